@@ -15,6 +15,12 @@ python manage.py collectstatic --no-input
 echo "==> Running database migrations..."
 python manage.py migrate --no-input
 
+echo "==> Filling sales financial summaries..."
+python manage.py recalcular_resumo_vendas --pendentes
+
+echo "==> Refreshing stock forecasts..."
+python manage.py recalcular_previsoes
+
 echo "==> Returning to root directory..."
 cd ..
 
@@ -43,6 +43,8 @@ ALLOWED_HOSTS = get_env_list('ALLOWED_HOSTS', '127.0.0.1,localhost,.onrender.com
 
 # Security Settings
 SECURE_SSL_REDIRECT = get_env_bool('SECURE_SSL_REDIRECT', not DEBUG)
+# Health checks do Render chegam por HTTP interno; não redirecionar para HTTPS
+SECURE_REDIRECT_EXEMPT = [r'^healthz$', r'^readyz$']
 SESSION_COOKIE_SECURE = get_env_bool('SESSION_COOKIE_SECURE', not DEBUG)
 CSRF_COOKIE_SECURE = get_env_bool('CSRF_COOKIE_SECURE', not DEBUG)
 SECURE_BROWSER_XSS_FILTER = True
@@ -73,6 +75,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'inventario.middleware.DesempenhoMiddleware',  # Queries por requisição (só com PERF_INSTRUMENTACAO)
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # Serve static files
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -122,11 +125,65 @@ if 'neon.tech' in DATABASE_URL:
 DATABASES = {
     'default': {
         **db_config,
-        'CONN_MAX_AGE': 600,  # Reutilizar conexões por 10 minutos
+        # Reutilizar conexões por 10 minutos; sob ASGI (uvicorn) use CONN_MAX_AGE=0,
+        # pois as conexões ficam presas às threads e não são reaproveitadas
+        'CONN_MAX_AGE': int(get_env('CONN_MAX_AGE', '600')),
         'CONN_HEALTH_CHECKS': True,  # Verificar saúde da conexão antes de reutilizar
     }
 }
 
+# SQLite: banco de testes em arquivo. O padrão em memória usa cache compartilhado,
+# em que até leituras falham com "database table is locked" enquanto outra conexão
+# grava, e os testes com caixas em paralelo ficavam intermitentes
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    DATABASES['default']['TEST'] = {'NAME': str(BASE_DIR / 'test_db.sqlite3')}
+
+
+# Cache
+# Padrão em memória do processo (locmem). Defina DASHBOARD_CACHE_DIR para usar
+# cache em arquivo, compartilhado entre os workers da mesma máquina.
+DASHBOARD_CACHE_DIR = get_env('DASHBOARD_CACHE_DIR')
+DASHBOARD_CACHE_TIMEOUT = int(get_env('DASHBOARD_CACHE_TIMEOUT', '600'))
+
+if DASHBOARD_CACHE_DIR:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': DASHBOARD_CACHE_DIR,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'estoque-default',
+        }
+    }
+
+
+# Quantidade de resultados do autocomplete de produtos (api/buscar-produtos/)
+BUSCA_PRODUTOS_LIMITE = int(get_env('BUSCA_PRODUTOS_LIMITE', '15'))
+# Autocomplete atendido pelo catálogo em memória de cada worker (refeito a cada CATALOGO_TTL segundos
+# ou quando produtos/lotes mudam); False consulta o banco a cada requisição
+CATALOGO_EM_MEMORIA = get_env_bool('CATALOGO_EM_MEMORIA', True)
+CATALOGO_TTL = int(get_env('CATALOGO_TTL', '300'))
+
+
+# Instrumentação de queries por requisição (inventario/desempenho.py, página /_perf/ para staff)
+PERF_INSTRUMENTACAO = get_env_bool('PERF_INSTRUMENTACAO', False)
+# Orçamento de queries por requisição; PERF_ORCAMENTOS define por view: "inventario:listar_produtos=12,..."
+PERF_ORCAMENTO_QUERIES = int(get_env('PERF_ORCAMENTO_QUERIES', '30'))
+PERF_ORCAMENTOS = {
+    view.strip(): int(limite)
+    for view, _, limite in (item.partition('=') for item in get_env_list('PERF_ORCAMENTOS'))
+    if limite.strip().isdigit()
+}
+# Requisições guardadas por view para o resumo (p50/p95)
+PERF_AMOSTRAS = int(get_env('PERF_AMOSTRAS', '500'))
+
+# Vezes que vendas, edições e devoluções são refeitas após deadlock/falha de serialização (inventario/concorrencia.py)
+RETENTATIVAS_TRANSACAO = int(get_env('RETENTATIVAS_TRANSACAO', '3'))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -1,5 +1,7 @@
 from django.contrib import admin
 from .models import Produto, Fornecedor, Lote, Venda, ItemVenda, ItemVendaLote, Configuracao
+from .vendas_diarias import atualizar_vendas_diarias
+from .estoque import ajustar_estoque, acumular_delta, recalcular_ultima_venda
 
 # Register your models here.
 
@@ -19,6 +21,33 @@ class VendaAdmin(admin.ModelAdmin):
     search_fields = ('id',)
     inlines = [ItemVendaInline]
 
+    def save_related(self, request, form, formsets, change):
+        produto_ids = set(form.instance.itens.values_list('produto_id', flat=True))
+        super().save_related(request, form, formsets, change)
+        # Itens editados pelo admin alteram o resumo financeiro gravado na venda
+        form.instance.atualizar_resumo()
+        # Se a data da venda mudou, o dia antigo também precisa ser refeito
+        data_anterior = form.initial.get('data') if change else None
+        if data_anterior:
+            atualizar_vendas_diarias([data_anterior])
+        # Data ou itens alterados mudam a última venda dos produtos (antigos e novos)
+        produto_ids.update(form.instance.itens.values_list('produto_id', flat=True))
+        recalcular_ultima_venda(produto_ids)
+
+    def delete_model(self, request, obj):
+        data_venda = obj.data
+        produto_ids = set(obj.itens.values_list('produto_id', flat=True))
+        super().delete_model(request, obj)
+        atualizar_vendas_diarias([data_venda])
+        recalcular_ultima_venda(produto_ids)
+
+    def delete_queryset(self, request, queryset):
+        datas = list(queryset.values_list('data', flat=True))
+        produto_ids = set(ItemVenda.objects.filter(venda__in=queryset).values_list('produto_id', flat=True))
+        super().delete_queryset(request, queryset)
+        atualizar_vendas_diarias(datas)
+        recalcular_ultima_venda(produto_ids)
+
 @admin.register(ItemVenda)
 class ItemVendaAdmin(admin.ModelAdmin):
     list_display = ('id', 'venda', 'produto', 'quantidade', 'preco_venda_unitario')
@@ -43,4 +72,27 @@ class LoteAdmin(admin.ModelAdmin):
     list_filter = ('produto', 'data_entrada')
     search_fields = ('produto__nome',)
 
+    # Lotes editados pelo admin também ajustam o estoque e o custo gravados no produto
+    def save_model(self, request, obj, form, change):
+        deltas = {}
+        if change:
+            anterior = Lote.objects.select_for_update().get(pk=obj.pk)
+            acumular_delta(deltas, anterior, -anterior.quantidade_atual)
+        super().save_model(request, obj, form, change)
+        acumular_delta(deltas, obj, obj.quantidade_atual)
+        ajustar_estoque(deltas)
+
+    def delete_model(self, request, obj):
+        deltas = {}
+        acumular_delta(deltas, obj, -obj.quantidade_atual)
+        super().delete_model(request, obj)
+        ajustar_estoque(deltas)
+
+    def delete_queryset(self, request, queryset):
+        deltas = {}
+        for lote in queryset.select_for_update().order_by('id'):
+            acumular_delta(deltas, lote, -lote.quantidade_atual)
+        super().delete_queryset(request, queryset)
+        ajustar_estoque(deltas)
+
 admin.site.register(Configuracao)
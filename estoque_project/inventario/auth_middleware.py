@@ -2,6 +2,7 @@
 Middleware de autenticação para proteger todas as views do sistema.
 Redireciona usuários não autenticados para a página de login.
 """
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 from django.shortcuts import redirect
 from django.conf import settings
 from django.urls import reverse
@@ -11,10 +12,17 @@ class LoginRequiredMiddleware:
     """
     Middleware que exige login para acessar qualquer página,
     exceto login, logout e arquivos estáticos.
+
+    Funciona também sob ASGI sem sair do event loop: o usuário é carregado
+    com request.auser().
     """
+    sync_capable = True
+    async_capable = True
     
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
         
         # URLs que não precisam de autenticação
         self.exempt_urls = [
@@ -27,24 +35,33 @@ class LoginRequiredMiddleware:
             '/manifest.webmanifest',
             '/sw.js',
             '/offline/',
+            '/healthz',
+            '/readyz',
         ]
     
     def __call__(self, request):
-        # Se o usuário já está autenticado, permite acesso
-        if request.user.is_authenticated:
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        # Se o usuário já está autenticado ou a URL é isenta, permite acesso
+        if request.user.is_authenticated or self.url_isenta(request.path_info):
             response = self.get_response(request)
             return response
         
-        # Verifica se a URL atual está na lista de exceções
-        path = request.path_info
-        
+        return self.redirecionar_login(request)
+
+    async def __acall__(self, request):
+        usuario = await request.auser()
+        if usuario.is_authenticated or self.url_isenta(request.path_info):
+            return await self.get_response(request)
+        return self.redirecionar_login(request)
+
+    def url_isenta(self, path):
         # Permite acesso a URLs isentas
-        for exempt_url in self.exempt_urls:
-            if path.startswith(exempt_url):
-                response = self.get_response(request)
-                return response
-        
+        return any(path.startswith(exempt_url) for exempt_url in self.exempt_urls)
+
+    def redirecionar_login(self, request):
         # Se não está autenticado e não é uma URL isenta, redireciona para login
         login_url = settings.LOGIN_URL
-        return redirect(f'{login_url}?next={path}')
+        return redirect(f'{login_url}?next={request.path_info}')
 
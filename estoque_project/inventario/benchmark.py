@@ -0,0 +1,194 @@
+"""
+Benchmark de queries e latência das telas principais sobre a loja sintética.
+
+Para cada escala (ESCALAS) a loja é gerada por dados_sinteticos.gerar_loja
+dentro de uma transação, cada cenário é executado `repeticoes` vezes pelo
+test client (rotas, middlewares e templates reais) e a transação é desfeita
+no final. Por cenário são registrados o máximo de queries (a primeira
+execução começa com o cache vazio) e a mediana e o máximo da latência.
+
+Os limites ficam em benchmark_baseline.json, versionado junto com o código:
+{"escalas": {escala: {cenário: {"queries": n, "ms": n}}}}. O número de
+queries é comparado exatamente; a latência, multiplicada pela tolerância,
+porque depende da máquina.
+"""
+import json
+import math
+import statistics
+import time
+import uuid
+from dataclasses import asdict
+from pathlib import Path
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .dados_sinteticos import gerar_loja
+from .models import Produto, Venda
+
+ARQUIVO_BASELINE = Path(__file__).with_name('benchmark_baseline.json')
+REPETICOES_PADRAO = 5
+# Folga gravada no baseline sobre a latência medida (máquinas diferentes, ruído)
+FOLGA_LATENCIA = 3
+LATENCIA_MINIMA_MS = 50
+
+ESCALAS = {
+    'pequena': {'produtos': 50, 'lotes_por_produto': 3, 'vendas': 500},
+    'media': {'produtos': 300, 'lotes_por_produto': 3, 'vendas': 5000},
+    'grande': {'produtos': 1500, 'lotes_por_produto': 4, 'vendas': 30000},
+}
+
+
+class ErroCenario(Exception):
+    pass
+
+
+def _get(nome, **parametros):
+    def executar(cliente, dados, repeticao):
+        return cliente.get(reverse(f'inventario:{nome}'), parametros, secure=True)
+    return executar
+
+
+def _criar_venda(cliente, dados, repeticao):
+    produtos = dados['produtos'][repeticao * 2:repeticao * 2 + 2]
+    resposta = cliente.post(
+        reverse('inventario:criar_venda'),
+        json.dumps({
+            'tipo_venda': 'LOJA',
+            'tipo_pagamento': 'CREDITO',
+            'parcelas': 2,
+            'itens': [{'id': produto_id, 'quantidade': 1} for produto_id in produtos],
+        }),
+        content_type='application/json',
+        secure=True,
+    )
+    if not resposta.json().get('sucesso'):
+        raise ErroCenario(resposta.json().get('erro'))
+    return resposta
+
+
+def _registrar_devolucao(cliente, dados, repeticao):
+    venda_id, item_id = dados['vendas'][repeticao]
+    resposta = cliente.post(
+        reverse('inventario:registrar_devolucao', args=[venda_id]),
+        {f'item_{item_id}': 1, 'motivo': 'Benchmark'},
+        secure=True,
+    )
+    if resposta.get('Location') != reverse('inventario:listar_devolucoes'):
+        raise ErroCenario(f'devolução da venda #{venda_id} não foi registrada')
+    return resposta
+
+
+CENARIOS = {
+    'dashboard': _get('dashboard'),
+    'listar_produtos': _get('listar_produtos'),
+    'listar_vendas': _get('listar_vendas'),
+    'buscar_produtos_json': _get('buscar_produtos_json', term='caneca'),
+    'buscar_produtos_listagem_json': _get('buscar_produtos_listagem_json', q='azul'),
+    'buscar_vendas_listagem_json': _get('buscar_vendas_listagem_json', q='ana'),
+    'buscar_devolucoes_listagem_json': _get('buscar_devolucoes_listagem_json'),
+    'analise_tendencias': _get('analise_tendencias'),
+    'criar_venda': _criar_venda,
+    'registrar_devolucao': _registrar_devolucao,
+}
+
+
+def _dados_cenarios(repeticoes):
+    """Produtos com estoque para as vendas e vendas sem devolução para as devoluções."""
+    produtos = list(Produto.objects.filter(
+        ativo=True, estoque_atual__gte=repeticoes
+    ).order_by('id').values_list('id', flat=True)[:repeticoes * 2])
+    vendas = [
+        (venda.pk, venda.itens.all()[0].pk)
+        for venda in Venda.objects.filter(possui_devolucao=False).prefetch_related('itens').order_by('-data')[:repeticoes]
+    ]
+    if len(produtos) < repeticoes * 2 or len(vendas) < repeticoes:
+        raise ErroCenario('loja sintética pequena demais para o número de repetições')
+    return {'produtos': produtos, 'vendas': vendas}
+
+
+def medir(cliente, executar, dados, repeticoes):
+    """Executa um cenário `repeticoes` vezes (começando com o cache vazio) e resume as medições."""
+    cache.clear()
+    queries = []
+    tempos = []
+    for repeticao in range(repeticoes):
+        with CaptureQueriesContext(connection) as consultas:
+            inicio = time.perf_counter()
+            resposta = executar(cliente, dados, repeticao)
+            tempos.append((time.perf_counter() - inicio) * 1000)
+        if resposta.status_code >= 400 or resposta.get('Location', '').startswith(reverse('login')):
+            raise ErroCenario(f'status {resposta.status_code}')
+        queries.append(len(consultas))
+    return {
+        'queries': max(queries),
+        'queries_min': min(queries),
+        'ms_mediana': round(statistics.median(tempos), 1),
+        'ms_max': round(max(tempos), 1),
+    }
+
+
+def medir_escala(parametros, repeticoes=REPETICOES_PADRAO, semente=42, cenarios=None):
+    """Gera a loja com `parametros` (ver gerar_loja), mede os cenários e desfaz tudo."""
+    with transaction.atomic():
+        loja = gerar_loja(semente=semente, **parametros)
+        usuario = get_user_model().objects.create_user(username=f'benchmark-{uuid.uuid4().hex[:8]}', is_staff=True)
+        cliente = Client()
+        cliente.force_login(usuario)
+        dados = _dados_cenarios(repeticoes)
+        resultados = {}
+        for nome, executar in CENARIOS.items():
+            if cenarios and nome not in cenarios:
+                continue
+            try:
+                resultados[nome] = medir(cliente, executar, dados, repeticoes)
+            except ErroCenario as erro:
+                resultados[nome] = {'erro': str(erro)}
+        transaction.set_rollback(True)
+    cache.clear()
+    return {'dados': asdict(loja), 'cenarios': resultados}
+
+
+def comparar(resultados, baseline, tolerancia=1.0):
+    """Lista de violações dos limites do baseline (cenários com erro também contam)."""
+    falhas = []
+    for escala, resultado in resultados.items():
+        limites = baseline.get('escalas', {}).get(escala, {})
+        for cenario, medida in resultado['cenarios'].items():
+            if 'erro' in medida:
+                falhas.append(f"{escala}/{cenario}: erro ({medida['erro']})")
+                continue
+            limite = limites.get(cenario)
+            if not limite:
+                continue
+            if medida['queries'] > limite['queries']:
+                falhas.append(f"{escala}/{cenario}: {medida['queries']} queries (limite {limite['queries']})")
+            if 'ms' in limite and medida['ms_mediana'] > limite['ms'] * tolerancia:
+                falhas.append(f"{escala}/{cenario}: {medida['ms_mediana']} ms (limite {limite['ms'] * tolerancia:g} ms)")
+    return falhas
+
+
+def gerar_baseline(resultados, baseline=None):
+    """Baseline com os limites medidos agora (mantém as escalas que não foram medidas)."""
+    baseline = {'escalas': dict((baseline or {}).get('escalas', {}))}
+    for escala, resultado in resultados.items():
+        baseline['escalas'][escala] = {
+            cenario: {
+                'queries': medida['queries'],
+                'ms': max(LATENCIA_MINIMA_MS, math.ceil(medida['ms_mediana'] * FOLGA_LATENCIA)),
+            }
+            for cenario, medida in resultado['cenarios'].items()
+            if 'erro' not in medida
+        }
+    return baseline
+
+
+def ler_baseline(caminho=ARQUIVO_BASELINE):
+    caminho = Path(caminho)
+    if not caminho.exists():
+        return {}
+    return json.loads(caminho.read_text(encoding='utf-8'))
@@ -0,0 +1,80 @@
+"""
+Busca de produtos por nome (autocomplete da tela de vendas e formulários).
+
+A busca compara o termo normalizado (minúsculas, sem acentos) com
+Produto.nome_normalizado: cada palavra digitada precisa aparecer no nome.
+No PostgreSQL o LIKE '%termo%' usa o índice GIN pg_trgm criado na migration
+0020 e os resultados também são ordenados pela similaridade de trigramas; no
+SQLite a mesma consulta roda sem índice. Tudo (ranking, limite e custo FIFO)
+sai em uma única query.
+"""
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, When, Value, IntegerField, DecimalField, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Length
+
+from .models import Produto, Lote, normalizar_texto
+
+LIMITE_MAXIMO = 50
+
+
+def limite_busca(valor=None):
+    """Limite de resultados: o pedido (se válido) ou BUSCA_PRODUTOS_LIMITE, até LIMITE_MAXIMO."""
+    padrao = getattr(settings, 'BUSCA_PRODUTOS_LIMITE', 15)
+    try:
+        limite = int(valor) if valor else padrao
+    except (TypeError, ValueError):
+        limite = padrao
+    return max(1, min(limite, LIMITE_MAXIMO))
+
+
+def anotar_custo_fifo(produtos):
+    """Anota custo_fifo: preço do lote mais antigo com saldo (0 se não houver)."""
+    return produtos.annotate(
+        custo_fifo=Coalesce(
+            Subquery(
+                Lote.objects.filter(
+                    produto=OuterRef('pk'),
+                    quantidade_atual__gt=0
+                ).order_by('data_entrada').values('preco_compra')[:1]
+            ),
+            Value(Decimal('0')),
+            output_field=DecimalField(max_digits=10, decimal_places=2),
+        )
+    )
+
+
+def buscar_produtos(termo, limite=None, produtos=None):
+    """
+    Produtos cujo nome contém todas as palavras do termo, ranqueados:
+    nome igual ao termo, nome começando pelo termo, palavra começando pelo
+    termo e, por fim, o termo no meio de uma palavra. Cada produto vem
+    anotado com custo_fifo.
+    """
+    if produtos is None:
+        produtos = Produto.objects.all()
+    termo_normalizado = normalizar_texto(termo)
+
+    for palavra in termo_normalizado.split():
+        produtos = produtos.filter(nome_normalizado__contains=palavra)
+
+    produtos = anotar_custo_fifo(produtos).annotate(
+        relevancia=Case(
+            When(nome_normalizado=termo_normalizado, then=Value(0)),
+            When(nome_normalizado__startswith=termo_normalizado, then=Value(1)),
+            When(nome_normalizado__contains=f' {termo_normalizado}', then=Value(2)),
+            default=Value(3),
+            output_field=IntegerField(),
+        )
+    )
+    ordenacao = ['relevancia']
+
+    if connection.vendor == 'postgresql' and termo_normalizado:
+        from django.contrib.postgres.search import TrigramSimilarity
+        produtos = produtos.annotate(similaridade=TrigramSimilarity('nome_normalizado', termo_normalizado))
+        ordenacao.append('-similaridade')
+
+    produtos = produtos.annotate(tamanho_nome=Length('nome')).order_by(*ordenacao, 'tamanho_nome', 'nome', 'pk')
+    return produtos[:limite_busca(limite)]
@@ -0,0 +1,95 @@
+"""
+Cache do contexto calculado do dashboard.
+
+O contexto é guardado no cache do Django (CACHES['default']) por período,
+intervalo de datas e data local. Em vez de apagar chaves uma a uma, a
+invalidação incrementa uma versão global: as chaves antigas deixam de ser
+lidas e expiram sozinhas pelo timeout.
+
+A versão e os contadores de acertos/falhas também ficam no cache, então são
+compartilhados entre processos quando o backend é compartilhado (arquivo) e
+por processo quando é locmem.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+CHAVE_VERSAO = 'dashboard:versao'
+CHAVE_ACERTOS = 'dashboard:acertos'
+CHAVE_FALHAS = 'dashboard:falhas'
+
+
+def _timeout():
+    return getattr(settings, 'DASHBOARD_CACHE_TIMEOUT', 600)
+
+
+def _versao():
+    versao = cache.get(CHAVE_VERSAO)
+    if versao is None:
+        cache.add(CHAVE_VERSAO, 1, timeout=None)
+        versao = cache.get(CHAVE_VERSAO, 1)
+    return versao
+
+
+def _contar(chave):
+    try:
+        cache.incr(chave)
+    except ValueError:
+        # Contador ainda não existe (ou expirou junto com o cache)
+        cache.add(chave, 0, timeout=None)
+        cache.incr(chave)
+
+
+def chave_dashboard(periodo, data_inicio, data_fim, hoje):
+    return f'dashboard:{_versao()}:{periodo}:{data_inicio.isoformat()}:{data_fim.isoformat()}:{hoje.isoformat()}'
+
+
+def obter_contexto(periodo, data_inicio, data_fim, hoje, calcular):
+    """
+    Retorna (contexto, acerto). Em caso de falha, chama `calcular()` e guarda o
+    resultado, que precisa ser serializável (listas em vez de QuerySets).
+    """
+    chave = chave_dashboard(periodo, data_inicio, data_fim, hoje)
+    contexto = cache.get(chave)
+    if contexto is not None:
+        _contar(CHAVE_ACERTOS)
+        return contexto, True
+
+    _contar(CHAVE_FALHAS)
+    contexto = calcular()
+    cache.set(chave, contexto, timeout=_timeout())
+    return contexto, False
+
+
+def invalidar_dashboard():
+    """Descarta todos os contextos em cache (incrementa a versão)."""
+    try:
+        cache.incr(CHAVE_VERSAO)
+    except ValueError:
+        cache.add(CHAVE_VERSAO, 1, timeout=None)
+
+
+def agendar_invalidacao():
+    """
+    Invalida o cache depois do commit da transação atual (ou imediatamente, fora
+    de transação), para que uma requisição concorrente não volte a guardar os
+    números de antes da alteração.
+    """
+    transaction.on_commit(invalidar_dashboard)
+
+
+def estatisticas():
+    """Acertos, falhas e taxa de acerto (%) do cache do dashboard."""
+    acertos = cache.get(CHAVE_ACERTOS, 0)
+    falhas = cache.get(CHAVE_FALHAS, 0)
+    total = acertos + falhas
+    return {
+        'acertos': acertos,
+        'falhas': falhas,
+        'taxa_acerto': round(acertos * 100 / total, 1) if total else 0,
+        'versao': cache.get(CHAVE_VERSAO, 1),
+    }
+
+
+def zerar_estatisticas():
+    cache.delete_many([CHAVE_ACERTOS, CHAVE_FALHAS])
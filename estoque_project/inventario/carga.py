@@ -0,0 +1,280 @@
+"""
+Simulação de carga do fluxo do caixa: buscar_produtos_json -> criar_venda ->
+detalhar_venda, com vários caixas simultâneos.
+
+Cada caixa é uma thread (ou, contra um servidor HTTP, também processos) com
+seu próprio cliente: o test client do Django, rodando as views neste processo
+sobre o banco configurado, ou um cliente HTTP com sessão e CSRF para um
+servidor em execução (gunicorn, runserver).
+
+Erros de lock (deadlock, "database is locked", timeout de lock, falha de
+serialização) são contados e a venda é reenviada, como faria o caixa, até
+TENTATIVAS_LOCK vezes. As vendas levam um marcador no nome do cliente para
+a reconciliação no final: cada lote precisa ter perdido exatamente o que os
+ItemVendaLote das vendas da simulação retiraram, cada item precisa estar
+coberto pelos seus lotes e os totais dos produtos precisam bater com os lotes.
+"""
+import http.cookiejar
+import json
+import random
+import statistics
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter
+from dataclasses import dataclass, field
+
+from django.db import connections
+from django.db.models import Sum
+from django.test import Client
+from django.urls import reverse
+
+from .estoque import verificar_estoque
+from .models import ItemVenda, ItemVendaLote, Lote
+
+TENTATIVAS_LOCK = 3
+TERMOS_BUSCA = ['ca', 'co', 'azul', 'preto', 'caneca', 'camiseta', 'garrafa', 'bo', 'es', 'ma']
+
+# Trechos das mensagens de erro (SQLite e PostgreSQL) -> tipo
+ERROS_LOCK = {
+    'deadlock': 'deadlock',
+    'database is locked': 'lock',
+    'database table is locked': 'lock',
+    'lock timeout': 'lock',
+    'could not obtain lock': 'lock',
+    'could not serialize': 'serializacao',
+}
+
+
+def classificar_erro(mensagem):
+    """Tipo do erro de lock contido na mensagem, ou None."""
+    mensagem = (mensagem or '').lower()
+    for trecho, tipo in ERROS_LOCK.items():
+        if trecho in mensagem:
+            return tipo
+    return None
+
+
+class ClienteLocal:
+    """Views deste processo pelo test client do Django (sem rede)."""
+
+    def __init__(self, usuario):
+        self.cliente = Client()
+        self.cliente.force_login(usuario)
+
+    def get(self, url, parametros=None):
+        resposta = self.cliente.get(url, parametros or {}, secure=True)
+        return resposta.status_code, resposta.content
+
+    def post_json(self, url, dados):
+        resposta = self.cliente.post(url, json.dumps(dados), content_type='application/json', secure=True)
+        return resposta.status_code, resposta.content
+
+    def fechar(self):
+        # Cada thread tem as suas conexões com o banco
+        connections.close_all()
+
+
+class ClienteHTTP:
+    """Servidor em execução, com login pela tela e o token CSRF da sessão."""
+
+    def __init__(self, base, usuario, senha):
+        self.base = base.rstrip('/')
+        self.cookies = http.cookiejar.CookieJar()
+        self.abridor = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies))
+        url_login = self.base + reverse('login')
+        self._abrir(url_login)
+        status, _ = self._abrir(url_login, urllib.parse.urlencode({
+            'username': usuario, 'password': senha, 'csrfmiddlewaretoken': self._csrf(),
+        }).encode(), {'Referer': url_login})
+        if not any(cookie.name == 'sessionid' for cookie in self.cookies):
+            raise ValueError(f'Login falhou em {url_login} (status {status}).')
+
+    def _csrf(self):
+        return next((cookie.value for cookie in self.cookies if cookie.name == 'csrftoken'), '')
+
+    def _abrir(self, url, corpo=None, cabecalhos=None):
+        requisicao = urllib.request.Request(url, data=corpo, headers=cabecalhos or {})
+        try:
+            with self.abridor.open(requisicao, timeout=60) as resposta:
+                return resposta.status, resposta.read()
+        except urllib.error.HTTPError as erro:
+            return erro.code, erro.read()
+
+    def get(self, url, parametros=None):
+        if parametros:
+            url = f'{url}?{urllib.parse.urlencode(parametros)}'
+        return self._abrir(self.base + url)
+
+    def post_json(self, url, dados):
+        return self._abrir(self.base + url, json.dumps(dados).encode(), {
+            'Content-Type': 'application/json',
+            'X-CSRFToken': self._csrf(),
+            'Referer': self.base + url,
+        })
+
+    def fechar(self):
+        pass
+
+
+@dataclass
+class ResultadoCaixa:
+    latencias: dict = field(default_factory=dict)  # etapa -> [ms]
+    vendas: int = 0
+    recusadas: Counter = field(default_factory=Counter)  # motivo -> quantidade
+    erros_lock: Counter = field(default_factory=Counter)  # tipo -> quantidade
+    retentativas: int = 0
+    limitadas: int = 0  # respostas 429 (rate limit)
+    erros: Counter = field(default_factory=Counter)  # etapa/status -> quantidade
+
+    def juntar(self, outro):
+        for etapa, valores in outro.latencias.items():
+            self.latencias.setdefault(etapa, []).extend(valores)
+        self.vendas += outro.vendas
+        self.recusadas.update(outro.recusadas)
+        self.erros_lock.update(outro.erros_lock)
+        self.retentativas += outro.retentativas
+        self.limitadas += outro.limitadas
+        self.erros.update(outro.erros)
+
+
+def _medir(resultado, etapa, chamada, aceita_400=False):
+    """Executa a chamada medindo a latência; `aceita_400` para recusas de negócio (estoque, preço)."""
+    inicio = time.perf_counter()
+    status, corpo = chamada()
+    resultado.latencias.setdefault(etapa, []).append((time.perf_counter() - inicio) * 1000)
+    if status == 429:
+        resultado.limitadas += 1
+    elif status >= 400 and not (aceita_400 and status == 400):
+        resultado.erros[f'{etapa}:{status}'] += 1
+    return status, corpo
+
+
+def _json(corpo):
+    try:
+        return json.loads(corpo)
+    except ValueError:
+        return None
+
+
+def _vender(cliente, resultado, dados):
+    """Envia a venda, repetindo em erro de lock. Retorna o id da venda ou None."""
+    for tentativa in range(TENTATIVAS_LOCK + 1):
+        status, corpo = _medir(
+            resultado, 'criar_venda', lambda: cliente.post_json(reverse('inventario:criar_venda'), dados), aceita_400=True
+        )
+        resposta = _json(corpo) or {}
+        if resposta.get('sucesso'):
+            resultado.vendas += 1
+            return resposta['venda_id']
+        erro = resposta.get('erro') or corpo[:200].decode(errors='replace')
+        tipo = classificar_erro(erro)
+        if tipo is None:
+            if status == 400:
+                resultado.recusadas[erro[:80]] += 1
+            return None
+        resultado.erros_lock[tipo] += 1
+        if tentativa < TENTATIVAS_LOCK:
+            resultado.retentativas += 1
+            time.sleep(0.01 * 2 ** tentativa)
+    return None
+
+
+def executar_caixa(cliente, iteracoes, semente, marcador, duracao=None):
+    """Um caixa: busca, vende de 1 a 3 produtos encontrados com estoque e abre a venda."""
+    aleatorio = random.Random(semente)
+    resultado = ResultadoCaixa()
+    limite = time.monotonic() + duracao if duracao else None
+    try:
+        for _ in range(iteracoes):
+            if limite and time.monotonic() >= limite:
+                break
+            status, corpo = _medir(resultado, 'buscar_produtos_json', lambda: cliente.get(
+                reverse('inventario:buscar_produtos_json'), {'term': aleatorio.choice(TERMOS_BUSCA)}
+            ))
+            encontrados = [produto for produto in (_json(corpo) or []) if produto.get('estoque', 0) > 0] if status == 200 else []
+            if not encontrados:
+                continue
+            itens = [
+                {'id': produto['id'], 'quantidade': min(produto['estoque'], aleatorio.randint(1, 2))}
+                for produto in aleatorio.sample(encontrados, min(len(encontrados), aleatorio.randint(1, 3)))
+            ]
+            venda_id = _vender(cliente, resultado, {
+                'cliente_nome': marcador,
+                'tipo_venda': aleatorio.choice(['LOJA', 'EXTERNA']),
+                'tipo_pagamento': aleatorio.choice(['DINHEIRO', 'PIX', 'DEBITO']),
+                'itens': itens,
+            })
+            if venda_id:
+                _medir(resultado, 'detalhar_venda', lambda: cliente.get(reverse('inventario:detalhar_venda', args=[venda_id])))
+    finally:
+        cliente.fechar()
+    return resultado
+
+
+def percentis(valores):
+    if not valores:
+        return {'n': 0}
+    ordenados = sorted(valores)
+
+    def percentil(p):
+        return round(ordenados[max(0, -(-len(ordenados) * p // 100) - 1)], 1)
+
+    return {
+        'n': len(ordenados),
+        'p50_ms': percentil(50),
+        'p95_ms': percentil(95),
+        'p99_ms': percentil(99),
+        'media_ms': round(statistics.fmean(ordenados), 1),
+        'max_ms': round(ordenados[-1], 1),
+    }
+
+
+def resumir(resultado, segundos):
+    requisicoes = sum(len(valores) for valores in resultado.latencias.values())
+    return {
+        'duracao_s': round(segundos, 2),
+        'vendas': resultado.vendas,
+        'vendas_por_s': round(resultado.vendas / segundos, 2) if segundos else 0,
+        'requisicoes_por_s': round(requisicoes / segundos, 2) if segundos else 0,
+        'latencias': {etapa: percentis(valores) for etapa, valores in resultado.latencias.items()},
+        'deadlocks': resultado.erros_lock.get('deadlock', 0),
+        'erros_lock': dict(resultado.erros_lock),
+        'retentativas': resultado.retentativas,
+        'limitadas_429': resultado.limitadas,
+        'recusadas': dict(resultado.recusadas),
+        'erros': dict(resultado.erros),
+    }
+
+
+def quantidades_lotes():
+    return dict(Lote.objects.values_list('id', 'quantidade_atual'))
+
+
+def reconciliar(antes, marcador):
+    """
+    Divergências depois da simulação (lista vazia = tudo bate), comparando as
+    quantidades dos lotes de `antes` com as retiradas das vendas do `marcador`.
+    """
+    divergencias = []
+    retiradas = dict(ItemVendaLote.objects.filter(
+        item_venda__venda__cliente_nome=marcador
+    ).values('lote_id').annotate(total=Sum('quantidade_retirada')).values_list('lote_id', 'total').order_by())
+    depois = quantidades_lotes()
+    for lote_id, quantidade in antes.items():
+        esperado = quantidade - retiradas.get(lote_id, 0)
+        if depois.get(lote_id) != esperado:
+            divergencias.append(f'Lote #{lote_id}: {depois.get(lote_id)} (esperado {esperado})')
+
+    for item in ItemVenda.objects.filter(venda__cliente_nome=marcador).annotate(
+        retirado=Sum('lotes_utilizados__quantidade_retirada')
+    ).values('id', 'quantidade', 'retirado'):
+        if item['retirado'] != item['quantidade']:
+            divergencias.append(f"ItemVenda #{item['id']}: {item['quantidade']} vendidos, {item['retirado']} retirados dos lotes")
+
+    for divergencia in verificar_estoque():
+        divergencias.append(
+            f"Produto #{divergencia['produto'].pk}: estoque {divergencia['estoque_registrado']}, lotes {divergencia['estoque_lotes']}"
+        )
+    return divergencias
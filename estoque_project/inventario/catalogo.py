@@ -0,0 +1,155 @@
+"""
+Catálogo de produtos em memória para o autocomplete da tela de vendas.
+
+Cada processo monta, com uma query, um snapshot dos produtos vendáveis
+(ativos e com preço): id, nome, nome normalizado, preço, estoque e custo FIFO.
+As buscas são atendidas a partir de um índice ordenado de sufixos que começam
+em início de palavra, consultado com bisect; só quando esses resultados não
+completam o limite os nomes são varridos procurando o termo no meio de uma
+palavra.
+
+O snapshot é versionado por um token guardado no cache do Django, trocado
+sempre que Produto ou Lote mudam (sinais e estoque.ajustar_estoque). Com
+locmem o token é por processo; para vários workers use o cache em arquivo
+(DASHBOARD_CACHE_DIR). Em qualquer caso o snapshot é refeito após
+CATALOGO_TTL segundos.
+
+`aobter_catalogo` é a versão para as views async: confere a versão com o
+cache assíncrono e só sai do event loop (para uma thread) quando o snapshot
+precisa ser refeito.
+"""
+import heapq
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .busca import anotar_custo_fifo, limite_busca
+from .models import Produto, normalizar_texto
+
+CHAVE_VERSAO = 'catalogo:versao'
+
+_lock = threading.Lock()
+_catalogo = None
+
+
+class Catalogo:
+    """Snapshot imutável dos produtos vendáveis com índice de busca"""
+
+    def __init__(self, produtos, versao):
+        self.versao = versao
+        self.construido_em = time.monotonic()
+        # (id, nome, nome_normalizado, preco_venda, estoque, custo_fifo)
+        self.produtos = produtos
+        self.nomes = [produto[2] for produto in produtos]
+        # Sufixos do nome a partir de cada início de palavra, ordenados: (sufixo, início, índice do produto)
+        sufixos = []
+        for indice, nome in enumerate(self.nomes):
+            inicio = 0
+            for palavra in nome.split(' '):
+                sufixos.append((nome[inicio:], inicio, indice))
+                inicio += len(palavra) + 1
+        sufixos.sort()
+        self.sufixos = sufixos
+        self.chaves_sufixos = [sufixo for sufixo, _, _ in sufixos]
+
+    def buscar(self, termo, limite=None):
+        """Mesma semântica e ordenação de busca.buscar_produtos (sem a similaridade do PostgreSQL)."""
+        limite = limite_busca(limite)
+        termo = normalizar_texto(termo)
+        palavras = termo.split()
+
+        relevancias = {}
+        posicao = bisect_left(self.chaves_sufixos, termo)
+        while posicao < len(self.sufixos) and self.chaves_sufixos[posicao].startswith(termo):
+            _, inicio, indice = self.sufixos[posicao]
+            if inicio == 0:
+                relevancia = 0 if self.nomes[indice] == termo else 1
+            else:
+                relevancia = 2
+            if relevancia < relevancias.get(indice, 4):
+                relevancias[indice] = relevancia
+            posicao += 1
+
+        # Termo no meio de uma palavra (ou palavras fora de ordem): só se faltarem resultados
+        if len(relevancias) < limite:
+            primeira, outras = (palavras[0], palavras[1:]) if palavras else ('', [])
+            for indice, nome in enumerate(self.nomes):
+                if primeira in nome and indice not in relevancias and all(palavra in nome for palavra in outras):
+                    relevancias[indice] = 3
+
+        def ordem(indice):
+            produto_id, nome = self.produtos[indice][:2]
+            return (relevancias[indice], len(nome), nome, produto_id)
+
+        return [self.produtos[indice] for indice in heapq.nsmallest(limite, relevancias, key=ordem)]
+
+
+def _versao_atual():
+    versao = cache.get(CHAVE_VERSAO)
+    if versao is None:
+        cache.add(CHAVE_VERSAO, uuid.uuid4().hex, timeout=None)
+        versao = cache.get(CHAVE_VERSAO)
+    return versao
+
+
+def linha_catalogo(produto):
+    """Tupla do catálogo para um Produto anotado com custo_fifo."""
+    return (
+        produto.id,
+        produto.nome,
+        produto.nome_normalizado,
+        produto.preco_venda,
+        produto.estoque_atual,
+        # O SQLite não devolve as casas decimais da anotação
+        produto.custo_fifo.quantize(Decimal('0.01')) if produto.custo_fifo else Decimal('0'),
+    )
+
+
+def _montar_catalogo(versao):
+    produtos = anotar_custo_fifo(
+        Produto.objects.filter(ativo=True).exclude(preco_venda__isnull=True)
+    ).only('id', 'nome', 'nome_normalizado', 'preco_venda', 'estoque_atual')
+    return Catalogo([linha_catalogo(produto) for produto in produtos.iterator(chunk_size=2000)], versao)
+
+
+def _atualizado(catalogo, versao):
+    ttl = getattr(settings, 'CATALOGO_TTL', 300)
+    return catalogo is not None and catalogo.versao == versao and time.monotonic() - catalogo.construido_em < ttl
+
+
+def obter_catalogo():
+    """Catálogo deste processo, refeito se a versão mudou ou o TTL expirou."""
+    global _catalogo
+    versao = _versao_atual()
+    catalogo = _catalogo
+    if _atualizado(catalogo, versao):
+        return catalogo
+    with _lock:
+        catalogo = _catalogo
+        if not _atualizado(catalogo, versao):
+            catalogo = _catalogo = _montar_catalogo(versao)
+    return catalogo
+
+
+async def aobter_catalogo():
+    """Versão async de `obter_catalogo`."""
+    catalogo = _catalogo
+    if catalogo is not None and _atualizado(catalogo, await cache.aget(CHAVE_VERSAO)):
+        return catalogo
+    return await sync_to_async(obter_catalogo)()
+
+
+def invalidar_catalogo():
+    cache.set(CHAVE_VERSAO, uuid.uuid4().hex, timeout=None)
+
+
+def agendar_invalidacao_catalogo():
+    """Troca a versão do catálogo depois do commit da transação atual."""
+    transaction.on_commit(invalidar_catalogo)
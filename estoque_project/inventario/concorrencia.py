@@ -0,0 +1,74 @@
+"""
+Retentativa das transações de estoque que falham por concorrência.
+
+Vendas, edições, exclusões e devoluções travam produtos e lotes sempre na
+mesma ordem (ver estoque.py), mas o banco ainda pode abortar uma delas: falha
+de serialização ou deadlock no PostgreSQL, "database is locked" no SQLite, ou
+um lote que mudou entre a leitura e a baixa (ConflitoEstoque), ou ainda uma
+chave única dos totais diários gravada por outra venda do mesmo dia (ver
+vendas_diarias.travar_dias; não deveria acontecer com a trava, mas refazer é
+seguro). Nesses casos a transação inteira é refeita do zero, até
+RETENTATIVAS_TRANSACAO vezes, com uma espera crescente e aleatória entre as
+tentativas.
+
+Uso (a função decorada abre a transação; não faz sentido repetir dentro de
+uma transação externa, então nesse caso o erro sobe direto):
+
+    @com_retentativa
+    @transaction.atomic
+    def gravar():
+        ...
+"""
+import functools
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connection
+
+from .estoque import ConflitoEstoque
+
+logger = logging.getLogger('inventario.concorrencia')
+
+# SQLSTATE: serialization_failure, deadlock_detected, lock_not_available
+CODIGOS_TRANSITORIOS = {'40001', '40P01', '55P03'}
+MENSAGENS_TRANSITORIAS = ('deadlock', 'database is locked', 'database table is locked', 'could not serialize')
+# Chaves únicas dos totais diários (PostgreSQL: nome da restrição; SQLite: tabela na mensagem)
+RESTRICOES_TRANSITORIAS = {'uniq_vendadiaria_data_tipo', 'uniq_vendadiariaprod_data_prod'}
+TABELAS_TRANSITORIAS = ('inventario_vendadiaria.', 'inventario_vendadiariaproduto.')
+ESPERA_INICIAL = 0.02
+ESPERA_MAXIMA = 0.5
+
+
+def erro_transitorio(erro):
+    """True se a transação que levantou `erro` pode ser refeita."""
+    if isinstance(erro, ConflitoEstoque):
+        return True
+    if not isinstance(erro, DatabaseError):
+        return False
+    causa = erro.__cause__
+    mensagem = str(erro).lower()
+    if isinstance(erro, IntegrityError):
+        restricao = getattr(getattr(causa, 'diag', None), 'constraint_name', None)
+        return restricao in RESTRICOES_TRANSITORIAS or any(tabela in mensagem for tabela in TABELAS_TRANSITORIAS)
+    codigo = getattr(causa, 'sqlstate', None) or getattr(causa, 'pgcode', None)
+    if codigo in CODIGOS_TRANSITORIOS:
+        return True
+    return any(trecho in mensagem for trecho in MENSAGENS_TRANSITORIAS)
+
+
+def com_retentativa(funcao):
+    """Refaz `funcao` (uma transação completa) quando ela falha por concorrência."""
+    @functools.wraps(funcao)
+    def executar(*args, **kwargs):
+        tentativas = getattr(settings, 'RETENTATIVAS_TRANSACAO', 3)
+        for tentativa in range(tentativas + 1):
+            try:
+                return funcao(*args, **kwargs)
+            except (DatabaseError, ConflitoEstoque) as erro:
+                if tentativa == tentativas or connection.in_atomic_block or not erro_transitorio(erro):
+                    raise
+                logger.info('%s: conflito de concorrência (%s), tentativa %d', funcao.__qualname__, erro, tentativa + 1)
+                time.sleep(min(ESPERA_MAXIMA, ESPERA_INICIAL * 2 ** tentativa) * random.uniform(0.5, 1.5))
+    return executar
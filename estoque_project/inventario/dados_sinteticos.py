@@ -0,0 +1,201 @@
+"""
+Gerador determinístico de uma loja sintética (benchmarks e testes de carga).
+
+Com a mesma semente gera sempre os mesmos fornecedores, produtos, lotes,
+vendas (com itens e lotes FIFO), devoluções e produtos chegando, espalhados
+pelos últimos `dias` dias. A baixa FIFO é simulada em memória e tudo é
+gravado com bulk_create; no final os resumos das vendas, os totais diários e
+os totais de estoque dos produtos são recalculados pelos mesmos serviços
+usados pelas telas, então os dados ficam consistentes (verificar_estoque
+não aponta divergências).
+"""
+import random
+from dataclasses import dataclass
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from .estoque import verificar_estoque
+from .models import (
+    Configuracao, Devolucao, Fornecedor, ItemDevolucao, ItemVenda, ItemVendaLote, Lote, Produto,
+    ProdutoChegando, Venda, normalizar_texto,
+)
+from .resumo_vendas import atualizar_resumo_vendas
+from .vendas_diarias import reconstruir_vendas_diarias
+
+TAMANHO_LOTE_GRAVACAO = 1000
+
+PALAVRAS = [
+    'Caneca', 'Camiseta', 'Boné', 'Chaveiro', 'Caderno', 'Caneta', 'Mochila', 'Garrafa', 'Adesivo', 'Copo',
+    'Ímã', 'Pulseira', 'Colar', 'Brinco', 'Agenda', 'Estojo', 'Toalha', 'Almofada', 'Luminária', 'Vela',
+]
+CORES = ['Azul', 'Vermelho', 'Verde', 'Preto', 'Branco', 'Rosa', 'Amarelo', 'Lilás', 'Café', 'Prata']
+CLIENTES = ['Ana', 'Bruno', 'Carla', 'Diego', 'Érica', 'Fábio', 'Gabriela', 'Hugo', 'Íris', 'João']
+
+
+@dataclass
+class LojaSintetica:
+    produtos: int
+    lotes: int
+    vendas: int
+    itens: int
+    devolucoes: int
+    produtos_chegando: int
+
+
+def gerar_loja(produtos=50, lotes_por_produto=3, vendas=500, dias=365, semente=42, taxa_devolucao=0.05):
+    """
+    Grava a loja sintética no banco atual e retorna as contagens (LojaSintetica).
+    Deve rodar em um banco vazio (ou descartável): não apaga nada antes.
+    """
+    aleatorio = random.Random(semente)
+    agora = timezone.now()
+    inicio = agora - timedelta(days=dias)
+    config, _ = Configuracao.objects.get_or_create()
+
+    with transaction.atomic():
+        fornecedores = Fornecedor.objects.bulk_create(
+            [Fornecedor(nome=f'Fornecedor {indice + 1}') for indice in range(max(1, produtos // 20))]
+        )
+
+        # bulk_create não chama save(): o nome normalizado é preenchido aqui
+        novos_produtos = []
+        for indice in range(produtos):
+            nome = f'{aleatorio.choice(PALAVRAS)} {aleatorio.choice(CORES)} {indice + 1}'
+            novos_produtos.append(Produto(
+                nome=nome,
+                nome_normalizado=normalizar_texto(nome),
+                fornecedor=aleatorio.choice(fornecedores),
+                preco_venda=Decimal(aleatorio.randint(1000, 15000)) / 100,
+                ativo=aleatorio.random() > 0.05,
+            ))
+        Produto.objects.bulk_create(novos_produtos, batch_size=TAMANHO_LOTE_GRAVACAO)
+        vendaveis = [produto for produto in novos_produtos if produto.ativo]
+
+        # Lotes antes da primeira venda, com quantidade para a demanda esperada do ano
+        demanda_media = max(1, vendas * 5 // max(1, len(vendaveis)))
+        novos_lotes = []
+        for produto in novos_produtos:
+            for numero in range(lotes_por_produto):
+                quantidade = aleatorio.randint(demanda_media // lotes_por_produto + 1, demanda_media + 10)
+                novos_lotes.append(Lote(
+                    produto=produto,
+                    quantidade_inicial=quantidade,
+                    quantidade_atual=quantidade,
+                    preco_compra=(produto.preco_venda * Decimal(aleatorio.randint(35, 70)) / 100).quantize(Decimal('0.01')),
+                    data_entrada=inicio - timedelta(days=lotes_por_produto - numero, minutes=produto.pk % 60),
+                ))
+        Lote.objects.bulk_create(novos_lotes, batch_size=TAMANHO_LOTE_GRAVACAO)
+        lotes_fifo = {}
+        for lote in novos_lotes:
+            lotes_fifo.setdefault(lote.produto_id, []).append(lote)
+
+        # Vendas em ordem cronológica, com a baixa FIFO simulada em memória
+        datas = sorted(inicio + timedelta(seconds=aleatorio.randint(0, dias * 86400 - 1)) for _ in range(vendas))
+        novas_vendas = []
+        itens_por_venda = []
+        for data in datas:
+            tipo_pagamento = aleatorio.choice(['DINHEIRO', 'PIX', 'DEBITO', 'CREDITO'])
+            parcelas = aleatorio.randint(1, 6) if tipo_pagamento == 'CREDITO' else 1
+            venda = Venda(
+                cliente_nome=aleatorio.choice(CLIENTES + [None]),
+                data=data,
+                tipo_venda=aleatorio.choice(['LOJA', 'EXTERNA']),
+                tipo_pagamento=tipo_pagamento,
+                parcelas=parcelas,
+                taxa_aplicada=config.get_taxa_pagamento(tipo_pagamento, parcelas),
+            )
+            itens = []
+            for produto in aleatorio.sample(vendaveis, min(len(vendaveis), aleatorio.randint(1, 4))):
+                quantidade = aleatorio.randint(1, 3)
+                disponiveis = [lote for lote in lotes_fifo[produto.pk] if lote.quantidade_atual]
+                if sum(lote.quantidade_atual for lote in disponiveis) < quantidade:
+                    continue
+                retiradas = []
+                restante = quantidade
+                for lote in disponiveis:
+                    retirada = min(lote.quantidade_atual, restante)
+                    lote.quantidade_atual -= retirada
+                    retiradas.append((lote, retirada))
+                    restante -= retirada
+                    if not restante:
+                        break
+                eh_brinde = aleatorio.random() < 0.03
+                itens.append((ItemVenda(
+                    produto=produto,
+                    quantidade=quantidade,
+                    preco_venda_unitario=Decimal('0.00') if eh_brinde else produto.preco_venda,
+                    custo_compra_total_registrado=sum(lote.preco_compra * retirada for lote, retirada in retiradas),
+                    eh_brinde=eh_brinde,
+                ), retiradas))
+            if itens:
+                novas_vendas.append(venda)
+                itens_por_venda.append(itens)
+        Venda.objects.bulk_create(novas_vendas, batch_size=TAMANHO_LOTE_GRAVACAO)
+
+        novos_itens = []
+        for venda, itens in zip(novas_vendas, itens_por_venda):
+            for item, _ in itens:
+                item.venda = venda
+                novos_itens.append(item)
+        ItemVenda.objects.bulk_create(novos_itens, batch_size=TAMANHO_LOTE_GRAVACAO)
+        ItemVendaLote.objects.bulk_create([
+            ItemVendaLote(item_venda=item, lote=lote, quantidade_retirada=retirada, preco_compra_lote=lote.preco_compra)
+            for itens in itens_por_venda
+            for item, retiradas in itens
+            for lote, retirada in retiradas
+        ], batch_size=TAMANHO_LOTE_GRAVACAO)
+
+        # Devoluções de uma unidade do primeiro item, de volta ao primeiro lote usado
+        novas_devolucoes = []
+        itens_devolvidos = []
+        for venda, itens in zip(novas_vendas, itens_por_venda):
+            if aleatorio.random() >= taxa_devolucao:
+                continue
+            item, retiradas = itens[0]
+            novas_devolucoes.append(Devolucao(
+                venda_original=venda,
+                data=min(agora, venda.data + timedelta(days=aleatorio.randint(1, 10))),
+                motivo='Defeito' if aleatorio.random() < 0.5 else 'Troca',
+            ))
+            retiradas[0][0].quantidade_atual += 1
+            itens_devolvidos.append(ItemDevolucao(
+                item_venda_original=item, quantidade=1, devolvido_ao_estoque=True,
+            ))
+        Devolucao.objects.bulk_create(novas_devolucoes, batch_size=TAMANHO_LOTE_GRAVACAO)
+        for devolucao, item_devolucao in zip(novas_devolucoes, itens_devolvidos):
+            item_devolucao.devolucao = devolucao
+            item_devolucao.data_retorno_estoque = devolucao.data
+        ItemDevolucao.objects.bulk_create(itens_devolvidos, batch_size=TAMANHO_LOTE_GRAVACAO)
+
+        Lote.objects.bulk_update(novos_lotes, ['quantidade_atual'], batch_size=TAMANHO_LOTE_GRAVACAO)
+        verificar_estoque(corrigir=True)
+
+        chegando = [
+            ProdutoChegando(
+                nome=produto.nome,
+                nome_normalizado=produto.nome_normalizado,
+                quantidade=aleatorio.randint(5, 50),
+                preco_compra=lotes_fifo[produto.pk][-1].preco_compra,
+                fornecedor=produto.fornecedor,
+                data_compra=(agora - timedelta(days=aleatorio.randint(0, 20))).date(),
+                produto_existente=produto if aleatorio.random() < 0.5 else None,
+            )
+            for produto in vendaveis[::10]
+        ]
+        ProdutoChegando.objects.bulk_create(chegando)
+
+        for indice in range(0, len(novas_vendas), TAMANHO_LOTE_GRAVACAO):
+            atualizar_resumo_vendas(novas_vendas[indice:indice + TAMANHO_LOTE_GRAVACAO])
+        reconstruir_vendas_diarias()
+
+    return LojaSintetica(
+        produtos=len(novos_produtos),
+        lotes=len(novos_lotes),
+        vendas=len(novas_vendas),
+        itens=len(novos_itens),
+        devolucoes=len(novas_devolucoes),
+        produtos_chegando=len(chegando),
+    )
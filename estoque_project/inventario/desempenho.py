@@ -0,0 +1,154 @@
+"""
+Instrumentação de queries por requisição (orçamento de queries por view).
+
+Ligada por PERF_INSTRUMENTACAO (desligada, o middleware nem entra na cadeia).
+Funciona sem DEBUG: as queries são medidas por connection.execute_wrapper,
+que registra o SQL (sem parâmetros) e a duração de cada execução.
+
+Para cada requisição são guardados o nome da view, a duração total, o
+número de queries, o tempo no banco e as queries repetidas — o mesmo SQL
+executado mais de uma vez, sinal típico de N+1. Quando o número de queries
+passa do orçamento da view (PERF_ORCAMENTOS, ou PERF_ORCAMENTO_QUERIES para
+as demais) é registrado um aviso no log.
+
+O resumo (p50/p95 e queries por view) cobre as últimas PERF_AMOSTRAS
+requisições de cada view e fica na memória do processo: com vários workers,
+cada um tem o seu.
+"""
+import logging
+import re
+import threading
+import time
+from collections import Counter, defaultdict, deque
+
+from django.conf import settings
+
+logger = logging.getLogger('inventario.desempenho')
+
+DUPLICADAS_POR_VIEW = 10
+
+_lock = threading.Lock()
+_amostras = defaultdict(deque)  # view -> deque[(duração ms, queries, tempo no banco ms, repetidas)]
+_duplicadas = defaultdict(Counter)  # view -> Counter[impressão digital do SQL]
+_estouros = Counter()  # view -> requisições acima do orçamento
+
+_RE_LISTA_IN = re.compile(r'IN \((?:%s, )*%s\)')
+_RE_NUMERO = re.compile(r'\b\d+\b')
+_RE_TEXTO = re.compile(r"'[^']*'")
+_RE_ESPACOS = re.compile(r'\s+')
+
+
+def impressao_digital(sql):
+    """SQL normalizado: listas IN de qualquer tamanho, números e textos literais viram marcadores."""
+    sql = _RE_ESPACOS.sub(' ', sql).strip()
+    sql = _RE_LISTA_IN.sub('IN (...)', sql)
+    sql = _RE_TEXTO.sub("'?'", sql)
+    return _RE_NUMERO.sub('?', sql)
+
+
+class Medicao:
+    """Queries de uma requisição; instalada com connection.execute_wrapper(medicao)."""
+
+    def __init__(self):
+        self.queries = 0
+        self.tempo_banco = 0.0
+        self.impressoes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.tempo_banco += time.perf_counter() - inicio
+            self.queries += 1
+            self.impressoes[sql] += 1
+
+    def repetidas(self):
+        """{impressão digital: execuções} das queries executadas mais de uma vez."""
+        agrupadas = Counter()
+        for sql, vezes in self.impressoes.items():
+            agrupadas[impressao_digital(sql)] += vezes
+        return {sql: vezes for sql, vezes in agrupadas.items() if vezes > 1}
+
+
+def orcamento(view):
+    """Máximo de queries da view (None = sem orçamento)."""
+    limite = getattr(settings, 'PERF_ORCAMENTOS', {}).get(view, getattr(settings, 'PERF_ORCAMENTO_QUERIES', None))
+    return limite or None
+
+
+def registrar(view, duracao, medicao):
+    """Guarda a amostra da requisição e avisa no log se passou do orçamento. Durações em segundos."""
+    repetidas = medicao.repetidas()
+    limite = orcamento(view)
+    estourou = limite is not None and medicao.queries > limite
+    maximo = getattr(settings, 'PERF_AMOSTRAS', 500)
+    with _lock:
+        amostras = _amostras[view]
+        if amostras.maxlen != maximo:
+            amostras = _amostras[view] = deque(amostras, maxlen=maximo)
+        amostras.append((duracao * 1000, medicao.queries, medicao.tempo_banco * 1000, sum(repetidas.values())))
+        duplicadas = _duplicadas[view]
+        duplicadas.update(repetidas)
+        if len(duplicadas) > DUPLICADAS_POR_VIEW * 2:
+            _duplicadas[view] = Counter(dict(duplicadas.most_common(DUPLICADAS_POR_VIEW)))
+        if estourou:
+            _estouros[view] += 1
+    if estourou:
+        pior = max(repetidas.items(), key=lambda item: item[1], default=None)
+        logger.warning(
+            'Orçamento de queries excedido em %s: %d queries (limite %d), %.1f ms no banco%s',
+            view, medicao.queries, limite, medicao.tempo_banco * 1000,
+            f'; repetida {pior[1]}x: {pior[0][:200]}' if pior else '',
+        )
+
+
+def server_timing(duracao, medicao):
+    """Valor do cabeçalho Server-Timing (durações em segundos)."""
+    return (
+        f'db;dur={medicao.tempo_banco * 1000:.1f};desc="{medicao.queries} queries", '
+        f'total;dur={duracao * 1000:.1f}'
+    )
+
+
+def _percentil(valores, percentil):
+    """Percentil por posição mais próxima de uma lista ordenada."""
+    posicao = max(0, -(-len(valores) * percentil // 100) - 1)
+    return valores[int(posicao)]
+
+
+def resumo():
+    """Uma linha por view, da que mais consome banco para a que menos."""
+    with _lock:
+        copia = {view: list(amostras) for view, amostras in _amostras.items()}
+        duplicadas = {view: contador.most_common(3) for view, contador in _duplicadas.items()}
+        estouros = dict(_estouros)
+    linhas = []
+    for view, amostras in copia.items():
+        if not amostras:
+            continue
+        duracoes = sorted(amostra[0] for amostra in amostras)
+        queries = [amostra[1] for amostra in amostras]
+        total = len(amostras)
+        linhas.append({
+            'view': view,
+            'requisicoes': total,
+            'p50_ms': round(_percentil(duracoes, 50), 1),
+            'p95_ms': round(_percentil(duracoes, 95), 1),
+            'queries_media': round(sum(queries) / total, 1),
+            'queries_max': max(queries),
+            'banco_medio_ms': round(sum(amostra[2] for amostra in amostras) / total, 1),
+            'repetidas_media': round(sum(amostra[3] for amostra in amostras) / total, 1),
+            'orcamento': orcamento(view),
+            'estouros': estouros.get(view, 0),
+            'duplicadas': duplicadas.get(view, []),
+        })
+    linhas.sort(key=lambda linha: linha['banco_medio_ms'] * linha['requisicoes'], reverse=True)
+    return linhas
+
+
+def zerar():
+    with _lock:
+        _amostras.clear()
+        _duplicadas.clear()
+        _estouros.clear()
@@ -0,0 +1,151 @@
+"""
+Devoluções de vendas com restauração dos lotes em lote.
+
+As quantidades já devolvidas de todos os itens da venda vêm de uma query
+agrupada, os ItemDevolucao são gravados com bulk_create e as unidades voltam
+aos lotes de onde saíram (mesma ordem FIFO da venda) com um único UPDATE
+condicional (estoque.repor_lotes). `devolver_tudo` devolve o saldo de todos
+os itens da venda de uma vez (estorno total).
+
+A venda (ou os itens de devolução) ficam travados até o fim da transação, que
+é refeita em caso de deadlock ou falha de serialização (ver concorrencia.py).
+"""
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .concorrencia import com_retentativa
+from .estoque import criar_lote, repor_lotes
+from .models import Devolucao, ItemDevolucao, ItemVendaLote, Lote, Venda
+
+
+def quantidades_devolvidas(itens):
+    """{item_venda_id: quantidade já devolvida} dos itens, em uma query."""
+    return dict(ItemDevolucao.objects.filter(item_venda_original__in=itens).values('item_venda_original_id').annotate(
+        total=Sum('quantidade')
+    ).values_list('item_venda_original_id', 'total').order_by())
+
+
+def itens_para_devolucao(venda):
+    """Itens da venda com o saldo que ainda pode ser devolvido: [{'item', 'max_para_devolver'}]."""
+    itens = list(venda.itens.select_related('produto').order_by('id'))
+    devolvidas = quantidades_devolvidas(itens)
+    return [
+        {'item': item, 'max_para_devolver': item.quantidade - devolvidas.get(item.pk, 0)}
+        for item in itens
+    ]
+
+
+def distribuir_nos_lotes(quantidades_por_item):
+    """
+    Distribui {item_venda_id: quantidade} pelos lotes de onde os itens saíram,
+    na ordem em que foram retirados. Retorna ({lote_id: quantidade}, {item_venda_id:
+    quantidade sem rastreamento FIFO}), este para vendas antigas sem ItemVendaLote.
+    """
+    restantes = dict(quantidades_por_item)
+    por_lote = {}
+    rastreados = set()
+    for lote_usado in ItemVendaLote.objects.filter(item_venda_id__in=restantes).order_by('item_venda_id', 'id').values(
+        'item_venda_id', 'lote_id', 'quantidade_retirada'
+    ):
+        rastreados.add(lote_usado['item_venda_id'])
+        quantidade = min(restantes[lote_usado['item_venda_id']], lote_usado['quantidade_retirada'])
+        if quantidade <= 0:
+            continue
+        por_lote[lote_usado['lote_id']] = por_lote.get(lote_usado['lote_id'], 0) + quantidade
+        restantes[lote_usado['item_venda_id']] -= quantidade
+    sem_rastreio = {pk: quantidade for pk, quantidade in restantes.items() if pk not in rastreados and quantidade > 0}
+    return por_lote, sem_rastreio
+
+
+@com_retentativa
+@transaction.atomic
+def registrar_devolucao(venda_id, quantidades=None, motivo='', devolver_tudo=False):
+    """
+    Registra a devolução de {item_venda_id: quantidade} da venda (ou, com
+    `devolver_tudo`, do saldo de todos os itens) e devolve as unidades aos lotes.
+    Retorna a Devolucao, ou None se não houver nada a devolver. Levanta
+    ValueError quando a quantidade passa do que ainda pode ser devolvido.
+    """
+    quantidades = quantidades or {}
+    # Trava a venda: devoluções simultâneas da mesma venda são validadas uma de cada vez
+    venda = Venda.objects.select_for_update().get(pk=venda_id)
+
+    a_devolver = []
+    for linha in itens_para_devolucao(venda):
+        item, saldo = linha['item'], linha['max_para_devolver']
+        quantidade = saldo if devolver_tudo else quantidades.get(item.pk, 0)
+        if quantidade <= 0:
+            continue
+        if quantidade > saldo:
+            raise ValueError(f"Quantidade a devolver para '{item.produto.nome}' é maior que a permitida.")
+        a_devolver.append((item, quantidade))
+    if not a_devolver:
+        return None
+
+    agora = timezone.now()
+    devolucao = Devolucao.objects.create(venda_original=venda, motivo=motivo)
+    ItemDevolucao.objects.bulk_create([
+        ItemDevolucao(
+            devolucao=devolucao,
+            item_venda_original=item,
+            quantidade=quantidade,
+            devolvido_ao_estoque=True,
+            data_retorno_estoque=agora,
+        )
+        for item, quantidade in a_devolver
+    ])
+
+    por_lote, sem_rastreio = distribuir_nos_lotes({item.pk: quantidade for item, quantidade in a_devolver})
+    if sem_rastreio:
+        # Vendas antigas sem rastreamento FIFO: volta para o lote mais recente do produto
+        produtos = {item.pk: item.produto_id for item, _ in a_devolver}
+        mais_recentes = {}
+        for lote_id, produto_id in Lote.objects.filter(produto_id__in=set(produtos.values())).order_by(
+            'produto_id', '-data_entrada', '-id'
+        ).values_list('id', 'produto_id'):
+            mais_recentes.setdefault(produto_id, lote_id)
+        for item_id, quantidade in sem_rastreio.items():
+            lote_id = mais_recentes.get(produtos[item_id])
+            if lote_id:
+                por_lote[lote_id] = por_lote.get(lote_id, 0) + quantidade
+    repor_lotes(por_lote)
+
+    venda.atualizar_resumo()
+    return devolucao
+
+
+@com_retentativa
+@transaction.atomic
+def retornar_ao_estoque(item_ids):
+    """
+    Devolve aos lotes de origem os ItemDevolucao informados que ainda não
+    voltaram ao estoque (sem rastreamento FIFO, cria um lote com o custo médio
+    do item vendido). Retorna os itens retornados.
+    """
+    itens = list(ItemDevolucao.objects.select_for_update().filter(
+        pk__in=item_ids, devolvido_ao_estoque=False
+    ).select_related('item_venda_original__produto').order_by('id'))
+    if not itens:
+        return []
+
+    quantidades_por_item = {}
+    for item in itens:
+        quantidades_por_item[item.item_venda_original_id] = quantidades_por_item.get(item.item_venda_original_id, 0) + item.quantidade
+    por_lote, sem_rastreio = distribuir_nos_lotes(quantidades_por_item)
+    repor_lotes(por_lote)
+
+    vendidos = {item.item_venda_original_id: item.item_venda_original for item in itens}
+    for item_venda_id, quantidade in sem_rastreio.items():
+        item_venda = vendidos[item_venda_id]
+        if item_venda.custo_compra_total_registrado and item_venda.quantidade > 0:
+            preco_compra_unitario = item_venda.custo_compra_total_registrado / item_venda.quantidade
+        else:
+            preco_compra_unitario = 0
+        criar_lote(item_venda.produto, quantidade, preco_compra_unitario, data_entrada=timezone.now())
+
+    ItemDevolucao.objects.filter(pk__in=[item.pk for item in itens]).update(
+        devolvido_ao_estoque=True,
+        data_retorno_estoque=timezone.now(),
+    )
+    return itens
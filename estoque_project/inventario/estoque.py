@@ -0,0 +1,267 @@
+"""
+Manutenção dos totais de estoque desnormalizados em Produto.
+
+`Produto.estoque_atual` e `Produto.custo_estoque` espelham a soma dos lotes
+(quantidade_atual e quantidade_atual * preco_compra). Toda alteração de lote
+deve passar por aqui para que os totais sejam ajustados na mesma transação,
+sempre com expressões F() (sem ler-modificar-gravar).
+
+Quantidades de lotes mudam por `movimentar_lotes`, também com F(): as baixas
+são condicionais (só acontecem se o lote ainda tiver a quantidade) e as
+linhas são travadas antes por `travar_lotes`/fifo.carregar_estoque, sempre
+na mesma ordem — produtos por id e depois lotes por id — para que operações
+concorrentes esperem umas pelas outras em vez de entrar em deadlock.
+
+As datas do relatório de produtos parados também ficam em Produto:
+`estoque_desde` (entrada do lote mais antigo com saldo) é refeita no mesmo
+UPDATE de ajustar_estoque e `ultima_venda_em` acompanha as vendas
+(registrar_ultima_venda / recalcular_ultima_venda).
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Sum, F, Q, Case, When, Value, IntegerField, DecimalField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .cache_dashboard import agendar_invalidacao
+from .catalogo import agendar_invalidacao_catalogo
+from .models import Produto, Lote, ItemVenda, ProdutoChegando
+
+
+def ajustar_estoque(deltas):
+    """
+    Soma as variações de estoque aos totais dos produtos em um único UPDATE.
+
+    `deltas` é um dicionário {produto_id: (quantidade, custo)}; valores negativos
+    representam baixas.
+    """
+    deltas = {pk: (quantidade, custo) for pk, (quantidade, custo) in deltas.items() if quantidade or custo}
+    if not deltas:
+        return
+    agendar_invalidacao()
+    agendar_invalidacao_catalogo()
+
+    if len(deltas) == 1:
+        [(pk, (quantidade, custo))] = deltas.items()
+        Produto.objects.filter(pk=pk).update(
+            estoque_atual=F('estoque_atual') + quantidade,
+            custo_estoque=F('custo_estoque') + custo,
+            estoque_desde=_lote_mais_antigo(),
+        )
+        return
+
+    Produto.objects.filter(pk__in=deltas.keys()).update(
+        estoque_atual=F('estoque_atual') + Case(
+            *[When(pk=pk, then=Value(quantidade)) for pk, (quantidade, _) in deltas.items()],
+            default=Value(0),
+            output_field=IntegerField()
+        ),
+        custo_estoque=F('custo_estoque') + Case(
+            *[When(pk=pk, then=Value(custo)) for pk, (_, custo) in deltas.items()],
+            default=Value(Decimal('0.00')),
+            output_field=DecimalField(max_digits=12, decimal_places=2)
+        ),
+        estoque_desde=_lote_mais_antigo(),
+    )
+
+
+def _lote_mais_antigo():
+    """Subquery: entrada do lote mais antigo com saldo do produto (None se não houver)."""
+    return Subquery(Lote.objects.filter(
+        produto=OuterRef('pk'), quantidade_atual__gt=0
+    ).order_by('data_entrada').values('data_entrada')[:1])
+
+
+def _ultima_venda():
+    """Subquery: data da venda mais recente com o produto (None se nunca foi vendido)."""
+    return Subquery(ItemVenda.objects.filter(
+        produto=OuterRef('pk')
+    ).order_by('-venda__data').values('venda__data')[:1])
+
+
+def registrar_ultima_venda(produto_ids, data):
+    """Avança ultima_venda_em dos produtos para `data` (vendas novas), em um UPDATE."""
+    Produto.objects.filter(
+        Q(ultima_venda_em__isnull=True) | Q(ultima_venda_em__lt=data), pk__in=set(produto_ids)
+    ).update(ultima_venda_em=data)
+
+
+def recalcular_ultima_venda(produto_ids):
+    """Refaz ultima_venda_em pelos itens vendidos (depois de excluir ou editar vendas)."""
+    produto_ids = set(produto_ids)
+    if produto_ids:
+        Produto.objects.filter(pk__in=produto_ids).update(ultima_venda_em=_ultima_venda())
+
+
+def recalcular_datas_produtos(produto_ids=None):
+    """Refaz ultima_venda_em e estoque_desde a partir das vendas e dos lotes."""
+    produtos = Produto.objects.all()
+    if produto_ids is not None:
+        produtos = produtos.filter(pk__in=produto_ids)
+    return produtos.update(ultima_venda_em=_ultima_venda(), estoque_desde=_lote_mais_antigo())
+
+
+def produtos_parados(desde_antes_de=None):
+    """
+    Produtos ativos com estoque anotados com `parado_desde` (última venda ou,
+    se nunca foram vendidos, entrada do lote mais antigo com saldo), do mais
+    parado para o menos; com `desde_antes_de`, só os parados antes desse
+    instante. Atendido pelo índice parcial idx_produto_parado.
+    """
+    produtos = Produto.objects.filter(ativo=True, estoque_atual__gt=0).annotate(
+        parado_desde=Coalesce('ultima_venda_em', 'estoque_desde')
+    ).filter(parado_desde__isnull=False)
+    if desde_antes_de is not None:
+        produtos = produtos.filter(parado_desde__lt=desde_antes_de)
+    return produtos.order_by('parado_desde', 'id')
+
+
+class ConflitoEstoque(Exception):
+    """Um lote não tinha mais a quantidade esperada; a transação deve ser refeita."""
+
+
+def travar_lotes(lote_ids):
+    """
+    Trava os produtos dos lotes e os lotes (SELECT ... FOR UPDATE, em ordem de id)
+    até o fim da transação. Retorna {lote_id: lote}.
+    """
+    lote_ids = sorted(set(lote_ids))
+    if not lote_ids:
+        return {}
+    produto_ids = Lote.objects.filter(pk__in=lote_ids).values('produto_id')
+    list(Produto.objects.select_for_update().filter(pk__in=produto_ids).order_by('id').only('id'))
+    return {lote.pk: lote for lote in Lote.objects.select_for_update().filter(pk__in=lote_ids).order_by('id')}
+
+
+def movimentar_lotes(variacoes):
+    """
+    Aplica {lote_id: variação} às quantidades dos lotes em um único UPDATE com F().
+    Baixas só são aplicadas se o lote ainda tiver a quantidade; se alguma linha
+    não for atualizada levanta ConflitoEstoque (e a transação é desfeita).
+    Não mexe nos totais dos produtos (ver ajustar_estoque).
+    """
+    variacoes = {pk: quantidade for pk, quantidade in variacoes.items() if quantidade}
+    if not variacoes:
+        return
+    condicao = Q()
+    for pk, quantidade in variacoes.items():
+        condicao |= Q(pk=pk, quantidade_atual__gte=-quantidade) if quantidade < 0 else Q(pk=pk)
+    atualizados = Lote.objects.filter(condicao).update(quantidade_atual=F('quantidade_atual') + Case(
+        *[When(pk=pk, then=Value(quantidade)) for pk, quantidade in variacoes.items()],
+        default=Value(0),
+        output_field=IntegerField()
+    ))
+    if atualizados != len(variacoes):
+        raise ConflitoEstoque('O estoque de um lote mudou durante a operação.')
+
+
+def acumular_delta(deltas, lote, quantidade):
+    """Acumula em `deltas` a variação de `quantidade` unidades de um lote."""
+    quantidade_atual, custo_atual = deltas.get(lote.produto_id, (0, Decimal('0.00')))
+    deltas[lote.produto_id] = (quantidade_atual + quantidade, custo_atual + quantidade * lote.preco_compra)
+
+
+def repor_lotes(quantidades_por_lote):
+    """
+    Devolve {lote_id: quantidade} aos lotes, travando-os antes, e soma as
+    quantidades e custos aos totais dos produtos. Lotes que não existem mais
+    são ignorados.
+    """
+    lotes = travar_lotes(quantidades_por_lote)
+    quantidades_por_lote = {pk: quantidade for pk, quantidade in quantidades_por_lote.items() if pk in lotes}
+    deltas = {}
+    for pk, quantidade in quantidades_por_lote.items():
+        acumular_delta(deltas, lotes[pk], quantidade)
+    movimentar_lotes(quantidades_por_lote)
+    ajustar_estoque(deltas)
+
+
+def criar_lote(produto, quantidade, preco_compra, **campos):
+    """Cria um lote novo e soma sua quantidade e custo aos totais do produto."""
+    preco_compra = Decimal(str(preco_compra)).quantize(Decimal('0.01'))
+    with transaction.atomic():
+        lote = Lote.objects.create(
+            produto=produto,
+            quantidade_inicial=quantidade,
+            quantidade_atual=quantidade,
+            preco_compra=preco_compra,
+            **campos
+        )
+        ajustar_estoque({produto.pk: (quantidade, quantidade * preco_compra)})
+    return lote
+
+
+def anotar_quantidade_chegando(produtos):
+    """
+    Anota qtd_chegando: soma dos ProdutoChegando pendentes vinculados ao produto
+    (produto_existente) mais os sem vínculo com o mesmo nome normalizado, estes
+    só para produtos ativos — a mesma regra usada ao incluir no estoque. São dois
+    subqueries agrupados, cada um atendido por um índice.
+    """
+    pendentes = ProdutoChegando.objects.filter(incluido_estoque=False).order_by()
+    vinculados = pendentes.filter(produto_existente=OuterRef('pk')).values('produto_existente').annotate(
+        total=Sum('quantidade')
+    ).values('total')
+    mesmo_nome = pendentes.filter(
+        produto_existente__isnull=True, nome_normalizado=OuterRef('nome_normalizado')
+    ).values('nome_normalizado').annotate(total=Sum('quantidade')).values('total')
+    return produtos.annotate(
+        qtd_chegando=Coalesce(Subquery(vinculados), 0) + Case(
+            When(ativo=True, then=Coalesce(Subquery(mesmo_nome), 0)),
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+    )
+
+
+def totais_pelos_lotes(produto_ids=None):
+    """Retorna {produto_id: (quantidade, custo)} calculado diretamente dos lotes."""
+    lotes = Lote.objects.all()
+    if produto_ids is not None:
+        lotes = lotes.filter(produto_id__in=produto_ids)
+
+    totais = defaultdict(lambda: (0, Decimal('0.00')))
+    for linha in lotes.values('produto_id').annotate(
+        quantidade=Sum('quantidade_atual'),
+        custo=Sum(F('quantidade_atual') * F('preco_compra'))
+    ).order_by():
+        totais[linha['produto_id']] = (linha['quantidade'] or 0, linha['custo'] or Decimal('0.00'))
+    return totais
+
+
+def verificar_estoque(produto_ids=None, corrigir=False):
+    """
+    Compara os totais desnormalizados com a soma dos lotes.
+
+    Retorna a lista de divergências como dicionários e, se `corrigir` for True,
+    grava os valores corretos (e refaz as datas dos produtos parados).
+    """
+    totais = totais_pelos_lotes(produto_ids)
+    produtos = Produto.objects.only('id', 'nome', 'estoque_atual', 'custo_estoque').order_by('id')
+    if produto_ids is not None:
+        produtos = produtos.filter(pk__in=produto_ids)
+
+    divergencias = []
+    produtos_corrigidos = []
+    for produto in produtos.iterator(chunk_size=2000):
+        quantidade, custo = totais[produto.pk]
+        if produto.estoque_atual == quantidade and produto.custo_estoque == custo:
+            continue
+        divergencias.append({
+            'produto': produto,
+            'estoque_registrado': produto.estoque_atual,
+            'estoque_lotes': quantidade,
+            'custo_registrado': produto.custo_estoque,
+            'custo_lotes': custo,
+        })
+        produto.estoque_atual = quantidade
+        produto.custo_estoque = custo
+        produtos_corrigidos.append(produto)
+
+    if corrigir and produtos_corrigidos:
+        Produto.objects.bulk_update(produtos_corrigidos, ['estoque_atual', 'custo_estoque'], batch_size=500)
+    if corrigir:
+        recalcular_datas_produtos(produto_ids)
+
+    return divergencias
@@ -0,0 +1,136 @@
+"""
+Exportação das vendas em CSV com o detalhe de itens e lotes (para a contabilidade).
+
+Uma linha por lote consumido de cada item de venda (ItemVenda sem lote
+registrado sai em uma linha com as colunas do lote vazias). As linhas vêm de
+uma única query com values() percorrida por iterator(chunk_size=...) — no
+PostgreSQL com cursor no servidor — e são escritas à medida que são lidas, de
+modo que a memória não cresce com o período exportado.
+
+O CSV segue o padrão do Excel em português: separador ';', vírgula decimal
+e BOM UTF-8 no início.
+"""
+import csv
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ItemVenda
+
+TAMANHO_LOTE_LEITURA = 2000
+
+COLUNAS = [
+    'venda_id', 'data', 'cliente', 'tipo_venda', 'tipo_pagamento', 'parcelas',
+    'taxa_aplicada_pct', 'desconto', 'valor_total_venda', 'meu_lucro_venda',
+    'item_id', 'produto_id', 'produto', 'quantidade', 'preco_unitario', 'brinde',
+    'subtotal_item', 'custo_item', 'taxa_item', 'meu_lucro_item',
+    'lote_id', 'lote_data_entrada', 'quantidade_lote', 'preco_compra_lote', 'custo_lote',
+]
+
+CAMPOS_CONSULTA = {
+    'venda_data': F('venda__data'),
+    'cliente': F('venda__cliente_nome'),
+    'tipo_venda': F('venda__tipo_venda'),
+    'tipo_pagamento': F('venda__tipo_pagamento'),
+    'parcelas': F('venda__parcelas'),
+    'taxa_aplicada': F('venda__taxa_aplicada'),
+    'desconto': F('venda__desconto'),
+    'valor_bruto_venda': F('venda__valor_bruto_registrado'),
+    'meu_lucro_venda': F('venda__meu_lucro_registrado'),
+    'produto_nome': F('produto__nome'),
+    'lote_id': F('lotes_utilizados__lote_id'),
+    'lote_data_entrada': F('lotes_utilizados__lote__data_entrada'),
+    'quantidade_lote': F('lotes_utilizados__quantidade_retirada'),
+    'preco_compra_lote': F('lotes_utilizados__preco_compra_lote'),
+}
+
+
+def filtrar_itens(data_inicio=None, data_fim=None, tipo_venda=None, tipo_pagamento=None, produto_id=None):
+    """ItemVenda das vendas no período (dias locais, inclusivos) e com os filtros informados."""
+    itens = ItemVenda.objects.all()
+    if data_inicio:
+        itens = itens.filter(venda__data__gte=timezone.make_aware(datetime.combine(data_inicio, time.min)))
+    if data_fim:
+        itens = itens.filter(venda__data__lt=timezone.make_aware(datetime.combine(data_fim + timedelta(days=1), time.min)))
+    if tipo_venda:
+        itens = itens.filter(venda__tipo_venda=tipo_venda)
+    if tipo_pagamento:
+        itens = itens.filter(venda__tipo_pagamento=tipo_pagamento)
+    if produto_id:
+        itens = itens.filter(produto_id=produto_id)
+    return itens
+
+
+def _decimal(valor):
+    if valor is None:
+        return ''
+    return f'{valor:.2f}'.replace('.', ',')
+
+
+def _valores_item(linha):
+    """Subtotal, taxa e lucro do item como em ItemVenda.subtotal/meu_lucro_item, sem queries."""
+    subtotal = Decimal('0.00') if linha['eh_brinde'] else linha['quantidade'] * linha['preco_venda_unitario']
+    valor_total_venda = linha['valor_bruto_venda'] - linha['desconto']
+    taxa = Decimal('0.00')
+    if linha['taxa_aplicada'] > 0 and valor_total_venda > 0:
+        taxa = subtotal * linha['taxa_aplicada'] / 100
+    lucro = subtotal - linha['custo_compra_total_registrado'] - taxa
+    if linha['tipo_venda'] == 'LOJA':
+        lucro = lucro / 2
+    return subtotal, valor_total_venda, taxa, lucro
+
+
+def linhas_exportacao(itens):
+    """Gera as linhas (listas na ordem de COLUNAS) de um queryset de ItemVenda."""
+    consulta = itens.values(
+        'id', 'venda_id', 'produto_id', 'quantidade', 'preco_venda_unitario', 'custo_compra_total_registrado', 'eh_brinde',
+        **CAMPOS_CONSULTA
+    ).order_by('venda__data', 'venda_id', 'id', 'lotes_utilizados__id')
+
+    for linha in consulta.iterator(chunk_size=TAMANHO_LOTE_LEITURA):
+        subtotal, valor_total_venda, taxa, lucro = _valores_item(linha)
+        lote = linha['lote_id'] is not None
+        yield [
+            linha['venda_id'],
+            timezone.localtime(linha['venda_data']).strftime('%d/%m/%Y %H:%M'),
+            linha['cliente'] or '',
+            linha['tipo_venda'],
+            linha['tipo_pagamento'],
+            linha['parcelas'],
+            _decimal(linha['taxa_aplicada']),
+            _decimal(linha['desconto']),
+            _decimal(valor_total_venda),
+            _decimal(linha['meu_lucro_venda']),
+            linha['id'],
+            linha['produto_id'],
+            linha['produto_nome'],
+            linha['quantidade'],
+            _decimal(linha['preco_venda_unitario']),
+            'sim' if linha['eh_brinde'] else 'não',
+            _decimal(subtotal),
+            _decimal(linha['custo_compra_total_registrado']),
+            _decimal(taxa),
+            _decimal(lucro),
+            linha['lote_id'] if lote else '',
+            timezone.localtime(linha['lote_data_entrada']).strftime('%d/%m/%Y') if lote else '',
+            linha['quantidade_lote'] if lote else '',
+            _decimal(linha['preco_compra_lote']),
+            _decimal(linha['quantidade_lote'] * linha['preco_compra_lote']) if lote else '',
+        ]
+
+
+class _Eco:
+    """Arquivo falso para o csv.writer: devolve a linha formatada em vez de guardá-la."""
+
+    def write(self, valor):
+        return valor
+
+
+def gerar_csv(linhas):
+    """Gera o CSV (cabeçalho + linhas) pedaço a pedaço, começando pelo BOM UTF-8."""
+    escritor = csv.writer(_Eco(), delimiter=';')
+    yield '\ufeff' + escritor.writerow(COLUNAS)
+    for linha in linhas:
+        yield escritor.writerow(linha)
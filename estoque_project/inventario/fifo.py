@@ -0,0 +1,157 @@
+"""
+Motor de alocação FIFO das vendas.
+
+Carrega de uma vez (com lock) todos os produtos e lotes da cesta, calcula as
+retiradas em memória e grava tudo com bulk_create e um único UPDATE
+condicional nos lotes (estoque.movimentar_lotes), de modo que o número de
+queries não cresce com a quantidade de itens da venda e uma venda concorrente
+nunca deixa um lote negativo.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from .models import Produto, Lote, ItemVenda, ItemVendaLote
+from .estoque import ajustar_estoque, acumular_delta, movimentar_lotes, registrar_ultima_venda, repor_lotes
+
+
+def normalizar_itens(itens_dados, aceitar_preco_personalizado=False):
+    """
+    Converte os itens recebidos no JSON das telas de venda para o formato
+    usado pelo motor FIFO.
+    """
+    itens = []
+    for item_data in itens_dados:
+        preco_personalizado = None
+        if aceitar_preco_personalizado and item_data.get('preco_personalizado') is not None:
+            preco_personalizado = Decimal(str(item_data['preco_personalizado']))
+        itens.append({
+            'produto_id': int(item_data['id']),
+            'quantidade': int(item_data['quantidade']),
+            'eh_brinde': bool(item_data.get('eh_brinde', False)),
+            'preco_personalizado': preco_personalizado,
+        })
+    return itens
+
+
+def carregar_estoque(produto_ids):
+    """
+    Carrega os produtos e seus lotes disponíveis (ordem FIFO) travando as linhas
+    até o fim da transação. Retorna um dicionário {produto_id: produto}, onde cada
+    produto recebe a lista `lotes_fifo` já ordenada.
+
+    As linhas são travadas em ordem de id (produtos e depois lotes), a mesma de
+    estoque.travar_lotes; a ordem FIFO é montada em memória.
+    """
+    produto_ids = sorted(set(produto_ids))
+    produtos = {
+        produto.id: produto
+        for produto in Produto.objects.select_for_update().filter(id__in=produto_ids).order_by('id')
+    }
+    for produto in produtos.values():
+        produto.lotes_fifo = []
+
+    lotes = Lote.objects.select_for_update().filter(
+        produto_id__in=produto_ids,
+        quantidade_atual__gt=0
+    ).order_by('id')
+    for lote in sorted(lotes, key=lambda lote: (lote.data_entrada, lote.id)):
+        produtos[lote.produto_id].lotes_fifo.append(lote)
+
+    return produtos
+
+
+def restaurar_lotes_venda(venda):
+    """
+    Devolve aos lotes de origem as quantidades retiradas pelos itens da venda.
+    Usado antes de editar ou excluir uma venda.
+    """
+    quantidades_por_lote = defaultdict(int)
+    for lote_usado in ItemVendaLote.objects.filter(item_venda__venda=venda).values('lote_id', 'quantidade_retirada'):
+        quantidades_por_lote[lote_usado['lote_id']] += lote_usado['quantidade_retirada']
+
+    repor_lotes(quantidades_por_lote)
+
+
+def registrar_itens_venda(venda, itens, produtos=None):
+    """
+    Cria os itens da venda retirando o estoque dos lotes mais antigos (FIFO).
+
+    `itens` segue o formato de `normalizar_itens`. Se `produtos` não for informado,
+    o estoque é carregado com `carregar_estoque`. Levanta ValueError quando algum
+    produto não existe, está sem preço ou sem estoque suficiente.
+    """
+    if produtos is None:
+        produtos = carregar_estoque(item['produto_id'] for item in itens)
+
+    retiradas = defaultdict(int)
+    deltas = {}
+    itens_venda = []
+    lotes_por_item = []
+
+    for item in itens:
+        produto = produtos.get(item['produto_id'])
+        if produto is None:
+            raise ValueError(f"Produto #{item['produto_id']} não encontrado.")
+
+        quantidade_vendida = item['quantidade']
+        eh_brinde = item['eh_brinde']
+
+        disponivel = sum(lote.quantidade_atual for lote in produto.lotes_fifo)
+        if disponivel < quantidade_vendida:
+            raise ValueError(f'Estoque insuficiente para o produto: {produto.nome}')
+
+        if eh_brinde:
+            preco_no_ato_da_venda = Decimal('0.00')
+        elif item.get('preco_personalizado') is not None:
+            preco_no_ato_da_venda = item['preco_personalizado']
+        else:
+            preco_no_ato_da_venda = produto.preco_venda
+        if not eh_brinde and preco_no_ato_da_venda is None:
+            raise ValueError(f'O produto {produto.nome} está sem preço de venda definido.')
+
+        quantidade_a_baixar = quantidade_vendida
+        custo_total_item = Decimal('0')
+        lotes_utilizados_info = []
+
+        for lote in produto.lotes_fifo:
+            if quantidade_a_baixar == 0:
+                break
+            if lote.quantidade_atual == 0:
+                continue
+            quantidade_retirada_lote = min(lote.quantidade_atual, quantidade_a_baixar)
+            custo_total_item += quantidade_retirada_lote * lote.preco_compra
+            lote.quantidade_atual -= quantidade_retirada_lote
+            retiradas[lote.id] -= quantidade_retirada_lote
+            acumular_delta(deltas, lote, -quantidade_retirada_lote)
+            quantidade_a_baixar -= quantidade_retirada_lote
+
+            lotes_utilizados_info.append((lote, quantidade_retirada_lote))
+
+        itens_venda.append(ItemVenda(
+            venda=venda,
+            produto=produto,
+            quantidade=quantidade_vendida,
+            preco_venda_unitario=preco_no_ato_da_venda,
+            custo_compra_total_registrado=custo_total_item,
+            eh_brinde=eh_brinde
+        ))
+        lotes_por_item.append(lotes_utilizados_info)
+
+    ItemVenda.objects.bulk_create(itens_venda)
+
+    ItemVendaLote.objects.bulk_create([
+        ItemVendaLote(
+            item_venda=item_venda,
+            lote=lote,
+            quantidade_retirada=quantidade_retirada,
+            preco_compra_lote=lote.preco_compra
+        )
+        for item_venda, lotes_utilizados_info in zip(itens_venda, lotes_por_item)
+        for lote, quantidade_retirada in lotes_utilizados_info
+    ])
+
+    movimentar_lotes(retiradas)
+    ajustar_estoque(deltas)
+    registrar_ultima_venda(deltas, venda.data)
+
+    return itens_venda
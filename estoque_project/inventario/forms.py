@@ -107,4 +107,18 @@ class FornecedorForm(forms.ModelForm):
     
     def clean_nome(self):
         nome = self.cleaned_data.get('nome')
-        return capitalizar_nome(nome) 
\ No newline at end of file
+        return capitalizar_nome(nome)
+
+
+class ImportarProdutosForm(forms.Form):
+    arquivo = forms.FileField(
+        label='Arquivo CSV',
+        widget=forms.ClearableFileInput(attrs={'class': 'form-control', 'accept': '.csv,text/csv'}),
+        help_text='Colunas: nome, fornecedor, preco_venda, quantidade, preco_compra (separador ; ou ,).'
+    )
+    simular = forms.BooleanField(
+        label='Apenas simular (não grava nada)',
+        required=False,
+        initial=True,
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
+    )
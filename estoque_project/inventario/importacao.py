@@ -0,0 +1,248 @@
+"""
+Importação em lote de produtos e lotes a partir de CSV (catálogo de fornecedor).
+
+Colunas (cabeçalho obrigatório, separador ';' ou ','):
+    nome            obrigatório
+    fornecedor      opcional; criado se ainda não existir
+    preco_venda     opcional; atualiza o preço de produtos existentes
+    quantidade      opcional; > 0 cria um lote
+    preco_compra    obrigatório quando há quantidade
+
+Os produtos são casados pelo nome normalizado (sem acentos, minúsculas) e
+pelo fornecedor. O arquivo é lido em streaming e processado em blocos de
+TAMANHO_BLOCO linhas: cada bloco resolve fornecedores e produtos com uma
+query, grava com bulk_create/bulk_update e ajusta os totais de estoque em um
+UPDATE, tudo em uma transação. Erros de validação são reportados por linha
+e não impedem as demais.
+
+Em modo simulação tudo roda dentro de uma transação desfeita no final: o
+relatório é exatamente o que a importação faria, sem gravar nada.
+"""
+import csv
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db import transaction, DatabaseError
+
+from .estoque import ajustar_estoque
+from .forms import capitalizar_nome
+from .models import Produto, Lote, Fornecedor, normalizar_texto
+
+TAMANHO_BLOCO = 1000
+COLUNAS_OBRIGATORIAS = {'nome'}
+
+
+class ErroImportacao(ValueError):
+    pass
+
+
+@dataclass
+class LinhaImportacao:
+    numero: int
+    nome: str
+    fornecedor: str
+    preco_venda: Decimal | None
+    quantidade: int
+    preco_compra: Decimal | None
+
+
+@dataclass
+class ResultadoImportacao:
+    simulacao: bool = False
+    linhas_lidas: int = 0
+    produtos_criados: int = 0
+    produtos_atualizados: int = 0
+    lotes_criados: int = 0
+    fornecedores_criados: int = 0
+    erros: list = field(default_factory=list)  # [(número da linha, mensagem)]
+
+    @property
+    def linhas_importadas(self):
+        return self.linhas_lidas - len(self.erros)
+
+
+def _decimal(valor, campo):
+    valor = (valor or '').strip().replace('R$', '').strip()
+    if not valor:
+        return None
+    if ',' in valor:
+        valor = valor.replace('.', '').replace(',', '.')
+    try:
+        numero = Decimal(valor).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise ErroImportacao(f'{campo} inválido: "{valor}"')
+    # Decimal aceita "NaN", que não pode ser comparado
+    if not numero.is_finite():
+        raise ErroImportacao(f'{campo} inválido: "{valor}"')
+    if numero < 0:
+        raise ErroImportacao(f'{campo} não pode ser negativo')
+    return numero
+
+
+def validar_linha(numero, dados):
+    """Converte uma linha do CSV em LinhaImportacao (ErroImportacao se inválida)."""
+    nome = capitalizar_nome((dados.get('nome') or '').strip())
+    if not nome:
+        raise ErroImportacao('nome é obrigatório')
+    if len(nome) > 255:
+        raise ErroImportacao('nome com mais de 255 caracteres')
+
+    quantidade = (dados.get('quantidade') or '').strip()
+    try:
+        quantidade = int(quantidade) if quantidade else 0
+    except ValueError:
+        raise ErroImportacao(f'quantidade inválida: "{quantidade}"')
+    if quantidade < 0:
+        raise ErroImportacao('quantidade não pode ser negativa')
+
+    preco_compra = _decimal(dados.get('preco_compra'), 'preco_compra')
+    if quantidade and preco_compra is None:
+        raise ErroImportacao('preco_compra é obrigatório quando há quantidade')
+
+    return LinhaImportacao(
+        numero=numero,
+        nome=nome,
+        fornecedor=capitalizar_nome((dados.get('fornecedor') or '').strip()),
+        preco_venda=_decimal(dados.get('preco_venda'), 'preco_venda'),
+        quantidade=quantidade,
+        preco_compra=preco_compra,
+    )
+
+
+def ler_csv(arquivo):
+    """Gera (número da linha, dicionário) de um arquivo texto, detectando o separador."""
+    amostra = arquivo.readline()
+    separador = ';' if amostra.count(';') > amostra.count(',') else ','
+    cabecalho = [coluna.strip().lower() for coluna in next(csv.reader([amostra], delimiter=separador), [])]
+    faltando = COLUNAS_OBRIGATORIAS - set(cabecalho)
+    if faltando:
+        raise ErroImportacao(f"Cabeçalho sem a(s) coluna(s): {', '.join(sorted(faltando))}")
+    for numero, valores in enumerate(csv.reader(arquivo, delimiter=separador), start=2):
+        if any(valor.strip() for valor in valores):
+            yield numero, dict(zip(cabecalho, valores))
+
+
+class Importador:
+    """Mantém os fornecedores e produtos já resolvidos entre os blocos."""
+
+    def __init__(self):
+        self.fornecedores = {}  # nome normalizado -> id
+        self.produtos = {}  # (nome normalizado, fornecedor_id) -> Produto
+
+    def _resolver_fornecedores(self, linhas):
+        """Ids dos fornecedores das linhas; cria os que não existem. Retorna quantos foram criados."""
+        nomes = {normalizar_texto(linha.fornecedor): linha.fornecedor for linha in linhas if linha.fornecedor}
+        faltando = set(nomes) - set(self.fornecedores)
+        if not faltando:
+            return 0
+        for fornecedor in Fornecedor.objects.only('id', 'nome').order_by('id'):
+            # Fornecedores são poucos; o nome não tem coluna normalizada para filtrar no banco
+            self.fornecedores.setdefault(normalizar_texto(fornecedor.nome), fornecedor.id)
+        novos = [Fornecedor(nome=nomes[chave]) for chave in sorted(faltando) if chave not in self.fornecedores]
+        for fornecedor in Fornecedor.objects.bulk_create(novos):
+            self.fornecedores[normalizar_texto(fornecedor.nome)] = fornecedor.id
+        return len(novos)
+
+    def _chave(self, linha):
+        return normalizar_texto(linha.nome), self.fornecedores.get(normalizar_texto(linha.fornecedor))
+
+    def _resolver_produtos(self, linhas):
+        chaves = {self._chave(linha) for linha in linhas} - set(self.produtos)
+        if not chaves:
+            return
+        existentes = Produto.objects.filter(
+            nome_normalizado__in={nome for nome, _ in chaves}
+        ).only('id', 'nome', 'nome_normalizado', 'fornecedor_id', 'preco_venda').order_by('id')
+        for produto in existentes:
+            self.produtos.setdefault((produto.nome_normalizado, produto.fornecedor_id), produto)
+
+    def processar_bloco(self, linhas):
+        """Grava um bloco de linhas válidas e retorna as contagens do que foi criado/alterado."""
+        fornecedores_criados = self._resolver_fornecedores(linhas)
+        self._resolver_produtos(linhas)
+
+        novos = {}
+        atualizados = {}
+        for linha in linhas:
+            chave = self._chave(linha)
+            produto = self.produtos.get(chave) or novos.get(chave)
+            if produto is None:
+                # bulk_create não chama save(): o nome normalizado é preenchido aqui
+                novos[chave] = Produto(
+                    nome=linha.nome,
+                    nome_normalizado=chave[0],
+                    fornecedor_id=chave[1],
+                    preco_venda=linha.preco_venda,
+                )
+            elif linha.preco_venda is not None and produto.preco_venda != linha.preco_venda:
+                produto.preco_venda = linha.preco_venda
+                if produto.pk:
+                    atualizados[produto.pk] = produto
+
+        Produto.objects.bulk_create(novos.values())
+        Produto.objects.bulk_update(atualizados.values(), ['preco_venda'])
+        self.produtos.update(novos)
+
+        lotes = []
+        deltas = {}
+        for linha in linhas:
+            if not linha.quantidade:
+                continue
+            produto = self.produtos[self._chave(linha)]
+            lotes.append(Lote(
+                produto=produto,
+                quantidade_inicial=linha.quantidade,
+                quantidade_atual=linha.quantidade,
+                preco_compra=linha.preco_compra,
+            ))
+            quantidade, custo = deltas.get(produto.pk, (0, Decimal('0.00')))
+            deltas[produto.pk] = (quantidade + linha.quantidade, custo + linha.quantidade * linha.preco_compra)
+        Lote.objects.bulk_create(lotes)
+        ajustar_estoque(deltas)
+        return {
+            'fornecedores_criados': fornecedores_criados,
+            'produtos_criados': len(novos),
+            'produtos_atualizados': len(atualizados),
+            'lotes_criados': len(lotes),
+        }
+
+
+def importar_arquivo(arquivo, simular=False, tamanho_bloco=TAMANHO_BLOCO):
+    """
+    Importa produtos e lotes de um arquivo texto CSV. Retorna ResultadoImportacao;
+    com `simular=True` nada é gravado.
+    """
+    resultado = ResultadoImportacao(simulacao=simular)
+    importador = Importador()
+    linhas_csv = ler_csv(arquivo)
+
+    with transaction.atomic() if simular else nullcontext():
+        while True:
+            bloco = list(islice(linhas_csv, tamanho_bloco))
+            if not bloco:
+                break
+            resultado.linhas_lidas += len(bloco)
+            validas = []
+            for numero, dados in bloco:
+                try:
+                    validas.append(validar_linha(numero, dados))
+                except ErroImportacao as erro:
+                    resultado.erros.append((numero, str(erro)))
+            if not validas:
+                continue
+            fornecedores, produtos = dict(importador.fornecedores), dict(importador.produtos)
+            try:
+                with transaction.atomic():
+                    contagens = importador.processar_bloco(validas)
+            except DatabaseError as erro:
+                # O bloco inteiro foi desfeito; esquece o que foi resolvido nele
+                importador.fornecedores, importador.produtos = fornecedores, produtos
+                resultado.erros.extend((linha.numero, f'Erro ao gravar o bloco: {erro}') for linha in validas)
+                continue
+            for campo, valor in contagens.items():
+                setattr(resultado, campo, getattr(resultado, campo) + valor)
+        if simular:
+            transaction.set_rollback(True)
+    return resultado
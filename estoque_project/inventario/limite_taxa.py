@@ -0,0 +1,111 @@
+"""
+Limite de requisições por minuto das APIs de busca, para views síncronas e
+assíncronas.
+
+Substitui o decorator do django-ratelimit, que só lê o usuário e o cache de
+forma síncrona (dentro de uma view async levantaria SynchronousOnlyOperation
+ou bloquearia o event loop). A contagem é uma janela fixa no cache do Django:
+uma chave por view, identificador e janela, criada com add e incrementada
+com incr (aadd/aincr nas views async). Acima do limite levanta
+LimiteExcedido, que o RatelimitMiddleware transforma em 429.
+
+Com RATELIMIT_ENABLE=False nada é contado (ver simular_carga).
+
+    @limitar_taxa(chave='user_or_ip', taxa='300/m')
+    async def buscar(request):
+        ...
+"""
+import functools
+import time
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+
+PERIODOS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+class LimiteExcedido(PermissionDenied):
+    pass
+
+
+def interpretar_taxa(taxa):
+    """'60/m' -> (60, 60): requisições permitidas e duração da janela em segundos."""
+    quantidade, _, periodo = taxa.partition('/')
+    return int(quantidade), PERIODOS[periodo]
+
+
+def _identificador_ip(request):
+    return request.META.get('REMOTE_ADDR', '')
+
+
+async def _usuario(request):
+    # Sob WSGI o LoginRequiredMiddleware (síncrono) já carregou request.user, mas
+    # auser() tem um cache próprio e buscaria o usuário de novo
+    usuario = getattr(request, '_cached_user', None)
+    if usuario is None:
+        usuario = await request.auser()
+    return usuario
+
+
+def _chave_contador(grupo, identificador, periodo):
+    janela = int(time.time() // periodo)
+    return f'limite:{grupo}:{identificador}:{janela}'
+
+
+def limitar_taxa(chave='ip', taxa='60/m', metodo='GET'):
+    """
+    Decorator que limita a `taxa` as requisições `metodo` da view por IP
+    (`chave='ip'`) ou pelo usuário logado, com o IP para anônimos
+    (`chave='user_or_ip'`).
+    """
+    limite, periodo = interpretar_taxa(taxa)
+
+    def decorator(view):
+        grupo = f'{view.__module__}.{view.__qualname__}'
+
+        def ignorar(request):
+            return request.method != metodo or not getattr(settings, 'RATELIMIT_ENABLE', True)
+
+        if iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def view_limitada(request, *args, **kwargs):
+                if not ignorar(request):
+                    identificador = _identificador_ip(request)
+                    if chave == 'user_or_ip':
+                        usuario = await _usuario(request)
+                        if usuario.is_authenticated:
+                            identificador = f'u{usuario.pk}'
+                    chave_contador = _chave_contador(grupo, identificador, periodo)
+                    await cache.aadd(chave_contador, 0, periodo)
+                    try:
+                        contagem = await cache.aincr(chave_contador)
+                    except ValueError:
+                        # A janela expirou entre o add e o incr
+                        await cache.aset(chave_contador, 1, periodo)
+                        contagem = 1
+                    if contagem > limite:
+                        raise LimiteExcedido()
+                return await view(request, *args, **kwargs)
+            return view_limitada
+
+        @functools.wraps(view)
+        def view_limitada(request, *args, **kwargs):
+            if not ignorar(request):
+                identificador = _identificador_ip(request)
+                if chave == 'user_or_ip' and request.user.is_authenticated:
+                    identificador = f'u{request.user.pk}'
+                chave_contador = _chave_contador(grupo, identificador, periodo)
+                cache.add(chave_contador, 0, periodo)
+                try:
+                    contagem = cache.incr(chave_contador)
+                except ValueError:
+                    cache.set(chave_contador, 1, periodo)
+                    contagem = 1
+                if contagem > limite:
+                    raise LimiteExcedido()
+            return view(request, *args, **kwargs)
+        return view_limitada
+
+    return decorator
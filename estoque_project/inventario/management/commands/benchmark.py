@@ -0,0 +1,76 @@
+"""
+Management command que mede queries e latência das telas principais sobre
+uma loja sintética (ver inventario/benchmark.py) e compara com o baseline.
+Roda em um banco de teste SQLite em memória: os dados reais não são tocados.
+Uso: python manage.py benchmark [--escalas pequena,media] [--repeticoes 5]
+     [--saida resultados.json] [--baseline arquivo.json] [--tolerancia 1.0] [--gravar-baseline]
+"""
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from inventario.benchmark import (
+    ARQUIVO_BASELINE, ESCALAS, REPETICOES_PADRAO, comparar, gerar_baseline, ler_baseline, medir_escala,
+)
+
+
+class Command(BaseCommand):
+    help = 'Mede queries e latência das telas principais em lojas sintéticas e compara com o baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--escalas', default='pequena,media', help=f"Escalas separadas por vírgula ({', '.join(ESCALAS)})")
+        parser.add_argument('--repeticoes', type=int, default=REPETICOES_PADRAO, help='Execuções de cada cenário')
+        parser.add_argument('--cenarios', help='Mede só estes cenários (separados por vírgula)')
+        parser.add_argument('--semente', type=int, default=42, help='Semente do gerador de dados')
+        parser.add_argument('--saida', help='Grava os resultados em JSON neste arquivo (padrão: saída padrão)')
+        parser.add_argument('--baseline', default=str(ARQUIVO_BASELINE), help='Arquivo com os limites')
+        parser.add_argument('--tolerancia', type=float, default=1.0, help='Multiplicador dos limites de latência')
+        parser.add_argument('--gravar-baseline', action='store_true', help='Grava os resultados como novo baseline')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('O benchmark roda em SQLite: use DATABASE_URL=sqlite:////tmp/benchmark.sqlite3')
+        escalas = [escala.strip() for escala in options['escalas'].split(',') if escala.strip()]
+        desconhecidas = set(escalas) - set(ESCALAS)
+        if desconhecidas:
+            raise CommandError(f"Escala(s) desconhecida(s): {', '.join(sorted(desconhecidas))}")
+        if options['repeticoes'] < 1:
+            raise CommandError('--repeticoes precisa ser pelo menos 1.')
+        cenarios = set(options['cenarios'].split(',')) if options['cenarios'] else None
+
+        setup_test_environment()
+        nome_original = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            resultados = {}
+            for escala in escalas:
+                self.stderr.write(f'Escala {escala}: {ESCALAS[escala]}')
+                resultados[escala] = medir_escala(ESCALAS[escala], options['repeticoes'], options['semente'], cenarios)
+        finally:
+            connection.creation.destroy_test_db(nome_original, verbosity=0)
+            teardown_test_environment()
+
+        baseline = ler_baseline(options['baseline'])
+        falhas = comparar(resultados, baseline, options['tolerancia'])
+        saida = json.dumps({
+            'gerado_em': timezone.now().isoformat(),
+            'repeticoes': options['repeticoes'],
+            'escalas': resultados,
+            'falhas': falhas,
+        }, indent=2, ensure_ascii=False)
+        if options['saida']:
+            Path(options['saida']).write_text(saida + '\n', encoding='utf-8')
+        else:
+            self.stdout.write(saida)
+
+        if options['gravar_baseline']:
+            novo = gerar_baseline(resultados, baseline)
+            Path(options['baseline']).write_text(json.dumps(novo, indent=2, ensure_ascii=False) + '\n', encoding='utf-8')
+            self.stderr.write(self.style.SUCCESS(f"Baseline gravado em {options['baseline']}."))
+            return
+        if falhas:
+            raise CommandError('Limites do baseline excedidos:\n' + '\n'.join(falhas))
+        self.stderr.write(self.style.SUCCESS('Todos os cenários dentro dos limites.'))
@@ -0,0 +1,39 @@
+"""
+Management command para consultar e invalidar o cache do dashboard.
+Com o backend locmem (padrão) os números são apenas os deste processo; com
+DASHBOARD_CACHE_DIR (cache em arquivo) são os de todos os workers.
+Uso: python manage.py cache_dashboard [--invalidar] [--zerar]
+"""
+from django.core.management.base import BaseCommand
+
+from inventario.cache_dashboard import estatisticas, invalidar_dashboard, zerar_estatisticas
+
+
+class Command(BaseCommand):
+    help = 'Mostra acertos e falhas do cache do dashboard (e opcionalmente o invalida)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--invalidar',
+            action='store_true',
+            help='Descarta os contextos do dashboard guardados no cache',
+        )
+        parser.add_argument(
+            '--zerar',
+            action='store_true',
+            help='Zera os contadores de acertos e falhas',
+        )
+
+    def handle(self, *args, **options):
+        dados = estatisticas()
+        self.stdout.write(
+            f'Acertos: {dados["acertos"]} | Falhas: {dados["falhas"]} | '
+            f'Taxa de acerto: {dados["taxa_acerto"]}% | Versão: {dados["versao"]}'
+        )
+
+        if options['invalidar']:
+            invalidar_dashboard()
+            self.stdout.write(self.style.SUCCESS('Cache do dashboard invalidado.'))
+        if options['zerar']:
+            zerar_estatisticas()
+            self.stdout.write(self.style.SUCCESS('Contadores zerados.'))
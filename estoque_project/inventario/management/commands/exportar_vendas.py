@@ -0,0 +1,55 @@
+"""
+Management command para exportar as vendas em CSV, item a item e com os lotes
+consumidos (mesmo formato de /vendas/exportar/).
+Uso: python manage.py exportar_vendas [--inicio AAAA-MM-DD] [--fim AAAA-MM-DD]
+     [--tipo-venda LOJA|EXTERNA] [--tipo-pagamento ...] [--produto ID] [--saida arquivo.csv]
+"""
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from inventario.exportacao import filtrar_itens, linhas_exportacao, gerar_csv
+from inventario.models import Venda
+
+
+class Command(BaseCommand):
+    help = 'Exporta as vendas com itens e lotes em CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--inicio', help='Primeiro dia do período (AAAA-MM-DD)')
+        parser.add_argument('--fim', help='Último dia do período (AAAA-MM-DD)')
+        parser.add_argument('--tipo-venda', choices=[valor for valor, _ in Venda.TIPO_VENDA_CHOICES])
+        parser.add_argument('--tipo-pagamento', choices=[valor for valor, _ in Venda.TIPO_PAGAMENTO_CHOICES])
+        parser.add_argument('--produto', type=int, help='ID do produto')
+        parser.add_argument('--saida', help='Arquivo de saída (padrão: saída padrão)')
+
+    def _data(self, valor, opcao):
+        if not valor:
+            return None
+        try:
+            return datetime.strptime(valor, '%Y-%m-%d').date()
+        except ValueError:
+            raise CommandError(f'Data inválida em {opcao}. Use o formato AAAA-MM-DD.')
+
+    def handle(self, *args, **options):
+        itens = filtrar_itens(
+            data_inicio=self._data(options['inicio'], '--inicio'),
+            data_fim=self._data(options['fim'], '--fim'),
+            tipo_venda=options['tipo_venda'],
+            tipo_pagamento=options['tipo_pagamento'],
+            produto_id=options['produto'],
+        )
+        if options['saida']:
+            with open(options['saida'], 'w', encoding='utf-8', newline='') as arquivo:
+                linhas = self._escrever(arquivo.write, itens)
+            self.stdout.write(self.style.SUCCESS(f"{linhas} linha(s) exportada(s) para {options['saida']}."))
+        else:
+            self._escrever(lambda pedaco: self.stdout.write(pedaco, ending=''), itens)
+
+    def _escrever(self, escrever, itens):
+        """Escreve o CSV pedaço a pedaço e devolve o número de linhas (sem o cabeçalho)."""
+        linhas = -1
+        for pedaco in gerar_csv(linhas_exportacao(itens)):
+            escrever(pedaco)
+            linhas += 1
+        return linhas
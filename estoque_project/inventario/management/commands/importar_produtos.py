@@ -0,0 +1,47 @@
+"""
+Management command para importar produtos e lotes de um CSV (ver inventario/importacao.py).
+Uso: python manage.py importar_produtos arquivo.csv [--simular] [--bloco 1000]
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from inventario.importacao import importar_arquivo, ErroImportacao, TAMANHO_BLOCO
+
+
+class Command(BaseCommand):
+    help = 'Importa produtos e lotes de um arquivo CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('arquivo', help='Arquivo CSV em UTF-8')
+        parser.add_argument(
+            '--simular',
+            action='store_true',
+            help='Apenas mostra o que seria importado, sem gravar nada',
+        )
+        parser.add_argument(
+            '--bloco',
+            type=int,
+            default=TAMANHO_BLOCO,
+            help=f'Linhas gravadas por transação (padrão: {TAMANHO_BLOCO})',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['arquivo'], encoding='utf-8-sig', newline='') as arquivo:
+                resultado = importar_arquivo(arquivo, simular=options['simular'], tamanho_bloco=options['bloco'])
+        except OSError as erro:
+            raise CommandError(f'Não foi possível abrir o arquivo: {erro}')
+        except (ErroImportacao, UnicodeDecodeError) as erro:
+            raise CommandError(str(erro))
+
+        for numero, mensagem in resultado.erros:
+            self.stderr.write(f'Linha {numero}: {mensagem}')
+
+        prefixo = '[SIMULAÇÃO] ' if resultado.simulacao else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefixo}{resultado.linhas_lidas} linha(s) lida(s): '
+            f'{resultado.produtos_criados} produto(s) criado(s), '
+            f'{resultado.produtos_atualizados} atualizado(s), '
+            f'{resultado.lotes_criados} lote(s), '
+            f'{resultado.fornecedores_criados} fornecedor(es) novo(s), '
+            f'{len(resultado.erros)} erro(s).'
+        ))
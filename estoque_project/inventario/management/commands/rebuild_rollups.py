@@ -0,0 +1,31 @@
+"""
+Management command para regenerar as tabelas de totais diários das vendas
+(VendaDiaria e VendaDiariaProduto) a partir do histórico.
+Uso: python manage.py rebuild_rollups [--desde AAAA-MM-DD]
+"""
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from inventario.vendas_diarias import reconstruir_vendas_diarias
+
+
+class Command(BaseCommand):
+    help = 'Regenera os totais diários de vendas usados pelo dashboard'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--desde',
+            help='Regenera apenas os dias a partir desta data (AAAA-MM-DD)',
+        )
+
+    def handle(self, *args, **options):
+        desde = None
+        if options['desde']:
+            try:
+                desde = datetime.strptime(options['desde'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('Data inválida em --desde. Use o formato AAAA-MM-DD.')
+
+        linhas = reconstruir_vendas_diarias(desde)
+        self.stdout.write(self.style.SUCCESS(f'{linhas} linha(s) diária(s) de vendas geradas.'))
@@ -0,0 +1,39 @@
+"""
+Management command para recalcular o snapshot de previsões de estoque
+(PrevisaoEstoque) usado pela página de análise de tendências.
+Rode diariamente (as médias móveis mudam a cada dia) e, se quiser, com
+--alterados em intervalos menores.
+Uso: python manage.py recalcular_previsoes [--alterados]
+"""
+from django.core.management.base import BaseCommand
+
+from inventario.previsoes import (
+    previsoes_desatualizadas, produtos_alterados_desde, recalcular_previsoes, ultima_atualizacao,
+)
+
+
+class Command(BaseCommand):
+    help = 'Recalcula as previsões de reposição de estoque a partir do histórico de vendas'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--alterados',
+            action='store_true',
+            help='Recalcula apenas produtos com vendas, lotes ou compras registrados desde a última execução '
+                 '(e os calculados antes de hoje)',
+        )
+
+    def handle(self, *args, **options):
+        produto_ids = None
+        if options['alterados']:
+            ultima = ultima_atualizacao()
+            if ultima is None:
+                self.stdout.write('Nenhuma previsão gravada ainda; recalculando todos os produtos.')
+            else:
+                produto_ids = produtos_alterados_desde(ultima)
+                if not produto_ids and not previsoes_desatualizadas().exists():
+                    self.stdout.write(self.style.SUCCESS('Nenhum produto alterado desde a última execução.'))
+                    return
+
+        total = recalcular_previsoes(produto_ids)
+        self.stdout.write(self.style.SUCCESS(f'{total} previsão(ões) gravada(s).'))
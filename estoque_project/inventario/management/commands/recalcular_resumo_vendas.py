@@ -0,0 +1,53 @@
+"""
+Management command para (re)calcular o resumo financeiro gravado em cada Venda
+(valor bruto, custo, meu lucro, quantidades vendidas/devolvidas e brindes)
+e os totais diários dos dias dessas vendas.
+Uso: python manage.py recalcular_resumo_vendas [--pendentes] [--lote 500]
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from inventario.models import Venda
+from inventario.resumo_vendas import atualizar_resumo_vendas
+from inventario.vendas_diarias import atualizar_vendas_diarias
+
+
+class Command(BaseCommand):
+    help = 'Recalcula o resumo financeiro gravado nas vendas a partir dos itens e devoluções'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--pendentes',
+            action='store_true',
+            help='Processa apenas vendas que ainda não têm resumo calculado',
+        )
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=500,
+            help='Quantidade de vendas processadas por transação (padrão: 500)',
+        )
+
+    def handle(self, *args, **options):
+        vendas = Venda.objects.only('id', 'data', 'desconto', 'taxa_aplicada', 'tipo_venda').order_by('id')
+        if options['pendentes']:
+            vendas = vendas.filter(resumo_atualizado_em__isnull=True)
+
+        tamanho_lote = max(1, options['lote'])
+        total = 0
+        lote = []
+        for venda in vendas.iterator(chunk_size=tamanho_lote):
+            lote.append(venda)
+            if len(lote) >= tamanho_lote:
+                total += self._processar(lote)
+                lote = []
+        if lote:
+            total += self._processar(lote)
+
+        self.stdout.write(self.style.SUCCESS(f'Resumo recalculado para {total} venda(s).'))
+
+    def _processar(self, vendas):
+        with transaction.atomic():
+            atualizar_resumo_vendas(vendas)
+            atualizar_vendas_diarias([venda.data for venda in vendas])
+        return len(vendas)
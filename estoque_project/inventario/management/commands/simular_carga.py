@@ -0,0 +1,151 @@
+"""
+Management command que simula caixas simultâneos no fluxo de venda
+(buscar_produtos_json -> criar_venda -> detalhar_venda) e reconcilia o
+estoque no final (ver inventario/carga.py).
+
+Sem --url as views rodam neste processo, uma thread por caixa, sobre o banco
+configurado. Com --url as requisições vão para um servidor em execução (por
+exemplo um worker do gunicorn) e --processos distribui os caixas entre
+processos; a reconciliação usa o banco configurado aqui, que precisa ser o
+mesmo do servidor (ou use --sem-verificacao).
+
+As vendas são gravadas de verdade: use um banco de teste (--gerar-loja
+popula um banco vazio com a loja sintética).
+
+Uso: python manage.py simular_carga [--caixas 4] [--iteracoes 20] [--duracao 60]
+     [--url http://127.0.0.1:8000 --usuario u --senha s --processos 2]
+     [--gerar-loja 200] [--saida resultado.json] [--noinput]
+"""
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from inventario.carga import (
+    ClienteHTTP, ClienteLocal, ResultadoCaixa, executar_caixa, quantidades_lotes, reconciliar, resumir,
+)
+from inventario.dados_sinteticos import gerar_loja
+from inventario.models import Produto
+
+
+def _caixas_http(url, usuario, senha, caixas, iteracoes, semente, marcador, duracao):
+    """Roda `caixas` caixas HTTP em threads (dentro de um processo filho)."""
+    with ThreadPoolExecutor(max_workers=len(caixas)) as executor:
+        futuros = [
+            executor.submit(executar_caixa, ClienteHTTP(url, usuario, senha), iteracoes, semente + caixa, marcador, duracao)
+            for caixa in caixas
+        ]
+        total = ResultadoCaixa()
+        for futuro in futuros:
+            total.juntar(futuro.result())
+    return total
+
+
+class Command(BaseCommand):
+    help = 'Simula caixas simultâneos vendendo e reconcilia lotes e estoque no final'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--caixas', type=int, default=4, help='Caixas simultâneos (threads)')
+        parser.add_argument('--iteracoes', type=int, default=20, help='Buscas/vendas por caixa')
+        parser.add_argument('--duracao', type=float, help='Para cada caixa depois de N segundos')
+        parser.add_argument('--semente', type=int, default=42)
+        parser.add_argument('--url', help='Servidor alvo (ex.: http://127.0.0.1:8000); sem ele, roda neste processo')
+        parser.add_argument('--usuario', help='Usuário para o login no servidor alvo')
+        parser.add_argument('--senha', help='Senha do usuário no servidor alvo')
+        parser.add_argument('--processos', type=int, default=1, help='Processos para distribuir os caixas (só com --url)')
+        parser.add_argument('--gerar-loja', type=int, metavar='PRODUTOS', help='Popula o banco vazio com a loja sintética')
+        parser.add_argument('--sem-verificacao', action='store_true', help='Não reconcilia lotes e estoque no final')
+        parser.add_argument('--com-ratelimit', action='store_true', help='Mantém o rate limit das APIs (neste processo)')
+        parser.add_argument('--saida', help='Grava o resultado em JSON neste arquivo')
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interativo', help='Não pede confirmação')
+
+    def handle(self, *args, **options):
+        caixas = options['caixas']
+        if caixas < 1 or options['iteracoes'] < 1 or options['processos'] < 1:
+            raise CommandError('--caixas, --iteracoes e --processos precisam ser pelo menos 1.')
+        if options['processos'] > 1 and not options['url']:
+            raise CommandError('--processos só é usado com --url (as views deste processo rodam em threads).')
+        if options['url'] and not (options['usuario'] and options['senha']):
+            raise CommandError('Informe --usuario e --senha para o login no servidor alvo.')
+
+        banco = connection.settings_dict['NAME']
+        if options['interativo']:
+            resposta = input(f'As vendas da simulação serão gravadas no banco "{banco}". Continuar? [s/N] ')
+            if resposta.strip().lower() not in ('s', 'sim'):
+                raise CommandError('Simulação cancelada.')
+
+        if options['gerar_loja']:
+            if Produto.objects.exists():
+                raise CommandError('--gerar-loja só pode ser usado em um banco sem produtos.')
+            loja = gerar_loja(produtos=options['gerar_loja'], vendas=options['gerar_loja'] * 10)
+            self.stderr.write(f'Loja sintética gerada: {loja}')
+
+        # Dígitos apenas: criar_venda capitaliza o nome do cliente
+        marcador = f'Carga {time.time_ns()}'
+        antes = None if options['sem_verificacao'] else quantidades_lotes()
+
+        inicio = time.perf_counter()
+        if options['url']:
+            resultado = self._executar_http(options, marcador)
+        else:
+            # O test client usa o host 'testserver'
+            with override_settings(
+                RATELIMIT_ENABLE=options['com_ratelimit'], ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']
+            ):
+                resultado = self._executar_local(options, marcador)
+        segundos = time.perf_counter() - inicio
+
+        relatorio = {
+            'alvo': options['url'] or 'local',
+            'caixas': caixas,
+            'processos': options['processos'],
+            'marcador': marcador,
+            **resumir(resultado, segundos),
+        }
+        if antes is not None:
+            relatorio['divergencias'] = reconciliar(antes, marcador)
+
+        saida = json.dumps(relatorio, indent=2, ensure_ascii=False)
+        if options['saida']:
+            Path(options['saida']).write_text(saida + '\n', encoding='utf-8')
+        self.stdout.write(saida)
+
+        if relatorio.get('divergencias'):
+            raise CommandError(f"{len(relatorio['divergencias'])} divergência(s) de estoque depois da simulação.")
+
+    def _executar_local(self, options, marcador):
+        usuario, _ = get_user_model().objects.get_or_create(username='simulador-carga')
+        with ThreadPoolExecutor(max_workers=options['caixas']) as executor:
+            futuros = [
+                executor.submit(
+                    executar_caixa, ClienteLocal(usuario), options['iteracoes'],
+                    options['semente'] + caixa, marcador, options['duracao'],
+                )
+                for caixa in range(options['caixas'])
+            ]
+            total = ResultadoCaixa()
+            for futuro in futuros:
+                total.juntar(futuro.result())
+        return total
+
+    def _executar_http(self, options, marcador):
+        grupos = [list(range(options['caixas']))[indice::options['processos']] for indice in range(options['processos'])]
+        argumentos = (options['url'], options['usuario'], options['senha'])
+        total = ResultadoCaixa()
+        if options['processos'] == 1:
+            total.juntar(_caixas_http(*argumentos, grupos[0], options['iteracoes'], options['semente'], marcador, options['duracao']))
+            return total
+        with ProcessPoolExecutor(max_workers=options['processos']) as executor:
+            futuros = [
+                executor.submit(_caixas_http, *argumentos, grupo, options['iteracoes'], options['semente'], marcador, options['duracao'])
+                for grupo in grupos if grupo
+            ]
+            for futuro in futuros:
+                total.juntar(futuro.result())
+        return total
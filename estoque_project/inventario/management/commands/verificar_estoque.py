@@ -0,0 +1,52 @@
+"""
+Management command para conferir os totais de estoque gravados em Produto
+(estoque_atual e custo_estoque) contra a soma dos lotes.
+Uso: python manage.py verificar_estoque [--corrigir]
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from inventario.estoque import verificar_estoque
+
+
+class Command(BaseCommand):
+    help = 'Verifica (e opcionalmente corrige) divergências entre o estoque de Produto e a soma dos lotes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--corrigir',
+            action='store_true',
+            help='Grava os totais calculados a partir dos lotes nos produtos divergentes',
+        )
+        parser.add_argument(
+            '--produto',
+            type=int,
+            action='append',
+            dest='produtos',
+            help='Limita a verificação ao produto informado (pode ser repetido)',
+        )
+
+    def handle(self, *args, **options):
+        corrigir = options['corrigir']
+
+        with transaction.atomic():
+            divergencias = verificar_estoque(options['produtos'], corrigir=corrigir)
+
+        if not divergencias:
+            self.stdout.write(self.style.SUCCESS('Nenhuma divergência encontrada.'))
+            return
+
+        for divergencia in divergencias:
+            produto = divergencia['produto']
+            self.stdout.write(
+                f'#{produto.pk} {produto.nome}: '
+                f'estoque {divergencia["estoque_registrado"]} -> {divergencia["estoque_lotes"]}, '
+                f'custo R$ {divergencia["custo_registrado"]} -> R$ {divergencia["custo_lotes"]}'
+            )
+
+        if corrigir:
+            self.stdout.write(self.style.SUCCESS(f'{len(divergencias)} produto(s) corrigido(s).'))
+        else:
+            self.stdout.write(
+                self.style.WARNING(f'{len(divergencias)} produto(s) com divergência. Use --corrigir para gravar os valores dos lotes.')
+            )
@@ -1,22 +1,28 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
 from django.http import JsonResponse
-from django_ratelimit.exceptions import Ratelimited
+from django.utils.deprecation import MiddlewareMixin
+
+from . import desempenho
+from .limite_taxa import LimiteExcedido
 
-class RatelimitMiddleware:
+class RatelimitMiddleware(MiddlewareMixin):
     """
     Middleware para interceptar exceções de rate limiting e retornar
-    respostas amigáveis em JSON para APIs.
+    respostas amigáveis em JSON para APIs (síncrono e assíncrono, para não
+    tirar as views async do event loop).
     """
-    def __init__(self, get_response):
-        self.get_response = get_response
-
-    def __call__(self, request):
-        return self.get_response(request)
 
     def process_exception(self, request, exception):
-        if isinstance(exception, Ratelimited):
+        if isinstance(exception, LimiteExcedido):
             # Se for uma requisição AJAX/API, retorna JSON
             if request.headers.get('x-requested-with') == 'XMLHttpRequest' or \
                request.path.endswith('.json') or \
+               request.path.startswith('/api/') or \
                'json' in request.path:
                 return JsonResponse({
                     'erro': 'Limite de requisições excedido. Por favor, aguarde um momento.',
@@ -28,4 +34,49 @@ class RatelimitMiddleware:
         return None
 
 
+class DesempenhoMiddleware:
+    """
+    Mede queries e tempo de cada requisição (ver desempenho.py) e devolve o
+    cabeçalho Server-Timing. Só entra na cadeia com PERF_INSTRUMENTACAO=True.
+
+    Sob ASGI não tira as views async do event loop: o wrapper é instalado na
+    conexão da thread em que o ORM assíncrono executa as queries da requisição
+    (a mesma de todos os sync_to_async dela).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PERF_INSTRUMENTACAO', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        medicao = desempenho.Medicao()
+        inicio = time.perf_counter()
+        with connection.execute_wrapper(medicao):
+            response = self.get_response(request)
+        return self.registrar(request, response, time.perf_counter() - inicio, medicao)
+
+    async def __acall__(self, request):
+        medicao = desempenho.Medicao()
+        inicio = time.perf_counter()
+        # `connection` precisa ser lida dentro da thread do sync_to_async
+        await sync_to_async(lambda: connection.execute_wrappers.append(medicao))()
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(lambda: connection.execute_wrappers.remove(medicao))()
+        return self.registrar(request, response, time.perf_counter() - inicio, medicao)
 
+    def registrar(self, request, response, duracao, medicao):
+        # Arquivos estáticos e 404 de rota não têm view
+        if request.resolver_match is not None:
+            desempenho.registrar(request.resolver_match.view_name, duracao, medicao)
+        response['Server-Timing'] = desempenho.server_timing(duracao, medicao)
+        return response
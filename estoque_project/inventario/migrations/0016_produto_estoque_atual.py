@@ -0,0 +1,46 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:59
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Sum, F
+
+
+def preencher_estoque(apps, schema_editor):
+    """Popula os totais desnormalizados a partir dos lotes existentes"""
+    Produto = apps.get_model('inventario', 'Produto')
+    Lote = apps.get_model('inventario', 'Lote')
+
+    totais = Lote.objects.values('produto_id').annotate(
+        quantidade=Sum('quantidade_atual'),
+        custo=Sum(F('quantidade_atual') * F('preco_compra'))
+    ).order_by()
+    for linha in totais:
+        Produto.objects.filter(pk=linha['produto_id']).update(
+            estoque_atual=linha['quantidade'] or 0,
+            custo_estoque=linha['custo'] or Decimal('0.00')
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0015_remove_itemvenda_idx_itemvenda_prod_venda_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='produto',
+            name='custo_estoque',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=12, verbose_name='Custo do Estoque'),
+        ),
+        migrations.AddField(
+            model_name='produto',
+            name='estoque_atual',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Estoque Atual'),
+        ),
+        migrations.AddIndex(
+            model_name='produto',
+            index=models.Index(fields=['ativo', 'estoque_atual'], name='idx_produto_ativo_estoque'),
+        ),
+        migrations.RunPython(preencher_estoque, migrations.RunPython.noop),
+    ]
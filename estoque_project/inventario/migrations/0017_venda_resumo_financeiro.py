@@ -0,0 +1,59 @@
+# Generated by Django 5.2.4 on 2026-10-18 18:01
+
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0016_produto_estoque_atual'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='venda',
+            name='custo_total_registrado',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='venda',
+            name='meu_lucro_registrado',
+            field=models.DecimalField(decimal_places=6, default=Decimal('0.00'), editable=False, max_digits=16),
+        ),
+        migrations.AddField(
+            model_name='venda',
+            name='possui_devolucao',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='venda',
+            name='quantidade_brindes_registrada',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='venda',
+            name='quantidade_devolvida_registrada',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='venda',
+            name='quantidade_vendida_registrada',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='venda',
+            name='resumo_atualizado_em',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='venda',
+            name='valor_brindes_registrado',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='venda',
+            name='valor_bruto_registrado',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=12),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.4 on 2026-10-18 18:05
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0017_venda_resumo_financeiro'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VendaDiaria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.DateField()),
+                ('tipo_venda', models.CharField(choices=[('LOJA', 'Loja'), ('EXTERNA', 'Externa')], max_length=10)),
+                ('receita', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('custo', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('taxa', models.DecimalField(decimal_places=6, default=Decimal('0.00'), max_digits=16)),
+                ('meu_lucro', models.DecimalField(decimal_places=6, default=Decimal('0.00'), max_digits=16)),
+                ('n_vendas', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Venda Diária',
+                'verbose_name_plural': 'Vendas Diárias',
+                'constraints': [models.UniqueConstraint(fields=('data', 'tipo_venda'), name='uniq_vendadiaria_data_tipo')],
+            },
+        ),
+        migrations.CreateModel(
+            name='VendaDiariaProduto',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.DateField()),
+                ('quantidade', models.PositiveIntegerField(default=0)),
+                ('receita', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('custo', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('produto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='vendas_diarias', to='inventario.produto')),
+            ],
+            options={
+                'verbose_name': 'Venda Diária por Produto',
+                'verbose_name_plural': 'Vendas Diárias por Produto',
+                'constraints': [models.UniqueConstraint(fields=('data', 'produto'), name='uniq_vendadiariaprod_data_prod')],
+            },
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.4 on 2026-10-18 18:11
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0018_vendas_diarias'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PrevisaoEstoque',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dias_analise', models.PositiveIntegerField()),
+                ('estoque_atual', models.PositiveIntegerField(default=0)),
+                ('quantidade_chegando', models.PositiveIntegerField(default=0)),
+                ('estoque_projetado', models.PositiveIntegerField(default=0)),
+                ('total_vendido_periodo', models.PositiveIntegerField(default=0)),
+                ('media_movel_7_dias', models.FloatField(default=0)),
+                ('media_movel_14_dias', models.FloatField(default=0)),
+                ('media_movel_30_dias', models.FloatField(default=0)),
+                ('desvio_padrao', models.FloatField(default=0)),
+                ('dias_cobertura_atual', models.FloatField(default=0)),
+                ('ponto_reposicao', models.FloatField(default=0)),
+                ('precisa_repor', models.BooleanField(default=False)),
+                ('quantidade_sugerida', models.PositiveIntegerField(default=0)),
+                ('urgencia', models.CharField(max_length=10)),
+                ('tendencia', models.CharField(max_length=20)),
+                ('variacao_percentual', models.FloatField(default=0)),
+                ('dia_mais_vendas', models.CharField(max_length=3)),
+                ('media_dia_mais_vendas', models.FloatField(default=0)),
+                ('custo_estimado_reposicao', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('vendas_lista', models.JSONField(default=list)),
+                ('calculado_em', models.DateTimeField()),
+                ('produto', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='previsao', to='inventario.produto')),
+            ],
+            options={
+                'verbose_name': 'Previsão de Estoque',
+                'verbose_name_plural': 'Previsões de Estoque',
+            },
+        ),
+    ]
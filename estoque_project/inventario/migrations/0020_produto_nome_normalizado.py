@@ -0,0 +1,54 @@
+# Generated by Django 5.2.4 on 2026-10-18 18:12
+
+import unicodedata
+
+from django.db import migrations, models
+
+
+def normalizar_texto(texto):
+    # Cópia de models.normalizar_texto (migrations não devem importar código do app)
+    texto = unicodedata.normalize('NFKD', texto or '')
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return ' '.join(texto.lower().split())
+
+
+def preencher_nome_normalizado(apps, schema_editor):
+    Produto = apps.get_model('inventario', 'Produto')
+    produtos = list(Produto.objects.only('id', 'nome'))
+    for produto in produtos:
+        produto.nome_normalizado = normalizar_texto(produto.nome)
+    Produto.objects.bulk_update(produtos, ['nome_normalizado'], batch_size=500)
+
+
+def criar_indice_trigram(apps, schema_editor):
+    """Índice GIN pg_trgm para LIKE '%termo%' e similaridade (apenas PostgreSQL)"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_produto_nome_trgm '
+        'ON inventario_produto USING gin (nome_normalizado gin_trgm_ops)'
+    )
+
+
+def remover_indice_trigram(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS idx_produto_nome_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0019_previsao_estoque'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='produto',
+            name='nome_normalizado',
+            field=models.CharField(default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(preencher_nome_normalizado, migrations.RunPython.noop),
+        migrations.RunPython(criar_indice_trigram, remover_indice_trigram),
+    ]
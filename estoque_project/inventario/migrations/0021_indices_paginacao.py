@@ -0,0 +1,21 @@
+# Generated by Django 5.2.4 on 2026-10-18 18:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0020_produto_nome_normalizado'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='devolucao',
+            index=models.Index(fields=['-data', '-id'], name='idx_devolucao_data_id'),
+        ),
+        migrations.AddIndex(
+            model_name='venda',
+            index=models.Index(fields=['-data', '-id'], name='idx_venda_data_id'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.4 on 2026-10-18 18:27
+
+import unicodedata
+
+from django.db import migrations, models
+
+
+def normalizar_texto(texto):
+    # Cópia de models.normalizar_texto (migrations não devem importar código do app)
+    texto = unicodedata.normalize('NFKD', texto or '')
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return ' '.join(texto.lower().split())
+
+
+def preencher_nome_normalizado(apps, schema_editor):
+    ProdutoChegando = apps.get_model('inventario', 'ProdutoChegando')
+    registros = list(ProdutoChegando.objects.only('id', 'nome'))
+    for registro in registros:
+        registro.nome_normalizado = normalizar_texto(registro.nome)
+    ProdutoChegando.objects.bulk_update(registros, ['nome_normalizado'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0021_indices_paginacao'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='produtochegando',
+            name='nome_normalizado',
+            field=models.CharField(default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(preencher_nome_normalizado, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='produtochegando',
+            index=models.Index(fields=['incluido_estoque', 'nome_normalizado'], name='idx_chegando_pendente_nome'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.4 on 2026-10-18 19:05
+
+import django.db.models.functions.comparison
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def preencher_datas(apps, schema_editor):
+    Produto = apps.get_model('inventario', 'Produto')
+    Lote = apps.get_model('inventario', 'Lote')
+    ItemVenda = apps.get_model('inventario', 'ItemVenda')
+    Produto.objects.update(
+        ultima_venda_em=Subquery(ItemVenda.objects.filter(
+            produto=OuterRef('pk')
+        ).order_by('-venda__data').values('venda__data')[:1]),
+        estoque_desde=Subquery(Lote.objects.filter(
+            produto=OuterRef('pk'), quantidade_atual__gt=0
+        ).order_by('data_entrada').values('data_entrada')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0022_produto_chegando_nome_normalizado'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='produto',
+            name='ultima_venda_em',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Última Venda'),
+        ),
+        migrations.AddField(
+            model_name='produto',
+            name='estoque_desde',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Em Estoque Desde'),
+        ),
+        migrations.RunPython(preencher_datas, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='produto',
+            index=models.Index(
+                django.db.models.functions.comparison.Coalesce('ultima_venda_em', 'estoque_desde'),
+                models.F('id'),
+                condition=models.Q(('ativo', True), ('estoque_atual__gt', 0)),
+                name='idx_produto_parado',
+            ),
+        ),
+    ]
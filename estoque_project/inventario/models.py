@@ -1,7 +1,16 @@
 from django.db import models
 from django.utils import timezone
 from decimal import Decimal
-from django.db.models import Sum, F
+from django.db.models import Sum, F, Q
+from django.db.models.functions import Coalesce
+import unicodedata
+
+
+def normalizar_texto(texto):
+    """Minúsculas, sem acentos e com espaços simples: 'Camisão  Básico' -> 'camisao basico'"""
+    texto = unicodedata.normalize('NFKD', texto or '')
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return ' '.join(texto.lower().split())
 
 class Fornecedor(models.Model):
     nome = models.CharField(max_length=255)
@@ -32,47 +41,70 @@ class Produto(models.Model):
         help_text='Quantidade mínima de dias que o estoque deve cobrir'
     )
     
+    # Totais desnormalizados dos lotes (mantidos por inventario.estoque)
+    estoque_atual = models.PositiveIntegerField('Estoque Atual', default=0, editable=False)
+    custo_estoque = models.DecimalField('Custo do Estoque', max_digits=12, decimal_places=2, default=Decimal('0.00'), editable=False)
+    # Datas dos produtos parados (mantidas por inventario.estoque): última venda e lote mais antigo com saldo
+    ultima_venda_em = models.DateTimeField('Última Venda', null=True, blank=True, editable=False)
+    estoque_desde = models.DateTimeField('Em Estoque Desde', null=True, blank=True, editable=False)
+    # Nome normalizado para busca (ver busca.py); no PostgreSQL tem índice GIN pg_trgm
+    nome_normalizado = models.CharField(max_length=255, default='', editable=False)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['ativo', 'estoque_atual'], name='idx_produto_ativo_estoque'),
+            # Produtos parados: ORDER BY COALESCE(ultima_venda_em, estoque_desde), id entre os ativos com estoque
+            models.Index(
+                Coalesce('ultima_venda_em', 'estoque_desde'), F('id'),
+                name='idx_produto_parado',
+                condition=Q(ativo=True, estoque_atual__gt=0),
+            ),
+        ]
+    
     def __str__(self):
         return self.nome
     
+    def save(self, *args, **kwargs):
+        self.nome_normalizado = normalizar_texto(self.nome)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'nome' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'nome_normalizado'}
+        super().save(*args, **kwargs)
+    
     @property
     def quantidade_total(self):
-        return self.lotes.aggregate(total=Sum('quantidade_atual'))['total'] or 0
+        return self.estoque_atual
     
     @property
     def custo_medio_ponderado(self):
-        lotes = self.lotes.filter(quantidade_atual__gt=0)
-        if not lotes.exists():
-            return Decimal('0.00')
-        
-        custo_total = sum(lote.quantidade_atual * lote.preco_compra for lote in lotes)
-        quantidade_total = sum(lote.quantidade_atual for lote in lotes)
-        
-        if quantidade_total == 0:
+        """Custo médio dos lotes com saldo, pelos totais mantidos em inventario.estoque (sem query)."""
+        if not self.estoque_atual:
             return Decimal('0.00')
-        
-        return custo_total / quantidade_total
+        return self.custo_estoque / self.estoque_atual
     
     @property
     def margem_lucro(self):
-        if not self.preco_venda or self.custo_medio_ponderado == 0:
+        custo_medio = self.custo_medio_ponderado
+        if not self.preco_venda or custo_medio == 0:
             return Decimal('0.00')
         
-        return ((self.preco_venda - self.custo_medio_ponderado) / self.preco_venda) * 100
+        return ((self.preco_venda - custo_medio) / self.preco_venda) * 100
     
     @property
     def quantidade_chegando(self):
-        """Quantidade de produtos chegando (pré-cadastro) com mesmo nome"""
-        # Import local para evitar circular import
-        from django.db.models import Sum as SumAgg
-        ProdutoCh = self.__class__.__module__.split('.')[0]
-        try:
-            return ProdutoChegando.objects.filter(
-                nome__iexact=self.nome,
-                incluido_estoque=False
-            ).aggregate(total=SumAgg('quantidade'))['total'] or 0
-        except:
-            return 0
+        """
+        Quantidade pendente em ProdutoChegando: vinculada a este produto ou, sem
+        vínculo, com o mesmo nome normalizado (se o produto estiver ativo). Usa a
+        anotação qtd_chegando (estoque.anotar_quantidade_chegando) quando presente.
+        """
+        if hasattr(self, 'qtd_chegando'):
+            return self.qtd_chegando
+        filtro = Q(produto_existente=self)
+        if self.ativo:
+            filtro |= Q(produto_existente__isnull=True, nome_normalizado=self.nome_normalizado)
+        return ProdutoChegando.objects.filter(filtro, incluido_estoque=False).aggregate(
+            total=Sum('quantidade')
+        )['total'] or 0
 
 class Lote(models.Model):
     produto = models.ForeignKey(Produto, related_name='lotes', on_delete=models.CASCADE)
@@ -110,25 +142,47 @@ class Venda(models.Model):
     parcelas = models.PositiveIntegerField('Número de Parcelas', default=1)
     taxa_aplicada = models.DecimalField('Taxa Aplicada (%)', max_digits=5, decimal_places=2, default=Decimal('0.00'))
 
+    # Resumo financeiro gravado ao criar/editar a venda e ao registrar devoluções
+    # (calculado por inventario.resumo_vendas; as properties abaixo leem estes campos)
+    valor_bruto_registrado = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'), editable=False)
+    custo_total_registrado = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'), editable=False)
+    meu_lucro_registrado = models.DecimalField(max_digits=16, decimal_places=6, default=Decimal('0.00'), editable=False)
+    quantidade_vendida_registrada = models.PositiveIntegerField(default=0, editable=False)
+    quantidade_devolvida_registrada = models.PositiveIntegerField(default=0, editable=False)
+    quantidade_brindes_registrada = models.PositiveIntegerField(default=0, editable=False)
+    valor_brindes_registrado = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'), editable=False)
+    possui_devolucao = models.BooleanField(default=False, editable=False)
+    resumo_atualizado_em = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # Paginação por cursor da listagem (ver paginacao.py)
+            models.Index(fields=['-data', '-id'], name='idx_venda_data_id'),
+        ]
+
     def __str__(self):
         from django.utils import timezone as tz
         data_local = tz.localtime(self.data)
         return f"Venda #{self.pk} - {data_local.strftime('%d/%m/%Y')}"
 
+    def atualizar_resumo(self):
+        """Recalcula e grava o resumo financeiro desta venda e os totais do seu dia"""
+        from .resumo_vendas import atualizar_resumo_vendas
+        from .vendas_diarias import atualizar_vendas_diarias
+        atualizar_resumo_vendas([self])
+        atualizar_vendas_diarias([self.data])
+
     @property
     def teve_devolucao(self):
-        return self.devolucoes.exists()
+        return self.possui_devolucao
     
     @property
     def quantidade_total_vendida(self):
-        return self.itens.aggregate(total=Sum('quantidade'))['total'] or 0
+        return self.quantidade_vendida_registrada
     
     @property
     def quantidade_total_devolvida(self):
-        total_devolvido = 0
-        for devolucao in self.devolucoes.all():
-            total_devolvido += devolucao.itens_devolvidos.aggregate(total=Sum('quantidade'))['total'] or 0
-        return total_devolvido
+        return self.quantidade_devolvida_registrada
     
     @property
     def tipo_devolucao(self):
@@ -146,7 +200,7 @@ class Venda(models.Model):
 
     @property
     def valor_bruto(self):
-        return self.itens.aggregate(total=Sum(F('quantidade') * F('preco_venda_unitario')))['total'] or Decimal('0.00')
+        return self.valor_bruto_registrado
 
     @property
     def valor_total(self):
@@ -154,23 +208,22 @@ class Venda(models.Model):
 
     @property
     def custo_total(self):
-        return sum(item.custo_compra_total_registrado for item in self.itens.all())
+        return self.custo_total_registrado
     
     @property
     def valor_brindes_dados(self):
         """Valor dos produtos dados como brinde (custo dos brindes)"""
-        brindes = self.itens.filter(eh_brinde=True)
-        return sum(item.custo_compra_total_registrado for item in brindes)
+        return self.valor_brindes_registrado
     
     @property
     def quantidade_brindes_dados(self):
         """Quantidade total de itens dados como brinde"""
-        return self.itens.filter(eh_brinde=True).aggregate(total=Sum('quantidade'))['total'] or 0
+        return self.quantidade_brindes_registrada
     
     @property
     def tem_brindes(self):
         """Verifica se a venda tem brindes"""
-        return self.itens.filter(eh_brinde=True).exists()
+        return self.quantidade_brindes_registrada > 0
 
     @property
     def lucro_bruto(self):
@@ -185,26 +238,45 @@ class Venda(models.Model):
     
     @property
     def meu_lucro(self):
-        lucro_bruto_venda = self.lucro_bruto
-        
-        lucro_revertido_devolucoes = self.devolucoes.aggregate(
-            total=Sum(F('itens_devolvidos__quantidade') * (F('itens_devolvidos__item_venda_original__preco_venda_unitario') - (F('itens_devolvidos__item_venda_original__custo_compra_total_registrado') / F('itens_devolvidos__item_venda_original__quantidade'))))
-        )['total'] or Decimal('0')
+        return self.meu_lucro_registrado
 
-        lucro_liquido = lucro_bruto_venda - lucro_revertido_devolucoes
+class VendaDiaria(models.Model):
+    """Totais diários das vendas concluídas (dia local × tipo de venda), usados pelo dashboard"""
+    data = models.DateField()
+    tipo_venda = models.CharField(max_length=10, choices=Venda.TIPO_VENDA_CHOICES)
+    receita = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    custo = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    taxa = models.DecimalField(max_digits=16, decimal_places=6, default=Decimal('0.00'))
+    meu_lucro = models.DecimalField(max_digits=16, decimal_places=6, default=Decimal('0.00'))
+    n_vendas = models.PositiveIntegerField(default=0)
 
-        # Desconta as taxas de pagamento do lucro ANTES de dividir por tipo de venda
-        # Taxa é aplicada sobre o valor total da venda
-        if self.taxa_aplicada > 0:
-            valor_taxa = (self.valor_total * self.taxa_aplicada) / 100
-            lucro_liquido = lucro_liquido - valor_taxa
-        
-        # Aplica divisão por tipo de venda APÓS descontar a taxa
-        # (na loja, tanto o lucro quanto as taxas são divididos com o sócio)
-        if self.tipo_venda == 'LOJA':
-            lucro_liquido = lucro_liquido / 2
-        
-        return lucro_liquido
+    class Meta:
+        verbose_name = 'Venda Diária'
+        verbose_name_plural = 'Vendas Diárias'
+        constraints = [
+            models.UniqueConstraint(fields=['data', 'tipo_venda'], name='uniq_vendadiaria_data_tipo'),
+        ]
+
+    def __str__(self):
+        return f"{self.data:%d/%m/%Y} - {self.get_tipo_venda_display()}: {self.n_vendas} venda(s)"
+
+class VendaDiariaProduto(models.Model):
+    """Quantidade, receita e custo vendidos de cada produto por dia local"""
+    data = models.DateField()
+    produto = models.ForeignKey('Produto', on_delete=models.CASCADE, related_name='vendas_diarias')
+    quantidade = models.PositiveIntegerField(default=0)
+    receita = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    custo = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+
+    class Meta:
+        verbose_name = 'Venda Diária por Produto'
+        verbose_name_plural = 'Vendas Diárias por Produto'
+        constraints = [
+            models.UniqueConstraint(fields=['data', 'produto'], name='uniq_vendadiariaprod_data_prod'),
+        ]
+
+    def __str__(self):
+        return f"{self.data:%d/%m/%Y} - {self.produto_id}: {self.quantidade} un."
 
 class ItemVenda(models.Model):
     venda = models.ForeignKey(Venda, related_name='itens', on_delete=models.CASCADE)
@@ -328,6 +400,11 @@ class Devolucao(models.Model):
     data = models.DateTimeField(default=timezone.now)
     motivo = models.TextField(blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-data', '-id'], name='idx_devolucao_data_id'),
+        ]
+
     def __str__(self):
         return f"Devolução da Venda #{self.venda_original.pk}"
 
@@ -367,12 +444,59 @@ class ProdutoChegando(models.Model):
     incluido_estoque = models.BooleanField('Já Incluído no Estoque', default=False)
     data_inclusao = models.DateTimeField('Data de Inclusão no Estoque', blank=True, null=True)
     produto_existente = models.ForeignKey(Produto, on_delete=models.SET_NULL, null=True, blank=True, related_name='produtos_chegando')
+    # Nome normalizado para casar com Produto.nome_normalizado quando não há produto_existente
+    nome_normalizado = models.CharField(max_length=255, default='', editable=False)
 
     class Meta:
         verbose_name = 'Produto Chegando'
         verbose_name_plural = 'Produtos Chegando'
         ordering = ['-data_compra']
+        indexes = [
+            models.Index(fields=['incluido_estoque', 'nome_normalizado'], name='idx_chegando_pendente_nome'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.nome_normalizado = normalizar_texto(self.nome)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'nome' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'nome_normalizado'}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         status = "✓ Incluído" if self.incluido_estoque else "⏳ Chegando"
         return f"{self.nome} ({self.quantidade} un.) - {status}"
+
+
+# -------- Previsão de Estoque (snapshot da análise de tendências) --------
+
+class PrevisaoEstoque(models.Model):
+    """Última previsão de reposição calculada para um produto (ver comando recalcular_previsoes)"""
+    produto = models.OneToOneField(Produto, on_delete=models.CASCADE, related_name='previsao')
+    dias_analise = models.PositiveIntegerField()
+    estoque_atual = models.PositiveIntegerField(default=0)
+    quantidade_chegando = models.PositiveIntegerField(default=0)
+    estoque_projetado = models.PositiveIntegerField(default=0)
+    total_vendido_periodo = models.PositiveIntegerField(default=0)
+    media_movel_7_dias = models.FloatField(default=0)
+    media_movel_14_dias = models.FloatField(default=0)
+    media_movel_30_dias = models.FloatField(default=0)
+    desvio_padrao = models.FloatField(default=0)
+    dias_cobertura_atual = models.FloatField(default=0)
+    ponto_reposicao = models.FloatField(default=0)
+    precisa_repor = models.BooleanField(default=False)
+    quantidade_sugerida = models.PositiveIntegerField(default=0)
+    urgencia = models.CharField(max_length=10)
+    tendencia = models.CharField(max_length=20)
+    variacao_percentual = models.FloatField(default=0)
+    dia_mais_vendas = models.CharField(max_length=3)
+    media_dia_mais_vendas = models.FloatField(default=0)
+    custo_estimado_reposicao = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    vendas_lista = models.JSONField(default=list)
+    calculado_em = models.DateTimeField()
+
+    class Meta:
+        verbose_name = 'Previsão de Estoque'
+        verbose_name_plural = 'Previsões de Estoque'
+
+    def __str__(self):
+        return f"{self.produto_id}: {self.urgencia} ({self.quantidade_sugerida} un. sugeridas)"
@@ -0,0 +1,289 @@
+"""
+Paginação por cursor (keyset) para as listagens.
+
+Em vez de COUNT(*) + OFFSET, cada página filtra a partir da última linha da
+página anterior: WHERE (campo, id) > (valor, id) ORDER BY campo, id LIMIT n+1.
+O custo da página N é o mesmo da página 1. Os cursores são opacos (JSON em
+base64) e carregam os valores da linha de referência, a direção e o número
+da página, só para exibição.
+
+O total exibido é aproximado: conta no máximo `contar_ate` linhas e, acima
+disso, usa a estimativa do planner no PostgreSQL (ou mostra "mais de N").
+
+As APIs JSON das listagens usam `resposta_paginada`: ?limit= e ?cursor= para
+carregar páginas sob demanda e ?fields= para escolher os campos devolvidos.
+As views async usam `aresposta_paginada` (KeysetPaginator.apagina/acontar,
+com o ORM assíncrono).
+"""
+import base64
+import binascii
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.db import connection
+from django.http import JsonResponse
+from django.db.models import F, Q
+from django.db.models.expressions import OrderBy
+
+POR_PAGINA_PADRAO = 20
+CONTAR_ATE_PADRAO = 1000
+LIMITE_API_PADRAO = 50
+LIMITE_API_MAXIMO = 200
+
+
+class CursorInvalido(ValueError):
+    pass
+
+
+def _serializar(valor):
+    if isinstance(valor, datetime):
+        return ['dt', valor.isoformat()]
+    if isinstance(valor, date):
+        return ['d', valor.isoformat()]
+    if isinstance(valor, Decimal):
+        return ['dec', str(valor)]
+    return ['v', valor]
+
+
+def _desserializar(item):
+    tipo, valor = item
+    if tipo == 'dt':
+        return datetime.fromisoformat(valor)
+    if tipo == 'd':
+        return date.fromisoformat(valor)
+    if tipo == 'dec':
+        return Decimal(valor)
+    return valor
+
+
+def codificar_cursor(valores, direcao, pagina):
+    dados = json.dumps({'v': [_serializar(valor) for valor in valores], 'd': direcao, 'p': pagina})
+    return base64.urlsafe_b64encode(dados.encode()).decode().rstrip('=')
+
+
+def decodificar_cursor(cursor):
+    try:
+        dados = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return [_desserializar(item) for item in dados['v']], dados['d'], int(dados['p'])
+    except (binascii.Error, ValueError, TypeError, KeyError, IndexError):
+        raise CursorInvalido(cursor)
+
+
+class PaginaCursor:
+    """Página de resultados com a mesma interface usada pelos templates (iterável, has_next...)."""
+
+    def __init__(self, objetos, numero, cursor_proximo, cursor_anterior, paginador):
+        self.object_list = objetos
+        self.number = numero
+        self.cursor_proximo = cursor_proximo
+        self.cursor_anterior = cursor_anterior
+        self.paginator = paginador
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+    def has_next(self):
+        return self.cursor_proximo is not None
+
+    def has_previous(self):
+        return self.cursor_anterior is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """
+    Paginador por cursor para um queryset e uma ordenação, por exemplo
+    ['-data', '-id'] ou ['nome', 'id']. O último campo precisa ser único (id).
+    Campos anotados podem ser usados desde que não sejam nulos.
+    """
+
+    def __init__(self, queryset, ordenacao, por_pagina=POR_PAGINA_PADRAO, contar_ate=CONTAR_ATE_PADRAO):
+        self.queryset = queryset
+        self.ordenacao = [(campo.lstrip('-'), campo.startswith('-')) for campo in ordenacao]
+        self.por_pagina = por_pagina
+        self.contar_ate = contar_ate
+        self._total = None
+
+    def _ordenar(self, queryset, invertido=False):
+        return queryset.order_by(*[
+            OrderBy(F(campo), descending=decrescente != invertido)
+            for campo, decrescente in self.ordenacao
+        ])
+
+    def _filtro_apos(self, valores, invertido=False):
+        """Linhas depois de `valores` na ordenação (antes, se invertido)."""
+        filtro = Q()
+        iguais = Q()
+        for (campo, decrescente), valor in zip(self.ordenacao, valores):
+            operador = 'lt' if decrescente != invertido else 'gt'
+            filtro |= iguais & Q(**{f'{campo}__{operador}': valor})
+            iguais &= Q(**{campo: valor})
+        return filtro
+
+    def _valores(self, objeto):
+        return [getattr(objeto, campo) for campo, _ in self.ordenacao]
+
+    def _consulta(self, cursor):
+        """(queryset da página com uma linha a mais, valores do cursor, anterior?, número da página)."""
+        valores, direcao, numero = None, 'p', 1
+        if cursor:
+            try:
+                valores, direcao, numero = decodificar_cursor(cursor)
+            except CursorInvalido:
+                valores, direcao, numero = None, 'p', 1
+
+        anterior = valores is not None and direcao == 'a'
+        queryset = self.queryset
+        if valores is not None:
+            queryset = queryset.filter(self._filtro_apos(valores, invertido=anterior))
+        return self._ordenar(queryset, invertido=anterior)[:self.por_pagina + 1], valores, anterior, numero
+
+    def pagina(self, cursor=None):
+        """Página indicada pelo cursor (a primeira se o cursor for vazio ou inválido)."""
+        queryset, valores, anterior, numero = self._consulta(cursor)
+        return self._montar_pagina(list(queryset), valores, anterior, numero)
+
+    async def apagina(self, cursor=None):
+        """Versão async de `pagina`."""
+        queryset, valores, anterior, numero = self._consulta(cursor)
+        return self._montar_pagina([objeto async for objeto in queryset], valores, anterior, numero)
+
+    def _montar_pagina(self, objetos, valores, anterior, numero):
+        tem_mais = len(objetos) > self.por_pagina
+        objetos = objetos[:self.por_pagina]
+        if anterior:
+            objetos.reverse()
+            tem_proxima, tem_anterior = True, tem_mais
+        else:
+            tem_proxima, tem_anterior = tem_mais, valores is not None
+
+        if not objetos:
+            return PaginaCursor([], numero, None, None, self)
+        cursor_proximo = codificar_cursor(self._valores(objetos[-1]), 'p', numero + 1) if tem_proxima else None
+        cursor_anterior = codificar_cursor(self._valores(objetos[0]), 'a', numero - 1) if tem_anterior else None
+        return PaginaCursor(objetos, max(numero, 1), cursor_proximo, cursor_anterior, self)
+
+    @property
+    def count(self):
+        """Total aproximado: exato até `contar_ate`, estimado acima disso."""
+        if self._total is None:
+            self._total = self._contar()
+        return self._total[0]
+
+    @property
+    def total_exibicao(self):
+        """Total para exibir: '842', '~12.000' (estimativa) ou 'mais de 1.000'."""
+        total = self.count
+        tipo = self._total[1]
+        numero = f'{total:,}'.replace(',', '.')
+        if tipo == 'estimado':
+            return f'~{numero}'
+        if tipo == 'minimo':
+            return f'mais de {numero}'
+        return numero
+
+    async def acontar(self):
+        """Versão async de `count` (preenche o total usado por total_exibicao)."""
+        if self._total is None:
+            limitado = await self.queryset.order_by()[:self.contar_ate + 1].acount()
+            estimativa = None
+            if limitado > self.contar_ate and connection.vendor == 'postgresql':
+                estimativa = await sync_to_async(_estimativa_postgresql)(self.queryset.order_by())
+            self._total = self._classificar_total(limitado, estimativa)
+        return self._total[0]
+
+    def _contar(self):
+        limitado = self.queryset.order_by()[:self.contar_ate + 1].count()
+        estimativa = None
+        if limitado > self.contar_ate and connection.vendor == 'postgresql':
+            estimativa = _estimativa_postgresql(self.queryset.order_by())
+        return self._classificar_total(limitado, estimativa)
+
+    def _classificar_total(self, limitado, estimativa):
+        if limitado <= self.contar_ate:
+            return limitado, 'exato'
+        if estimativa is not None and estimativa > self.contar_ate:
+            return estimativa, 'estimado'
+        return self.contar_ate, 'minimo'
+
+
+def _estimativa_postgresql(queryset):
+    """Número de linhas estimado pelo planner (EXPLAIN), sem executar a consulta."""
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plano = cursor.fetchone()[0]
+    if isinstance(plano, str):
+        plano = json.loads(plano)
+    return int(plano[0]['Plan']['Plan Rows'])
+
+
+def paginar(request, queryset, ordenacao, por_pagina=POR_PAGINA_PADRAO):
+    """Atalho para as views: lê ?cursor= e devolve a página."""
+    return KeysetPaginator(queryset, ordenacao, por_pagina).pagina(request.GET.get('cursor'))
+
+
+def limite_api(valor):
+    """Tamanho da página das APIs: ?limit= (se válido) ou LIMITE_API_PADRAO, até LIMITE_API_MAXIMO."""
+    try:
+        limite = int(valor) if valor else LIMITE_API_PADRAO
+    except (TypeError, ValueError):
+        limite = LIMITE_API_PADRAO
+    return max(1, min(limite, LIMITE_API_MAXIMO))
+
+
+def campos_pedidos(request, campos):
+    """
+    Subconjunto de `campos` ({nome: função(objeto)}) pedido em ?fields=a,b,c.
+    Sem o parâmetro (ou só com nomes desconhecidos) devolve todos.
+    """
+    nomes = [nome.strip() for nome in request.GET.get('fields', '').split(',') if nome.strip() in campos]
+    if not nomes:
+        return dict(campos)
+    return {nome: campos[nome] for nome in dict.fromkeys(['id', *nomes]) if nome in campos}
+
+
+def resposta_paginada(request, queryset, ordenacao, campos, chave):
+    """
+    JsonResponse com uma página do queryset serializada pelos `campos`:
+    {chave: [...], 'quantidade', 'proximo_cursor', 'tem_mais'} e, na primeira
+    página, 'total' e 'total_exibicao' (aproximados, ver KeysetPaginator).
+    """
+    cursor = request.GET.get('cursor')
+    paginador = KeysetPaginator(queryset, ordenacao, limite_api(request.GET.get('limit')))
+    pagina = paginador.pagina(cursor)
+    return JsonResponse(_dados_pagina(paginador, pagina, campos, chave, cursor))
+
+
+async def aresposta_paginada(request, queryset, ordenacao, campos, chave):
+    """Versão async de `resposta_paginada` (os `campos` não podem fazer queries)."""
+    cursor = request.GET.get('cursor')
+    paginador = KeysetPaginator(queryset, ordenacao, limite_api(request.GET.get('limit')))
+    pagina = await paginador.apagina(cursor)
+    if not cursor:
+        # Deixa o total calculado para _dados_pagina
+        await paginador.acontar()
+    return JsonResponse(_dados_pagina(paginador, pagina, campos, chave, cursor))
+
+
+def _dados_pagina(paginador, pagina, campos, chave, cursor):
+    dados = {
+        chave: [{nome: serializar(objeto) for nome, serializar in campos.items()} for objeto in pagina],
+        'quantidade': len(pagina),
+        'proximo_cursor': pagina.cursor_proximo,
+        'tem_mais': pagina.has_next(),
+    }
+    if not cursor:
+        dados['total'] = paginador.count
+        dados['total_exibicao'] = paginador.total_exibicao
+    return dados
@@ -0,0 +1,122 @@
+"""
+Snapshot da análise de tendências (PrevisaoEstoque).
+
+O comando recalcular_previsoes grava aqui o resultado de
+tendencias.analisar_produtos; a view de análise de tendências lê o snapshot
+em vez de recalcular tudo a cada acesso.
+"""
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from .models import Configuracao, ItemVenda, Lote, Produto, ProdutoChegando, PrevisaoEstoque
+from .tendencias import analisar_produtos, ESTILOS_TENDENCIA, CLASSES_URGENCIA
+
+CAMPOS_PREVISAO = [
+    'estoque_atual', 'quantidade_chegando', 'estoque_projetado', 'total_vendido_periodo',
+    'media_movel_7_dias', 'media_movel_14_dias', 'media_movel_30_dias', 'desvio_padrao',
+    'dias_cobertura_atual', 'ponto_reposicao', 'precisa_repor', 'quantidade_sugerida',
+    'urgencia', 'tendencia', 'variacao_percentual', 'dia_mais_vendas', 'media_dia_mais_vendas',
+    'vendas_lista',
+]
+
+# Médias exibidas sem formatação: inteiras voltam como int, como na análise calculada na hora
+CAMPOS_MEDIA = ['media_movel_7_dias', 'media_movel_14_dias', 'media_movel_30_dias', 'media_dia_mais_vendas']
+
+
+def ultima_atualizacao():
+    return PrevisaoEstoque.objects.aggregate(ultima=Max('calculado_em'))['ultima']
+
+
+def previsoes_desatualizadas():
+    """Previsões calculadas antes de hoje: a janela de análise já andou desde então."""
+    inicio_hoje = timezone.make_aware(datetime.combine(timezone.localdate(), time.min))
+    return PrevisaoEstoque.objects.filter(calculado_em__lt=inicio_hoje)
+
+
+def produtos_alterados_desde(momento):
+    """
+    Ids dos produtos com vendas (criadas, editadas ou com devolução), lotes ou
+    compras a caminho registrados desde `momento`.
+    """
+    produto_ids = set(ItemVenda.objects.filter(
+        venda__resumo_atualizado_em__gte=momento
+    ).values_list('produto_id', flat=True))
+    produto_ids.update(Lote.objects.filter(data_entrada__gte=momento).values_list('produto_id', flat=True))
+    chegando = ProdutoChegando.objects.filter(
+        Q(data_compra__gte=timezone.localtime(momento).date()) | Q(data_inclusao__gte=momento)
+    )
+    produto_ids.update(chegando.filter(
+        produto_existente__isnull=False
+    ).values_list('produto_existente_id', flat=True))
+    # Sem vínculo, a compra conta para o produto ativo de mesmo nome (estoque.anotar_quantidade_chegando)
+    produto_ids.update(Produto.objects.filter(
+        ativo=True,
+        nome_normalizado__in=chegando.filter(produto_existente__isnull=True).values('nome_normalizado'),
+    ).values_list('id', flat=True))
+    return produto_ids
+
+
+def recalcular_previsoes(produto_ids=None):
+    """
+    Recalcula o snapshot de todos os produtos (ou só dos informados, mais os
+    calculados antes de hoje) e retorna a quantidade de previsões gravadas.
+    Produtos sem vendas na janela saem do snapshot.
+    """
+    config, _ = Configuracao.objects.get_or_create()
+    dias_analise = config.dias_analise_tendencias
+    agora = timezone.now()
+
+    # Se o período de análise mudou, o snapshot inteiro precisa ser refeito
+    if produto_ids is not None and PrevisaoEstoque.objects.exclude(dias_analise=dias_analise).exists():
+        produto_ids = None
+    if produto_ids is not None:
+        produto_ids = set(produto_ids) | set(previsoes_desatualizadas().values_list('produto_id', flat=True))
+    data_inicio = timezone.localtime(agora).date() - timedelta(days=dias_analise - 1)
+
+    analises = analisar_produtos(data_inicio, dias_analise, produto_ids)
+    previsoes = [
+        PrevisaoEstoque(
+            produto=analise['produto'],
+            dias_analise=dias_analise,
+            custo_estimado_reposicao=analise['custo_estimado_reposicao'].quantize(Decimal('0.01')),
+            calculado_em=agora,
+            **{campo: analise[campo] for campo in CAMPOS_PREVISAO}
+        )
+        for analise in analises
+    ]
+
+    existentes = PrevisaoEstoque.objects.all()
+    if produto_ids is not None:
+        existentes = existentes.filter(produto_id__in=produto_ids)
+    with transaction.atomic():
+        existentes.delete()
+        PrevisaoEstoque.objects.bulk_create(previsoes, batch_size=500)
+    return len(previsoes)
+
+
+def analises_do_snapshot():
+    """
+    Retorna (análises no formato do template, cálculo mais antigo, dias_analise)
+    lidos do snapshot; ([], None, None) se ele estiver vazio.
+    """
+    analises = []
+    calculado_em = None
+    dias_analise = None
+    for previsao in PrevisaoEstoque.objects.select_related('produto').order_by('produto_id'):
+        analise = {campo: getattr(previsao, campo) for campo in CAMPOS_PREVISAO}
+        for campo in CAMPOS_MEDIA:
+            if float(analise[campo]).is_integer():
+                analise[campo] = int(analise[campo])
+        analise['produto'] = previsao.produto
+        analise['custo_estimado_reposicao'] = previsao.custo_estimado_reposicao
+        analise['tendencia_icon'], analise['tendencia_class'] = ESTILOS_TENDENCIA[previsao.tendencia]
+        analise['urgencia_class'] = CLASSES_URGENCIA[previsao.urgencia]
+        analises.append(analise)
+        if calculado_em is None or previsao.calculado_em < calculado_em:
+            calculado_em = previsao.calculado_em
+        dias_analise = previsao.dias_analise
+    return analises, calculado_em, dias_analise
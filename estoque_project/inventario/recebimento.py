@@ -0,0 +1,93 @@
+"""
+Recebimento em lote de produtos chegando (ProdutoChegando -> Lote).
+
+Mesmas regras de views.incluir_no_estoque, para vários registros de uma vez:
+usa o produto vinculado (produto_existente) ou um produto ativo com o mesmo
+nome e, se não houver, cria o produto. Os produtos são resolvidos em uma
+query, produtos e lotes são gravados com bulk_create, os totais de estoque
+com um UPDATE e os registros são marcados como incluídos com outro, tudo na
+mesma transação.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .estoque import ajustar_estoque
+from .models import Produto, Lote, ProdutoChegando, normalizar_texto
+
+
+@transaction.atomic
+def receber_produtos_chegando(ids=None, fornecedor_id=None, precos=None):
+    """
+    Inclui no estoque os ProdutoChegando pendentes com os `ids` informados
+    ou, com `fornecedor_id`, todos os pendentes desse fornecedor.
+    `precos` ({id do ProdutoChegando: preço de venda}) define o preço dos
+    produtos criados. Retorna (registros recebidos, produtos criados).
+    """
+    precos = precos or {}
+    pendentes = ProdutoChegando.objects.select_for_update().filter(incluido_estoque=False)
+    if ids is not None:
+        pendentes = pendentes.filter(pk__in=ids)
+    elif fornecedor_id is not None:
+        pendentes = pendentes.filter(fornecedor_id=fornecedor_id)
+    else:
+        raise ValueError('Informe os produtos ou o fornecedor a receber.')
+    pendentes = list(pendentes.order_by('pk'))
+    if not pendentes:
+        return [], []
+
+    vinculados = {chegando.produto_existente_id for chegando in pendentes if chegando.produto_existente_id}
+    nomes = {normalizar_texto(chegando.nome) for chegando in pendentes if not chegando.produto_existente_id}
+    produtos = Produto.objects.filter(
+        Q(pk__in=vinculados) | Q(ativo=True, nome_normalizado__in=nomes)
+    ).only('id', 'nome_normalizado', 'ativo').order_by('pk')
+    por_id = {}
+    por_nome = {}
+    for produto in produtos:
+        por_id[produto.pk] = produto
+        if produto.ativo:
+            por_nome.setdefault(produto.nome_normalizado, produto)
+
+    novos = {}
+    for chegando in pendentes:
+        if chegando.produto_existente_id:
+            continue
+        nome = normalizar_texto(chegando.nome)
+        if nome not in por_nome and nome not in novos:
+            # bulk_create não chama save(): o nome normalizado é preenchido aqui
+            preco = precos.get(chegando.pk)
+            novos[nome] = Produto(
+                nome=chegando.nome,
+                nome_normalizado=nome,
+                fornecedor_id=chegando.fornecedor_id,
+                preco_venda=Decimal(str(preco)) if preco not in (None, '') else None,
+                ativo=True,
+            )
+    Produto.objects.bulk_create(novos.values())
+    por_nome.update(novos)
+
+    lotes = []
+    deltas = {}
+    for chegando in pendentes:
+        if chegando.produto_existente_id:
+            produto = por_id[chegando.produto_existente_id]
+        else:
+            produto = por_nome[normalizar_texto(chegando.nome)]
+        lotes.append(Lote(
+            produto=produto,
+            quantidade_inicial=chegando.quantidade,
+            quantidade_atual=chegando.quantidade,
+            preco_compra=chegando.preco_compra,
+        ))
+        quantidade, custo = deltas.get(produto.pk, (0, Decimal('0.00')))
+        deltas[produto.pk] = (quantidade + chegando.quantidade, custo + chegando.quantidade * chegando.preco_compra)
+    Lote.objects.bulk_create(lotes)
+    ajustar_estoque(deltas)
+
+    ProdutoChegando.objects.filter(pk__in=[chegando.pk for chegando in pendentes]).update(
+        incluido_estoque=True,
+        data_inclusao=timezone.now(),
+    )
+    return pendentes, list(novos.values())
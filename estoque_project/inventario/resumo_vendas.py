@@ -0,0 +1,118 @@
+"""
+Cálculo do resumo financeiro gravado em Venda.
+
+As properties de Venda (valor_bruto, custo_total, meu_lucro, tipo_devolucao...)
+leem os campos *_registrado(a). Este módulo recalcula esses campos para um
+conjunto de vendas com três queries, independente de quantas vendas
+ou itens estejam envolvidos.
+"""
+from decimal import Decimal
+
+from django.db.models import Sum, F, Q
+from django.utils import timezone
+
+from .models import Venda, ItemVenda, Devolucao, ItemDevolucao
+
+CAMPOS_RESUMO = [
+    'valor_bruto_registrado',
+    'custo_total_registrado',
+    'meu_lucro_registrado',
+    'quantidade_vendida_registrada',
+    'quantidade_devolvida_registrada',
+    'quantidade_brindes_registrada',
+    'valor_brindes_registrado',
+    'possui_devolucao',
+    'resumo_atualizado_em',
+]
+
+CASAS_MEU_LUCRO = Decimal('0.000001')
+
+
+def calcular_meu_lucro(valor_bruto, custo_total, lucro_revertido, desconto, taxa_aplicada, tipo_venda):
+    """
+    Lucro que cabe à empresa em uma venda.
+
+    Lucro bruto menos o lucro revertido pelas devoluções, menos a taxa de pagamento
+    (aplicada sobre o valor total da venda). Na LOJA, o resultado é dividido com o
+    sócio (por isso a divisão acontece depois de descontar a taxa).
+    """
+    valor_total = valor_bruto - desconto
+    lucro_liquido = (valor_total - custo_total) - lucro_revertido
+
+    if taxa_aplicada > 0:
+        valor_taxa = (valor_total * taxa_aplicada) / 100
+        lucro_liquido = lucro_liquido - valor_taxa
+
+    if tipo_venda == 'LOJA':
+        lucro_liquido = lucro_liquido / 2
+
+    return lucro_liquido
+
+
+def atualizar_resumo_vendas(vendas):
+    """
+    Recalcula e grava o resumo financeiro das vendas informadas.
+
+    `vendas` é uma lista de instâncias de Venda; os campos também são atualizados
+    nas próprias instâncias, que podem continuar sendo usadas após a chamada.
+    """
+    vendas = [venda for venda in vendas if venda.pk]
+    if not vendas:
+        return
+    venda_ids = [venda.pk for venda in vendas]
+
+    totais_itens = {
+        linha['venda_id']: linha
+        for linha in ItemVenda.objects.filter(venda_id__in=venda_ids).values('venda_id').annotate(
+            valor_bruto=Sum(F('quantidade') * F('preco_venda_unitario')),
+            custo_total=Sum('custo_compra_total_registrado'),
+            quantidade_vendida=Sum('quantidade'),
+            quantidade_brindes=Sum('quantidade', filter=Q(eh_brinde=True)),
+            valor_brindes=Sum('custo_compra_total_registrado', filter=Q(eh_brinde=True)),
+        ).order_by()
+    }
+
+    # Lucro revertido por devolução: quantidade devolvida * (preço unitário - custo unitário)
+    totais_devolucoes = {}
+    for linha in ItemDevolucao.objects.filter(devolucao__venda_original_id__in=venda_ids).values(
+        'devolucao__venda_original_id',
+        'quantidade',
+        'item_venda_original__preco_venda_unitario',
+        'item_venda_original__custo_compra_total_registrado',
+        'item_venda_original__quantidade',
+    ):
+        totais = totais_devolucoes.setdefault(
+            linha['devolucao__venda_original_id'],
+            {'quantidade': 0, 'lucro_revertido': Decimal('0')}
+        )
+        custo_unitario = linha['item_venda_original__custo_compra_total_registrado'] / linha['item_venda_original__quantidade']
+        totais['quantidade'] += linha['quantidade']
+        totais['lucro_revertido'] += linha['quantidade'] * (linha['item_venda_original__preco_venda_unitario'] - custo_unitario)
+
+    vendas_com_devolucao = set(
+        Devolucao.objects.filter(venda_original_id__in=venda_ids).values_list('venda_original_id', flat=True)
+    )
+
+    agora = timezone.now()
+    for venda in vendas:
+        itens = totais_itens.get(venda.pk, {})
+        devolucoes = totais_devolucoes.get(venda.pk, {})
+
+        venda.valor_bruto_registrado = itens.get('valor_bruto') or Decimal('0.00')
+        venda.custo_total_registrado = itens.get('custo_total') or Decimal('0.00')
+        venda.quantidade_vendida_registrada = itens.get('quantidade_vendida') or 0
+        venda.quantidade_brindes_registrada = itens.get('quantidade_brindes') or 0
+        venda.valor_brindes_registrado = itens.get('valor_brindes') or Decimal('0.00')
+        venda.quantidade_devolvida_registrada = devolucoes.get('quantidade') or 0
+        venda.possui_devolucao = venda.pk in vendas_com_devolucao
+        venda.meu_lucro_registrado = calcular_meu_lucro(
+            venda.valor_bruto_registrado,
+            venda.custo_total_registrado,
+            devolucoes.get('lucro_revertido') or Decimal('0'),
+            venda.desconto,
+            venda.taxa_aplicada,
+            venda.tipo_venda,
+        ).quantize(CASAS_MEU_LUCRO)
+        venda.resumo_atualizado_em = agora
+
+    Venda.objects.bulk_update(vendas, CAMPOS_RESUMO, batch_size=500)
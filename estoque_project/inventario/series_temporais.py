@@ -0,0 +1,104 @@
+"""
+Séries temporais dos gráficos do dashboard.
+
+`serie_temporal` agrupa um queryset por dia, semana ou mês local
+(TIME_ZONE, America/Sao_Paulo) no próprio banco — TruncDate/TruncWeek/
+TruncMonth com o fuso para campos DateTimeField, truncamento simples para
+DateField (tabela diária) —, preenche com zero os períodos sem dados e
+devolve listas paralelas prontas para json.dumps (com DjangoJSONEncoder,
+por causa dos Decimals).
+
+`niveis` classifica todos os valores de uma série em uma única passada
+(bisect sobre os cortes), como os níveis de cor do heatmap.
+"""
+from bisect import bisect_left
+from datetime import timedelta
+from decimal import Decimal
+from zoneinfo import ZoneInfo
+
+from django.conf import settings
+from django.db.models import DateField, DateTimeField, F
+from django.db.models.functions import TruncDate, TruncMonth, TruncWeek
+
+FORMATOS_ROTULO = {
+    'dia': '%d/%m',
+    'semana': '%d/%m',
+    'mes': '%b/%y',
+}
+
+
+def inicio_do_periodo(dia, unidade):
+    """Primeiro dia do período (dia, semana começando na segunda ou mês) que contém `dia`."""
+    if unidade == 'semana':
+        return dia - timedelta(days=dia.weekday())
+    if unidade == 'mes':
+        return dia.replace(day=1)
+    return dia
+
+
+def periodos(inicio, fim, unidade):
+    """Primeiros dias de todos os períodos entre `inicio` e `fim` (inclusive)."""
+    atual = inicio_do_periodo(inicio, unidade)
+    resultado = []
+    while atual <= fim:
+        resultado.append(atual)
+        if unidade == 'semana':
+            atual += timedelta(days=7)
+        elif unidade == 'mes':
+            atual = (atual + timedelta(days=32)).replace(day=1)
+        else:
+            atual += timedelta(days=1)
+    return resultado
+
+
+def truncar(modelo, campo, unidade):
+    """Expressão que leva `campo` ao primeiro dia do seu período local."""
+    if unidade not in FORMATOS_ROTULO:
+        raise ValueError(f'Unidade desconhecida: {unidade}')
+    com_hora = isinstance(modelo._meta.get_field(campo), DateTimeField)
+    fuso = {'tzinfo': ZoneInfo(settings.TIME_ZONE)} if com_hora else {}
+    if unidade == 'dia':
+        return TruncDate(campo, **fuso) if com_hora else F(campo)
+    funcao = TruncWeek if unidade == 'semana' else TruncMonth
+    return funcao(campo, output_field=DateField(), **fuso)
+
+
+def serie_temporal(queryset, campo, valores, unidade, inicio, fim):
+    """
+    Soma as agregações `valores` ({nome: Sum(...)}) de `queryset` por período
+    entre as datas locais `inicio` e `fim`. Retorna
+    {'datas': [iso], 'rotulos': [...], 'series': {nome: [valor]}}, com um
+    elemento por período, inclusive os sem dados (zero).
+    """
+    if isinstance(queryset.model._meta.get_field(campo), DateTimeField):
+        filtro = {f'{campo}__date__range': [inicio, fim]}
+    else:
+        filtro = {f'{campo}__range': [inicio, fim]}
+    linhas = queryset.filter(**filtro).annotate(
+        periodo_serie=truncar(queryset.model, campo, unidade)
+    ).values('periodo_serie').annotate(**valores).order_by()
+    por_periodo = {linha['periodo_serie']: linha for linha in linhas}
+
+    datas = periodos(inicio, fim, unidade)
+    vazio = {}
+    return {
+        'datas': [dia.isoformat() for dia in datas],
+        'rotulos': [dia.strftime(FORMATOS_ROTULO[unidade]) for dia in datas],
+        'series': {
+            nome: [por_periodo.get(dia, vazio).get(nome) or Decimal('0') for dia in datas]
+            for nome in valores
+        },
+    }
+
+
+def cortes_do_maximo(valores, fracoes=(Decimal('0.25'), Decimal('0.50'), Decimal('0.75'))):
+    """Cortes dos níveis como frações do maior valor (o primeiro corte é zero)."""
+    maximo = max(valores, default=0)
+    if maximo <= 0:
+        return []
+    return [Decimal('0')] + [maximo * fracao for fracao in fracoes]
+
+
+def niveis(valores, cortes):
+    """Nível de cada valor: quantos cortes (ordenados) ele ultrapassa."""
+    return [bisect_left(cortes, valor) for valor in valores]
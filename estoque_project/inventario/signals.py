@@ -0,0 +1,33 @@
+"""
+Receivers que invalidam o cache do dashboard e o catálogo em memória quando
+os dados exibidos mudam.
+
+Operações em lote (bulk_create, bulk_update, queryset.update) não disparam
+sinais; por isso estoque.ajustar_estoque e vendas_diarias.atualizar_vendas_diarias
+também agendam a invalidação diretamente.
+"""
+from django.db.models.signals import post_save, post_delete
+
+from .cache_dashboard import agendar_invalidacao
+from .catalogo import agendar_invalidacao_catalogo
+from .models import Produto, Lote, Venda, ItemVenda, Devolucao, ItemDevolucao, Configuracao
+
+MODELOS_DASHBOARD = (Produto, Lote, Venda, ItemVenda, Devolucao, ItemDevolucao, Configuracao)
+MODELOS_CATALOGO = (Produto, Lote)
+
+
+def invalidar_cache_dashboard(sender, **kwargs):
+    agendar_invalidacao()
+
+
+def invalidar_catalogo(sender, **kwargs):
+    agendar_invalidacao_catalogo()
+
+
+def conectar_sinais():
+    for modelo in MODELOS_DASHBOARD:
+        post_save.connect(invalidar_cache_dashboard, sender=modelo, dispatch_uid=f'dashboard_save_{modelo.__name__}')
+        post_delete.connect(invalidar_cache_dashboard, sender=modelo, dispatch_uid=f'dashboard_delete_{modelo.__name__}')
+    for modelo in MODELOS_CATALOGO:
+        post_save.connect(invalidar_catalogo, sender=modelo, dispatch_uid=f'catalogo_save_{modelo.__name__}')
+        post_delete.connect(invalidar_catalogo, sender=modelo, dispatch_uid=f'catalogo_delete_{modelo.__name__}')
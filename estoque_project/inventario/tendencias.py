@@ -0,0 +1,269 @@
+"""
+Motor da análise de tendências de vendas.
+
+Uma única query agrupada traz a quantidade vendida por produto e por dia na
+janela analisada; o resultado é pivotado em uma matriz produto x dia e as
+estatísticas (médias móveis, desvio padrão, tendência entre as metades do
+período e sazonalidade por dia da semana) são calculadas a partir de somas
+da matriz, sem nenhuma query por produto.
+
+As médias seguem a semântica de statistics.mean para inteiros (int quando a
+divisão é exata, float caso contrário), que é o que o template exibe.
+"""
+from datetime import datetime, time
+from decimal import Decimal
+from math import sqrt
+
+from django.db.models import Sum, OuterRef, Subquery
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .estoque import anotar_quantidade_chegando
+from .models import Produto, Lote, ItemVenda
+
+DIAS_SEMANA = ['Seg', 'Ter', 'Qua', 'Qui', 'Sex', 'Sáb', 'Dom']
+
+# tendência -> (ícone, classe do badge)
+ESTILOS_TENDENCIA = {
+    'crescente': ('📈', 'success'),
+    'decrescente': ('📉', 'danger'),
+    'estável': ('➡️', 'info'),
+    'dados insuficientes': ('❓', 'secondary'),
+}
+
+CLASSES_URGENCIA = {
+    'alta': 'danger',
+    'média': 'warning',
+    'baixa': 'success',
+}
+
+
+def _media(soma, n):
+    return soma // n if soma % n == 0 else soma / n
+
+
+def matriz_vendas(data_inicio, dias, produto_ids=None):
+    """
+    {produto_id: [quantidade por dia]} das vendas concluídas (sem brindes) de
+    produtos ativos, com `dias` posições a partir de `data_inicio`.
+    Produtos sem venda na janela não aparecem.
+    """
+    inicio = timezone.make_aware(datetime.combine(data_inicio, time.min))
+    itens = ItemVenda.objects.filter(
+        venda__data__gte=inicio,
+        venda__status='CONCLUIDA',
+        eh_brinde=False,
+        produto__ativo=True,
+    )
+    if produto_ids is not None:
+        itens = itens.filter(produto_id__in=produto_ids)
+
+    matriz = {}
+    for linha in itens.annotate(dia=TruncDate('venda__data')).values('produto_id', 'dia').annotate(
+        quantidade_dia=Sum('quantidade')
+    ).order_by():
+        posicao = (linha['dia'] - data_inicio).days
+        if 0 <= posicao < dias and linha['quantidade_dia']:
+            matriz.setdefault(linha['produto_id'], [0] * dias)[posicao] += linha['quantidade_dia']
+    return matriz
+
+
+def estatisticas_vendas(vendas_lista, data_inicio):
+    """Médias móveis, desvio padrão, tendência e sazonalidade de uma linha da matriz."""
+    n = len(vendas_lista)
+
+    # Somas acumuladas: qualquer janela final sai em O(1)
+    acumulado = [0]
+    soma_quadrados = 0
+    for qtd in vendas_lista:
+        acumulado.append(acumulado[-1] + qtd)
+        soma_quadrados += qtd * qtd
+    total = acumulado[-1]
+
+    def media_ultimos(dias):
+        dias = min(dias, n)
+        return _media(total - acumulado[n - dias], dias)
+
+    if n > 1:
+        desvio_padrao = sqrt((n * soma_quadrados - total * total) / (n * (n - 1)))
+    else:
+        desvio_padrao = 0
+
+    if n >= 14:
+        metade = n // 2
+        media_primeira_metade = _media(acumulado[metade], metade)
+        media_segunda_metade = _media(total - acumulado[metade], n - metade)
+        if media_primeira_metade > 0:
+            variacao_percentual = ((media_segunda_metade - media_primeira_metade) / media_primeira_metade) * 100
+        elif media_segunda_metade > 0:
+            variacao_percentual = 100
+        else:
+            variacao_percentual = 0
+    else:
+        variacao_percentual = None
+
+    # Sazonalidade: soma e contagem por dia da semana (0 = Segunda)
+    primeiro_dia_semana = data_inicio.weekday()
+    somas_semana = [0] * 7
+    contagens_semana = [0] * 7
+    for i, qtd in enumerate(vendas_lista):
+        dia_semana = (primeiro_dia_semana + i) % 7
+        somas_semana[dia_semana] += qtd
+        contagens_semana[dia_semana] += 1
+    medias_dia_semana = {
+        DIAS_SEMANA[dia]: _media(somas_semana[dia], contagens_semana[dia])
+        for dia in range(7) if contagens_semana[dia]
+    }
+
+    return {
+        'total_vendido_periodo': total,
+        'media_movel_7_dias': media_ultimos(7),
+        'media_movel_14_dias': media_ultimos(14),
+        'media_movel_30_dias': media_ultimos(30),
+        'desvio_padrao': desvio_padrao,
+        'variacao_percentual': variacao_percentual,
+        'medias_dia_semana': medias_dia_semana,
+    }
+
+
+def analisar_produto(produto, vendas_lista, data_inicio):
+    """
+    Dicionário de análise de um produto (o formato que o template espera).
+
+    `produto` precisa estar anotado com qtd_chegando e ultimo_preco_compra
+    (ver produtos_para_analise).
+    """
+    estatisticas = estatisticas_vendas(vendas_lista, data_inicio)
+    total_vendido_periodo = estatisticas['total_vendido_periodo']
+    
+    # Médias móveis e desvio padrão (volatilidade)
+    media_movel_7_dias = estatisticas['media_movel_7_dias']
+    media_movel_14_dias = estatisticas['media_movel_14_dias']
+    media_movel_30_dias = estatisticas['media_movel_30_dias']
+    desvio_padrao = estatisticas['desvio_padrao']
+    
+    # Tendência: comparar segunda metade do período com primeira metade
+    # Requer pelo menos 14 dias de dados (7 dias em cada metade)
+    variacao_percentual = estatisticas['variacao_percentual']
+    if variacao_percentual is not None:
+        if variacao_percentual > 15:
+            tendencia = 'crescente'
+        elif variacao_percentual < -15:
+            tendencia = 'decrescente'
+        else:
+            tendencia = 'estável'
+    else:
+        variacao_percentual = 0
+        tendencia = 'dados insuficientes'
+    tendencia_icon, tendencia_class = ESTILOS_TENDENCIA[tendencia]
+    
+    # Estoque atual
+    estoque_atual = produto.quantidade_total
+    
+    # Projeção de demanda futura (baseada na média móvel de 30 dias)
+    demanda_diaria_media = media_movel_30_dias
+    
+    # Dias de cobertura atual (quantos dias o estoque atual vai durar)
+    if demanda_diaria_media > 0:
+        dias_cobertura_atual = estoque_atual / demanda_diaria_media
+    else:
+        dias_cobertura_atual = float('inf')
+    
+    # Calcular ponto de reposição
+    # Ponto de reposição = (Demanda diária * Lead Time) + Estoque de Segurança
+    # Estoque de Segurança = Demanda diária * Dias de cobertura mínima
+    lead_time = produto.lead_time_dias
+    dias_cobertura_minima = produto.dias_cobertura_minima
+    
+    # Adicionar desvio padrão ao estoque de segurança para produtos com vendas voláteis
+    estoque_seguranca = (demanda_diaria_media * dias_cobertura_minima) + (desvio_padrao * 1.5)
+    ponto_reposicao = (demanda_diaria_media * lead_time) + estoque_seguranca
+    
+    # Quantidade sugerida para compra
+    # Queremos manter estoque para: Lead Time + Cobertura Mínima + 50% extra
+    estoque_ideal = demanda_diaria_media * (lead_time + dias_cobertura_minima) * 1.5
+    
+    # Otimização: Usar quantidade_chegando já anotada no queryset
+    quantidade_chegando = produto.qtd_chegando
+    estoque_projetado = estoque_atual + quantidade_chegando
+    
+    if estoque_projetado < ponto_reposicao:
+        precisa_repor = True
+        quantidade_sugerida = max(0, estoque_ideal - estoque_projetado)
+        urgencia = 'alta' if dias_cobertura_atual < lead_time else 'média'
+    else:
+        precisa_repor = False
+        quantidade_sugerida = 0
+        urgencia = 'baixa'
+    urgencia_class = CLASSES_URGENCIA[urgencia]
+    
+    # Detecção de sazonalidade simples: média por dia da semana
+    medias_dia_semana = estatisticas['medias_dia_semana']
+    
+    # Dia da semana com mais vendas
+    if medias_dia_semana:
+        dia_mais_vendas = max(medias_dia_semana, key=medias_dia_semana.get)
+        media_dia_mais_vendas = medias_dia_semana[dia_mais_vendas]
+    else:
+        dia_mais_vendas = 'N/A'
+        media_dia_mais_vendas = 0
+    
+    # Custo estimado da reposição sugerida (custo médio ponderado dos totais gravados)
+    custo_medio = produto.custo_estoque / produto.estoque_atual if produto.estoque_atual else Decimal('0.00')
+    
+    # Se o custo médio ponderado for 0 (sem estoque), usar o último preço de compra conhecido
+    if custo_medio == 0 and produto.ultimo_preco_compra is not None:
+        custo_medio = produto.ultimo_preco_compra
+    
+    custo_estimado_reposicao = Decimal(str(quantidade_sugerida)) * custo_medio if quantidade_sugerida > 0 else Decimal('0.00')
+    
+    return {
+        'produto': produto,
+        'estoque_atual': estoque_atual,
+        'quantidade_chegando': quantidade_chegando,
+        'estoque_projetado': estoque_projetado,
+        'total_vendido_periodo': total_vendido_periodo,
+        'media_movel_7_dias': round(media_movel_7_dias, 2),
+        'media_movel_14_dias': round(media_movel_14_dias, 2),
+        'media_movel_30_dias': round(media_movel_30_dias, 2),
+        'desvio_padrao': round(desvio_padrao, 2),
+        'dias_cobertura_atual': round(dias_cobertura_atual, 1) if dias_cobertura_atual != float('inf') else 999,
+        'ponto_reposicao': round(ponto_reposicao, 1),
+        'precisa_repor': precisa_repor,
+        'quantidade_sugerida': round(quantidade_sugerida),
+        'urgencia': urgencia,
+        'urgencia_class': urgencia_class,
+        'tendencia': tendencia,
+        'tendencia_icon': tendencia_icon,
+        'tendencia_class': tendencia_class,
+        'variacao_percentual': round(variacao_percentual, 1),
+        'dia_mais_vendas': dia_mais_vendas,
+        'media_dia_mais_vendas': round(media_dia_mais_vendas, 2),
+        'custo_estimado_reposicao': custo_estimado_reposicao,
+        'vendas_lista': vendas_lista[-30:],  # Últimos 30 dias para gráfico
+    }
+
+
+def produtos_para_analise(produto_ids):
+    """Produtos com quantidade chegando e último preço de compra anotados (uma query)."""
+    return anotar_quantidade_chegando(Produto.objects.filter(pk__in=produto_ids)).annotate(
+        ultimo_preco_compra=Subquery(
+            Lote.objects.filter(produto=OuterRef('pk')).order_by('-data_entrada').values('preco_compra')[:1]
+        )
+    ).order_by('pk')
+
+
+def analisar_produtos(data_inicio, dias, produto_ids=None):
+    """Análises de todos os produtos ativos com vendas na janela (ou só dos informados)."""
+    matriz = matriz_vendas(data_inicio, dias, produto_ids)
+    return [
+        analisar_produto(produto, matriz[produto.pk], data_inicio)
+        for produto in produtos_para_analise(matriz.keys())
+    ]
+
+
+def ordenar_analises(analises):
+    """Ordena por urgência (alta primeiro) e depois pela quantidade sugerida."""
+    ordem = {'alta': 0, 'média': 1}
+    analises.sort(key=lambda item: (ordem.get(item['urgencia'], 2), -item['quantidade_sugerida']))
+    return analises
@@ -1,3 +1,1216 @@
-from django.test import TestCase
+import csv
+import json
+import tempfile
+import threading
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+from zoneinfo import ZoneInfo
 
-# Create your tests here.
+from asgiref.sync import iscoroutinefunction, sync_to_async
+
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, OperationalError, connection, connections, transaction
+from django.db.models import Count, F, Sum
+from django.test import AsyncClient, Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Produto, Lote, Venda, ItemVenda, ItemVendaLote, Configuracao, Devolucao, ItemDevolucao, VendaDiaria, VendaDiariaProduto, PrevisaoEstoque, ProdutoChegando, Fornecedor
+from .estoque import criar_lote, verificar_estoque, anotar_quantidade_chegando, movimentar_lotes, recalcular_ultima_venda, ConflitoEstoque
+from .concorrencia import com_retentativa
+from .vendas_diarias import atualizar_vendas_diarias
+from .limite_taxa import LimiteExcedido, limitar_taxa
+from .middleware import DesempenhoMiddleware
+from .devolucoes import itens_para_devolucao
+from .series_temporais import serie_temporal, niveis, cortes_do_maximo
+from .importacao import importar_arquivo
+from .cache_dashboard import estatisticas
+from .tendencias import produtos_para_analise
+from .benchmark import medir_escala, comparar, gerar_baseline
+from .dados_sinteticos import gerar_loja
+from .carga import ClienteLocal, classificar_erro, executar_caixa, quantidades_lotes, reconciliar
+from . import desempenho, views
+
+
+class EstoqueTestCase(TestCase):
+    """Base com usuário logado e helpers para montar produtos, lotes e vendas"""
+
+    def setUp(self):
+        user = get_user_model().objects.create_user(username='caixa', password='senha-teste-123')
+        self.client.force_login(user)
+        Configuracao.objects.get_or_create()
+        cache.clear()
+
+    def criar_produto(self, nome, lotes, preco_venda=Decimal('20.00')):
+        produto = Produto.objects.create(nome=nome, preco_venda=preco_venda)
+        agora = timezone.now()
+        for i, (quantidade, preco_compra) in enumerate(lotes):
+            criar_lote(produto, quantidade, preco_compra, data_entrada=agora - timedelta(days=len(lotes) - i))
+        produto.refresh_from_db()
+        return produto
+
+    def postar_venda(self, itens, **extras):
+        dados = {'tipo_venda': 'EXTERNA', 'itens': itens}
+        dados.update(extras)
+        return self.client.post(reverse('inventario:criar_venda'), json.dumps(dados), content_type='application/json')
+
+
+class VendaFIFOTests(EstoqueTestCase):
+    """Baixa FIFO das vendas feita pelo motor de alocação em lote"""
+
+    def test_venda_consome_lotes_mais_antigos_primeiro(self):
+        produto = self.criar_produto('Camiseta', [(3, Decimal('5.00')), (10, Decimal('8.00'))])
+
+        resposta = self.postar_venda([{'id': produto.id, 'quantidade': 5}])
+
+        self.assertTrue(resposta.json()['sucesso'])
+        item = ItemVenda.objects.get(produto=produto)
+        self.assertEqual(item.custo_compra_total_registrado, Decimal('31.00'))
+        self.assertEqual(
+            list(produto.lotes.order_by('data_entrada').values_list('quantidade_atual', flat=True)),
+            [0, 8]
+        )
+        self.assertEqual(
+            list(ItemVendaLote.objects.filter(item_venda=item).order_by('id').values_list('quantidade_retirada', flat=True)),
+            [3, 2]
+        )
+
+    def test_linhas_repetidas_do_mesmo_produto_consomem_em_sequencia(self):
+        produto = self.criar_produto('Boné', [(2, Decimal('4.00')), (2, Decimal('6.00'))])
+
+        resposta = self.postar_venda([
+            {'id': produto.id, 'quantidade': 2},
+            {'id': produto.id, 'quantidade': 2, 'eh_brinde': True},
+        ])
+
+        self.assertTrue(resposta.json()['sucesso'])
+        custos = list(ItemVenda.objects.order_by('id').values_list('custo_compra_total_registrado', flat=True))
+        self.assertEqual(custos, [Decimal('8.00'), Decimal('12.00')])
+        produto.refresh_from_db()
+        self.assertEqual(produto.quantidade_total, 0)
+
+    def test_estoque_insuficiente_nao_grava_nada(self):
+        produto = self.criar_produto('Meia', [(1, Decimal('2.00'))])
+
+        resposta = self.postar_venda([{'id': produto.id, 'quantidade': 2}])
+
+        self.assertEqual(resposta.status_code, 400)
+        self.assertIn('Estoque insuficiente', resposta.json()['erro'])
+        self.assertFalse(Venda.objects.exists())
+        produto.refresh_from_db()
+        self.assertEqual(produto.quantidade_total, 1)
+
+    def test_numero_de_queries_nao_cresce_com_a_cesta(self):
+        produtos = [
+            self.criar_produto(f'Produto {i}', [(2, Decimal('3.00')), (2, Decimal('4.00')), (50, Decimal('5.00'))])
+            for i in range(30)
+        ]
+
+        with CaptureQueriesContext(connection) as uma_linha:
+            self.postar_venda([{'id': produtos[0].id, 'quantidade': 5}])
+        with CaptureQueriesContext(connection) as trinta_linhas:
+            self.postar_venda([{'id': produto.id, 'quantidade': 5} for produto in produtos[1:]])
+
+        self.assertEqual(len(trinta_linhas.captured_queries), len(uma_linha.captured_queries))
+
+    def test_editar_venda_restaura_lotes_e_realoca(self):
+        produto = self.criar_produto('Calça', [(5, Decimal('10.00')), (5, Decimal('12.00'))])
+        venda_id = self.postar_venda([{'id': produto.id, 'quantidade': 6}]).json()['venda_id']
+
+        resposta = self.client.post(
+            reverse('inventario:editar_venda', kwargs={'pk': venda_id}),
+            json.dumps({'tipo_venda': 'EXTERNA', 'itens': [{'id': produto.id, 'quantidade': 2}]}),
+            content_type='application/json'
+        )
+
+        self.assertTrue(resposta.json()['sucesso'])
+        self.assertEqual(
+            list(produto.lotes.order_by('data_entrada').values_list('quantidade_atual', flat=True)),
+            [3, 5]
+        )
+        self.assertEqual(ItemVendaLote.objects.count(), 1)
+
+
+class EstoqueDesnormalizadoTests(EstoqueTestCase):
+    """Totais estoque_atual/custo_estoque acompanham todas as movimentações de lote"""
+
+    def assertTotaisConferem(self, produto):
+        produto.refresh_from_db()
+        lotes = list(produto.lotes.all())
+        self.assertEqual(produto.estoque_atual, sum(lote.quantidade_atual for lote in lotes))
+        self.assertEqual(produto.custo_estoque, sum(lote.quantidade_atual * lote.preco_compra for lote in lotes))
+
+    def test_venda_edicao_e_exclusao_mantem_totais(self):
+        produto = self.criar_produto('Jaqueta', [(4, Decimal('30.00')), (6, Decimal('35.00'))])
+        self.assertEqual((produto.estoque_atual, produto.custo_estoque), (10, Decimal('330.00')))
+
+        venda_id = self.postar_venda([{'id': produto.id, 'quantidade': 5}]).json()['venda_id']
+        self.assertTotaisConferem(produto)
+        self.assertEqual(produto.estoque_atual, 5)
+
+        self.client.post(
+            reverse('inventario:editar_venda', kwargs={'pk': venda_id}),
+            json.dumps({'tipo_venda': 'LOJA', 'itens': [{'id': produto.id, 'quantidade': 7}]}),
+            content_type='application/json'
+        )
+        self.assertTotaisConferem(produto)
+        self.assertEqual(produto.estoque_atual, 3)
+
+        self.client.post(reverse('inventario:excluir_venda', kwargs={'pk': venda_id}))
+        self.assertTotaisConferem(produto)
+        self.assertEqual(produto.estoque_atual, 10)
+
+    def test_ajuste_manual_reduz_pelos_lotes_mais_antigos(self):
+        produto = self.criar_produto('Tênis', [(3, Decimal('50.00')), (3, Decimal('60.00'))])
+
+        self.client.post(reverse('inventario:editar_produto', kwargs={'pk': produto.pk}), {
+            'nome': produto.nome, 'preco_venda': '120.00', 'ativo': 'on', 'quantidade_estoque': 2,
+        })
+
+        self.assertTotaisConferem(produto)
+        self.assertEqual(produto.custo_estoque, Decimal('120.00'))
+
+    def test_custo_medio_e_margem_sem_queries(self):
+        produto = self.criar_produto('Bolsa', [(2, Decimal('10.00')), (3, Decimal('15.00'))], preco_venda=Decimal('26.00'))
+
+        with self.assertNumQueries(0):
+            self.assertEqual(produto.custo_medio_ponderado, Decimal('13.00'))
+            self.assertEqual(produto.margem_lucro, Decimal('50.00'))
+
+        self.postar_venda([{'id': produto.id, 'quantidade': 2}])
+        produto.refresh_from_db()
+        self.assertEqual(produto.custo_medio_ponderado, Decimal('15.00'))
+
+    def test_lote_editado_no_admin_ajusta_totais(self):
+        produto = self.criar_produto('Carteira', [(4, Decimal('9.00')), (2, Decimal('12.00'))])
+        lote_admin = admin.site._registry[Lote]
+        lote = produto.lotes.order_by('data_entrada').first()
+
+        lote.quantidade_atual, lote.preco_compra = 1, Decimal('11.00')
+        lote_admin.save_model(None, lote, None, change=True)
+        self.assertTotaisConferem(produto)
+
+        lote_admin.delete_queryset(None, produto.lotes.filter(pk=lote.pk))
+        self.assertTotaisConferem(produto)
+        self.assertEqual(produto.estoque_atual, 2)
+
+    def test_comando_verificar_estoque_corrige_divergencias(self):
+        produto = self.criar_produto('Cinto', [(5, Decimal('7.00'))])
+        Produto.objects.filter(pk=produto.pk).update(estoque_atual=99)
+
+        call_command('verificar_estoque', stdout=StringIO())
+        produto.refresh_from_db()
+        self.assertEqual(produto.estoque_atual, 99)
+
+        call_command('verificar_estoque', '--corrigir', stdout=StringIO())
+        self.assertTotaisConferem(produto)
+
+
+class ResumoVendaTests(EstoqueTestCase):
+    """Resumo financeiro gravado em Venda reproduz as regras de meu_lucro"""
+
+    def test_meu_lucro_com_taxa_loja_e_devolucao(self):
+        produto = self.criar_produto('Vestido', [(10, Decimal('10.00'))])
+        venda_id = self.postar_venda(
+            [{'id': produto.id, 'quantidade': 3}],
+            tipo_venda='LOJA', tipo_pagamento='CREDITO', parcelas=1, desconto='5.00'
+        ).json()['venda_id']
+
+        venda = Venda.objects.get(pk=venda_id)
+        self.assertEqual(venda.valor_total, Decimal('55.00'))
+        self.assertEqual(venda.custo_total, Decimal('30.00'))
+        self.assertEqual(venda.quantidade_total_vendida, 3)
+        # (55 - 30 - 3% de 55) / 2
+        self.assertEqual(venda.meu_lucro, Decimal('11.675'))
+        self.assertIsNone(venda.tipo_devolucao)
+
+        item = venda.itens.get()
+        self.client.post(reverse('inventario:registrar_devolucao', kwargs={'venda_pk': venda_id}), {f'item_{item.id}': 1})
+
+        venda.refresh_from_db()
+        self.assertTrue(venda.teve_devolucao)
+        self.assertEqual(venda.tipo_devolucao, 'parcial')
+        self.assertEqual(venda.quantidade_total_devolvida, 1)
+        # lucro revertido da unidade devolvida: 20 - 30/3 = 10
+        self.assertEqual(venda.meu_lucro, Decimal('6.675'))
+
+    def test_brindes_e_comando_de_backfill(self):
+        produto = self.criar_produto('Chaveiro', [(10, Decimal('1.50'))], preco_venda=Decimal('5.00'))
+        venda_id = self.postar_venda([
+            {'id': produto.id, 'quantidade': 2},
+            {'id': produto.id, 'quantidade': 1, 'eh_brinde': True},
+        ]).json()['venda_id']
+        Venda.objects.filter(pk=venda_id).update(meu_lucro_registrado=0, quantidade_brindes_registrada=0, resumo_atualizado_em=None)
+
+        call_command('recalcular_resumo_vendas', '--pendentes', stdout=StringIO())
+
+        venda = Venda.objects.get(pk=venda_id)
+        self.assertTrue(venda.tem_brindes)
+        self.assertEqual(venda.quantidade_brindes_dados, 1)
+        self.assertEqual(venda.valor_brindes_dados, Decimal('1.50'))
+        self.assertEqual(venda.meu_lucro, Decimal('5.50'))
+
+
+class VendaDiariaTests(EstoqueTestCase):
+    """Totais diários acompanham criação, devolução e exclusão de vendas"""
+
+    def test_totais_do_dia_seguem_as_vendas(self):
+        produto = self.criar_produto('Saia', [(10, Decimal('10.00'))])
+        hoje = timezone.localdate()
+
+        venda_id = self.postar_venda([{'id': produto.id, 'quantidade': 2}]).json()['venda_id']
+        self.postar_venda([{'id': produto.id, 'quantidade': 1}], tipo_venda='LOJA')
+
+        self.assertEqual(VendaDiaria.objects.filter(data=hoje).count(), 2)
+        diaria_produto = VendaDiariaProduto.objects.get(data=hoje, produto=produto)
+        self.assertEqual((diaria_produto.quantidade, diaria_produto.receita, diaria_produto.custo), (3, Decimal('60.00'), Decimal('30.00')))
+
+        item = ItemVenda.objects.get(venda_id=venda_id)
+        self.client.post(reverse('inventario:registrar_devolucao', kwargs={'venda_pk': venda_id}), {f'item_{item.id}': 1})
+        externa = VendaDiaria.objects.get(data=hoje, tipo_venda='EXTERNA')
+        self.assertEqual(externa.meu_lucro, Venda.objects.get(pk=venda_id).meu_lucro)
+
+        resposta = self.client.get(reverse('inventario:dashboard'))
+        self.assertEqual(resposta.context['numero_vendas'], 2)
+        self.assertEqual(resposta.context['receita_total'], Decimal('60.00'))
+
+        Venda.objects.filter(pk=venda_id).update(data=timezone.now() - timedelta(days=3))
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual(VendaDiaria.objects.filter(data=hoje).count(), 1)
+        self.assertEqual(VendaDiaria.objects.count(), 2)
+
+
+class SeriesTemporaisTests(EstoqueTestCase):
+    """Séries por dia/semana/mês local agrupadas no banco, com os períodos vazios preenchidos"""
+
+    def test_agrupa_pelo_dia_local_e_preenche_lacunas(self):
+        fuso = ZoneInfo('America/Sao_Paulo')
+        # 01:30 UTC de 10/03 ainda é 09/03 em São Paulo
+        Venda.objects.create(data=datetime(2025, 3, 10, 1, 30, tzinfo=dt_timezone.utc))
+        Venda.objects.create(data=datetime(2025, 3, 10, 12, 0, tzinfo=fuso))
+        Venda.objects.create(data=datetime(2025, 4, 2, 12, 0, tzinfo=fuso))
+
+        por_dia = serie_temporal(Venda.objects.all(), 'data', {'vendas': Count('id')}, 'dia', date(2025, 3, 9), date(2025, 3, 11))
+        self.assertEqual(por_dia['datas'], ['2025-03-09', '2025-03-10', '2025-03-11'])
+        self.assertEqual(por_dia['series']['vendas'], [1, 1, 0])
+
+        por_semana = serie_temporal(Venda.objects.all(), 'data', {'vendas': Count('id')}, 'semana', date(2025, 3, 9), date(2025, 3, 20))
+        self.assertEqual(por_semana['datas'], ['2025-03-03', '2025-03-10', '2025-03-17'])
+        self.assertEqual(por_semana['series']['vendas'], [1, 1, 0])
+
+        por_mes = serie_temporal(Venda.objects.all(), 'data', {'vendas': Count('id')}, 'mes', date(2025, 2, 1), date(2025, 4, 30))
+        self.assertEqual(por_mes['rotulos'], ['Feb/25', 'Mar/25', 'Apr/25'])
+        self.assertEqual(por_mes['series']['vendas'], [0, 2, 1])
+
+    def test_niveis_do_heatmap(self):
+        lucros = [Decimal('0'), Decimal('10'), Decimal('25'), Decimal('26'), Decimal('60'), Decimal('100'), Decimal('-5')]
+        self.assertEqual(niveis(lucros, cortes_do_maximo(lucros)), [0, 1, 1, 2, 3, 4, 0])
+        self.assertEqual(niveis([Decimal('0')] * 3, cortes_do_maximo([Decimal('0')] * 3)), [0, 0, 0])
+
+        produto = self.criar_produto('Saia', [(10, Decimal('10.00'))])
+        self.postar_venda([{'id': produto.id, 'quantidade': 2}])
+        heatmap = json.loads(self.client.get(reverse('inventario:dashboard')).context['heatmap_data'])
+        self.assertEqual(len(heatmap), 365)
+        self.assertEqual(heatmap[-1]['data'], timezone.localdate().isoformat())
+        self.assertEqual(heatmap[-1]['nivel'], 4)
+
+
+class CacheDashboardTests(EstoqueTestCase):
+    """Contexto do dashboard reaproveitado até uma alteração de vendas ou estoque"""
+
+    def test_cache_reaproveitado_e_invalidado_por_venda(self):
+        produto = self.criar_produto('Regata', [(10, Decimal('6.00'))])
+        url = reverse('inventario:dashboard')
+
+        self.assertEqual(self.client.get(url)['X-Dashboard-Cache'], 'MISS')
+        with CaptureQueriesContext(connection) as consultas:
+            resposta = self.client.get(url)
+        self.assertEqual(resposta['X-Dashboard-Cache'], 'HIT')
+        self.assertFalse([q for q in consultas.captured_queries if 'inventario_' in q['sql']])
+        self.assertEqual(self.client.get(url, {'periodo': '7d'})['X-Dashboard-Cache'], 'MISS')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.postar_venda([{'id': produto.id, 'quantidade': 2}])
+
+        resposta = self.client.get(url)
+        self.assertEqual(resposta['X-Dashboard-Cache'], 'MISS')
+        self.assertEqual(resposta.context['numero_vendas'], 1)
+        self.assertEqual(estatisticas()['acertos'], 1)
+        self.assertEqual(estatisticas()['falhas'], 3)
+
+
+class ProdutosParadosTests(EstoqueTestCase):
+    """Datas de última venda e de estoque gravadas no produto e relatório de parados"""
+
+    def test_datas_mantidas_pelas_vendas_e_lotes(self):
+        produto = self.criar_produto('Caneca', [(2, Decimal('5.00')), (3, Decimal('6.00'))])
+        primeiro, segundo = produto.lotes.order_by('data_entrada')
+        self.assertIsNone(produto.ultima_venda_em)
+        self.assertEqual(produto.estoque_desde, primeiro.data_entrada)
+
+        venda_id = self.postar_venda([{'id': produto.id, 'quantidade': 2}]).json()['venda_id']
+        produto.refresh_from_db()
+        self.assertEqual(produto.ultima_venda_em, Venda.objects.get(pk=venda_id).data)
+        self.assertEqual(produto.estoque_desde, segundo.data_entrada)
+
+        self.client.post(reverse('inventario:excluir_venda', kwargs={'pk': venda_id}))
+        produto.refresh_from_db()
+        self.assertIsNone(produto.ultima_venda_em)
+        self.assertEqual(produto.estoque_desde, primeiro.data_entrada)
+
+    def test_dashboard_e_relatorio_do_mais_parado_para_o_menos(self):
+        Configuracao.objects.update(dias_produto_parado=30)
+        agora = timezone.now()
+        for nome, dias in [('Antigo', 45), ('Recente', 5), ('Pausado', 80), ('Vendido', 90)]:
+            produto = Produto.objects.create(nome=nome, preco_venda=Decimal('20.00'), ativo=nome != 'Pausado')
+            criar_lote(produto, 3, Decimal('5.00'), data_entrada=agora - timedelta(days=dias))
+        vendido = Produto.objects.get(nome='Vendido')
+        venda_id = self.postar_venda([{'id': vendido.id, 'quantidade': 1}]).json()['venda_id']
+        Venda.objects.filter(pk=venda_id).update(data=agora - timedelta(days=40))
+        recalcular_ultima_venda([vendido.id])
+
+        parados = self.client.get(reverse('inventario:dashboard')).context['produtos_parados']
+        self.assertEqual([(item['produto'].nome, item['dias_parado']) for item in parados], [('Antigo', 45), ('Vendido', 40)])
+
+        # Sessão, usuário, configuração e uma única query dos produtos (índice idx_produto_parado)
+        with self.assertNumQueries(4):
+            resposta = self.client.get(reverse('inventario:produtos_parados'))
+        self.assertEqual([item['produto'].nome for item in resposta.context['produtos_parados']], ['Antigo', 'Vendido'])
+        self.assertContains(resposta, 'Nunca vendido')
+
+
+class HealthCheckTests(TestCase):
+    """Probes respondem sem login e sem renderizar o dashboard"""
+
+    def test_healthz_sem_login_e_sem_queries(self):
+        with CaptureQueriesContext(connection) as consultas:
+            resposta = self.client.get('/healthz')
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta.json(), {'status': 'ok'})
+        self.assertEqual(len(consultas.captured_queries), 0)
+
+    def test_readyz_reporta_banco_migrations_e_cache(self):
+        resposta = self.client.get('/readyz')
+        self.assertEqual(resposta.status_code, 200)
+        dados = resposta.json()
+        self.assertEqual(dados['status'], 'ok')
+        self.assertTrue(dados['banco']['ok'])
+        self.assertIn('latencia_ms', dados['banco'])
+        self.assertIn('conexao_reutilizada', dados['banco'])
+        self.assertEqual(dados['migrations']['pendentes'], [])
+        self.assertTrue(dados['cache']['ok'])
+
+
+class AnaliseTendenciasTests(EstoqueTestCase):
+    """Análise de tendências calculada a partir de uma matriz produto x dia"""
+
+    def test_estatisticas_e_queries_independentes_do_numero_de_produtos(self):
+        produtos = [self.criar_produto(f'Bermuda {i}', [(50, Decimal('9.00'))]) for i in range(4)]
+        self.postar_venda([{'id': produtos[0].id, 'quantidade': 7}])
+        url = reverse('inventario:analise_tendencias')
+
+        with CaptureQueriesContext(connection) as um_produto:
+            resposta = self.client.get(url)
+        [analise] = resposta.context['analises_produtos']
+        self.assertEqual(analise['produto'], produtos[0])
+        self.assertEqual(analise['total_vendido_periodo'], 7)
+        self.assertEqual(analise['media_movel_7_dias'], 1)
+        self.assertEqual(analise['vendas_lista'][-1], 7)
+
+        self.postar_venda([{'id': produto.id, 'quantidade': 1} for produto in produtos[1:]])
+        with CaptureQueriesContext(connection) as quatro_produtos:
+            resposta = self.client.get(url)
+        self.assertEqual(len(resposta.context['analises_produtos']), 4)
+        self.assertEqual(len(quatro_produtos.captured_queries), len(um_produto.captured_queries))
+
+    def test_view_le_snapshot_de_previsoes(self):
+        produtos = [self.criar_produto(f'Blusa {i}', [(20, Decimal('9.00'))]) for i in range(2)]
+        self.postar_venda([{'id': produto.id, 'quantidade': 3} for produto in produtos])
+        url = reverse('inventario:analise_tendencias')
+        inline = self.client.get(url).context
+        self.assertIsNone(inline['previsoes_calculadas_em'])
+
+        call_command('recalcular_previsoes', stdout=StringIO())
+        self.assertEqual(PrevisaoEstoque.objects.count(), 2)
+        resposta = self.client.get(url)
+        self.assertIsNotNone(resposta.context['previsoes_calculadas_em'])
+        for campo in ('media_movel_30_dias', 'ponto_reposicao', 'urgencia_class', 'tendencia_icon', 'vendas_lista', 'quantidade_sugerida'):
+            self.assertEqual(
+                [analise[campo] for analise in resposta.context['analises_produtos']],
+                [analise[campo] for analise in inline['analises_produtos']],
+            )
+
+        # --alterados recalcula só o produto com venda nova
+        self.postar_venda([{'id': produtos[0].id, 'quantidade': 2}])
+        call_command('recalcular_previsoes', '--alterados', stdout=StringIO())
+        self.assertEqual(PrevisaoEstoque.objects.get(produto=produtos[0]).total_vendido_periodo, 5)
+        self.assertLess(
+            PrevisaoEstoque.objects.get(produto=produtos[1]).calculado_em,
+            PrevisaoEstoque.objects.get(produto=produtos[0]).calculado_em,
+        )
+
+    def test_alterados_refaz_previsoes_de_dias_anteriores(self):
+        produtos = [self.criar_produto(f'Saia {i}', [(20, Decimal('9.00'))]) for i in range(2)]
+        self.postar_venda([{'id': produto.id, 'quantidade': 3} for produto in produtos])
+        call_command('recalcular_previsoes', stdout=StringIO())
+        agora = timezone.now()
+        dias_analise = Configuracao.objects.get().dias_analise_tendencias
+
+        # No dia seguinte, sem nada alterado, a janela de todos andou um dia
+        with mock.patch('django.utils.timezone.now', return_value=agora + timedelta(days=1)):
+            call_command('recalcular_previsoes', '--alterados', stdout=StringIO())
+        previsoes = list(PrevisaoEstoque.objects.order_by('produto_id'))
+        self.assertEqual([previsao.produto for previsao in previsoes], produtos)
+        for previsao in previsoes:
+            self.assertEqual(previsao.calculado_em, agora + timedelta(days=1))
+            self.assertEqual(previsao.vendas_lista[-2:], [3, 0])
+
+        # Quando a venda sai da janela, o produto sai do snapshot
+        with mock.patch('django.utils.timezone.now', return_value=agora + timedelta(days=dias_analise)):
+            call_command('recalcular_previsoes', '--alterados', stdout=StringIO())
+        self.assertFalse(PrevisaoEstoque.objects.exists())
+
+
+class BuscaProdutosTests(EstoqueTestCase):
+    """Autocomplete de produtos: normalizado, ranqueado, limitado e em uma query"""
+
+    def test_busca_sem_acento_ranqueada_com_custo_fifo(self):
+        self.criar_produto('Bolsa Camurça', [(1, Decimal('30.00'))])
+        camisa = self.criar_produto('Camisa Básica', [(0, Decimal('9.00')), (2, Decimal('11.00'))])
+        self.criar_produto('Câmera', [])
+        url = reverse('inventario:buscar_produtos_json')
+
+        with CaptureQueriesContext(connection) as consultas:
+            resultado = self.client.get(url, {'term': 'cam'}).json()
+        self.assertEqual([p['value'] for p in resultado], ['Câmera', 'Camisa Básica', 'Bolsa Camurça'])
+        self.assertEqual(len([q for q in consultas.captured_queries if 'inventario_produto' in q['sql']]), 1)
+        self.assertEqual(resultado[1]['custo'], '11.00')
+        self.assertTrue(resultado[0]['sem_estoque'])
+
+        resultado = self.client.get(url, {'term': 'BASICA cami'}).json()
+        self.assertEqual([p['id'] for p in resultado], [camisa.id])
+
+    def test_limite_de_resultados(self):
+        for i in range(20):
+            Produto.objects.create(nome=f'Camiseta {i:02d}', preco_venda=Decimal('10.00'))
+        url = reverse('inventario:buscar_produtos_json')
+
+        self.assertEqual(len(self.client.get(url, {'term': 'cam'}).json()), 15)
+        self.assertEqual(len(self.client.get(url, {'term': 'cam', 'limite': 5}).json()), 5)
+
+    def test_catalogo_em_memoria_atende_sem_banco_e_segue_o_estoque(self):
+        produto = self.criar_produto('Camisa Polo', [(5, Decimal('12.00'))])
+        url = reverse('inventario:buscar_produtos_json')
+        self.client.get(url, {'term': 'pol'})
+
+        with CaptureQueriesContext(connection) as consultas:
+            [resultado] = self.client.get(url, {'term': 'pol'}).json()
+        self.assertFalse([q for q in consultas.captured_queries if 'inventario_' in q['sql']])
+        self.assertEqual(resultado['estoque'], 5)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.postar_venda([{'id': produto.id, 'quantidade': 5}])
+        [resultado] = self.client.get(url, {'term': 'pol'}).json()
+        self.assertTrue(resultado['sem_estoque'])
+        self.assertEqual(resultado['custo'], '0')
+
+        with self.settings(CATALOGO_EM_MEMORIA=False):
+            self.assertEqual(self.client.get(url, {'term': 'pol'}).json(), [resultado])
+
+
+class PaginacaoCursorTests(EstoqueTestCase):
+    """Listagens paginadas por cursor: sem repetição, sem OFFSET e com custo constante"""
+
+    def percorrer(self, url, chave, **params):
+        ids, paginas, cursor = [], [], None
+        while True:
+            resposta = self.client.get(url, dict(params, **({'cursor': cursor} if cursor else {})))
+            pagina = resposta.context['page_obj']
+            paginas.append(pagina)
+            ids.extend(objeto.id for objeto in resposta.context[chave])
+            cursor = pagina.cursor_proximo
+            if not cursor:
+                return ids, paginas
+            # Um cursor que não avança repetiria a mesma página para sempre
+            self.assertLess(len(paginas), 20, 'A paginação não avançou')
+
+    def test_vendas_percorridas_nos_dois_sentidos_com_custo_constante(self):
+        agora = timezone.now()
+        for i in range(45):
+            # Datas repetidas para exercitar o desempate por id
+            Venda.objects.create(cliente_nome=f'Cliente {i}', data=agora - timedelta(hours=i // 3))
+        url = reverse('inventario:listar_vendas')
+
+        ids, paginas = self.percorrer(url, 'vendas')
+        self.assertEqual(ids, list(Venda.objects.order_by('-data', '-id').values_list('id', flat=True)))
+        self.assertEqual([pagina.number for pagina in paginas], [1, 2, 3])
+        self.assertEqual(paginas[0].paginator.total_exibicao, '45')
+
+        with CaptureQueriesContext(connection) as primeira:
+            self.client.get(url)
+        with CaptureQueriesContext(connection) as terceira:
+            self.client.get(url, {'cursor': paginas[1].cursor_proximo})
+        self.assertEqual(len(primeira), len(terceira))
+        self.assertFalse([q for q in terceira.captured_queries if 'OFFSET' in q['sql']])
+
+        anterior = self.client.get(url, {'cursor': paginas[2].cursor_anterior}).context['page_obj']
+        self.assertEqual([venda.id for venda in anterior], ids[20:40])
+        self.assertEqual(anterior.number, 2)
+
+        self.assertEqual(self.client.get(url, {'cursor': 'invalido'}).context['page_obj'].number, 1)
+
+    def test_produtos_ordenados_por_margem_com_valores_nulos(self):
+        for i in range(25):
+            lotes = [(2, Decimal(i % 7 + 1))] if i % 3 else []
+            self.criar_produto(f'Produto {i:02d}', lotes, preco_venda=Decimal('10.00'))
+        url = reverse('inventario:listar_produtos')
+
+        ids, paginas = self.percorrer(url, 'produtos', ordenar='margem', ordem='desc')
+        self.assertEqual(sorted(ids), sorted(Produto.objects.values_list('id', flat=True)))
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(len(paginas), 2)
+        self.assertEqual(paginas[0].paginator.total_exibicao, '25')
+
+    def test_produtos_ordenados_por_custo_medio_nao_exato(self):
+        # 30.01 / 3 = 10.00333...: o cursor precisa comparar com o mesmo valor arredondado do banco
+        for i in range(45):
+            self.criar_produto(f'Produto {i:02d}', [(3, Decimal('10.0033333'))], preco_venda=Decimal('15.00'))
+        Produto.objects.update(custo_estoque=Decimal('30.01'))
+        url = reverse('inventario:listar_produtos')
+
+        for ordenar in ('custo', 'margem'):
+            for ordem in ('asc', 'desc'):
+                ids, paginas = self.percorrer(url, 'produtos', ordenar=ordenar, ordem=ordem)
+                self.assertEqual(len(paginas), 3)
+                self.assertEqual(sorted(ids), sorted(Produto.objects.values_list('id', flat=True)))
+                self.assertEqual(len(ids), len(set(ids)))
+
+    def test_api_de_vendas_paginada_com_projecao_e_queries_constantes(self):
+        produto = self.criar_produto('Caneca', [(100, Decimal('3.00'))])
+        for _ in range(3):
+            self.postar_venda([{'id': produto.id, 'quantidade': 1}])
+        url = reverse('inventario:buscar_vendas_listagem_json')
+
+        with CaptureQueriesContext(connection) as poucas:
+            self.client.get(url, {'limit': 2})
+        for i in range(30):
+            Venda.objects.create(cliente_nome=f'Cliente {i}')
+        with CaptureQueriesContext(connection) as muitas:
+            dados = self.client.get(url, {'limit': 25}).json()
+        self.assertEqual(len(poucas), len(muitas))
+        self.assertEqual((dados['quantidade'], dados['total'], dados['tem_mais']), (25, 33, True))
+
+        segunda = self.client.get(url, {'limit': 25, 'cursor': dados['proximo_cursor']}).json()
+        self.assertNotIn('total', segunda)
+        self.assertFalse(segunda['tem_mais'])
+        self.assertEqual(segunda['vendas'][-1]['itens'], [{'quantidade': 1, 'produto_nome': 'Caneca'}])
+        ids = [venda['id'] for venda in dados['vendas'] + segunda['vendas']]
+        self.assertEqual(ids, list(Venda.objects.order_by('-data', '-id').values_list('id', flat=True)))
+
+        projetado = self.client.get(url, {'fields': 'valor_total,inexistente', 'limit': 1}).json()
+        self.assertEqual(list(projetado['vendas'][0]), ['id', 'valor_total'])
+
+    def test_api_de_produtos_anota_quantidade_chegando(self):
+        self.criar_produto('Agenda', [(2, Decimal('5.00'))], preco_venda=Decimal('10.00'))
+        ProdutoChegando.objects.create(nome='agenda', quantidade=4, preco_compra=Decimal('5.00'))
+        url = reverse('inventario:buscar_produtos_listagem_json')
+
+        [produto] = self.client.get(url, {'fields': 'quantidade_chegando,margem_cor'}).json()['produtos']
+        self.assertEqual(produto['quantidade_chegando'], 4)
+        self.assertEqual(produto['margem_cor'], 'success')
+
+
+class ApiAssincronaTests(EstoqueTestCase):
+    """APIs api/buscar-* como views async, com login e limite de taxa assíncronos"""
+
+    async def test_busca_pelo_cliente_async(self):
+        self.assertTrue(iscoroutinefunction(views.buscar_produtos_json))
+        await sync_to_async(self.criar_produto)('Caneca Azul', [(3, Decimal('4.00'))])
+        url = reverse('inventario:buscar_produtos_json')
+
+        anonimo = AsyncClient()
+        resposta = await anonimo.get(url, {'term': 'can'})
+        self.assertEqual(resposta.status_code, 302)
+
+        cliente = AsyncClient()
+        await cliente.aforce_login(await get_user_model().objects.aget(username='caixa'))
+        [produto] = (await cliente.get(url, {'term': 'can'})).json()
+        self.assertEqual((produto['value'], produto['estoque']), ('Caneca Azul', 3))
+        with self.settings(CATALOGO_EM_MEMORIA=False):
+            self.assertEqual((await cliente.get(url, {'term': 'can'})).json(), [produto])
+
+        dados = (await cliente.get(reverse('inventario:buscar_produtos_listagem_json'), {'fields': 'margem_cor'})).json()
+        self.assertEqual((dados['total'], dados['produtos'][0]['margem_cor']), (1, 'success'))
+
+    def test_limite_por_usuario_reaproveita_o_usuario_carregado(self):
+        url = reverse('inventario:buscar_produtos_json')
+        self.client.get(url, {'term': 'can'})
+        # Sessão e usuário, uma vez cada: o limite de taxa não busca o usuário de novo
+        with self.assertNumQueries(2):
+            self.client.get(url, {'term': 'can'})
+
+    def test_limite_de_taxa_responde_429(self):
+        url = reverse('inventario:buscar_devolucoes_listagem_json')
+        with mock.patch('inventario.limite_taxa.time.time', return_value=1_000_000.0):
+            respostas = [self.client.get(url).status_code for _ in range(61)]
+            self.assertEqual(respostas.count(200), 60)
+            resposta = self.client.get(url)
+            self.assertEqual(resposta.status_code, 429)
+            self.assertTrue(resposta.json()['limite_atingido'])
+            with self.settings(RATELIMIT_ENABLE=False):
+                self.assertEqual(self.client.get(url).status_code, 200)
+        # Janela seguinte
+        with mock.patch('inventario.limite_taxa.time.time', return_value=1_000_060.0):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    async def test_limite_por_usuario_em_view_async(self):
+        @limitar_taxa(chave='user_or_ip', taxa='2/m')
+        async def view(request):
+            return 'ok'
+
+        usuario = await get_user_model().objects.aget(username='caixa')
+        requisicao = RequestFactory().get('/')
+
+        async def auser():
+            return usuario
+        requisicao.auser = auser
+        self.assertEqual([await view(requisicao), await view(requisicao)], ['ok', 'ok'])
+        with self.assertRaises(LimiteExcedido):
+            await view(requisicao)
+        # Outro usuário no mesmo IP tem a sua própria contagem
+        outro = await get_user_model().objects.acreate(username='outro-caixa')
+
+        async def auser_outro():
+            return outro
+        requisicao.auser = auser_outro
+        self.assertEqual(await view(requisicao), 'ok')
+
+
+class ExportacaoVendasTests(EstoqueTestCase):
+    """Exportação CSV das vendas com itens e lotes, gerada em streaming"""
+
+    def ler_csv(self, conteudo):
+        self.assertTrue(conteudo.startswith('\ufeff'))
+        return list(csv.DictReader(StringIO(conteudo[1:]), delimiter=';'))
+
+    def test_exporta_uma_linha_por_lote_com_filtros(self):
+        produto = self.criar_produto('Vaso', [(1, Decimal('4.00')), (5, Decimal('6.00'))], preco_venda=Decimal('15.00'))
+        self.postar_venda([{'id': produto.id, 'quantidade': 3}], tipo_venda='LOJA', taxa_aplicada='10.00')
+        self.postar_venda([{'id': produto.id, 'quantidade': 1}], tipo_venda='EXTERNA')
+        url = reverse('inventario:exportar_vendas')
+
+        resposta = self.client.get(url, {'tipo_venda': 'LOJA', 'data_inicio': timezone.localdate().isoformat()})
+        self.assertTrue(resposta.streaming)
+        linhas = self.ler_csv(b''.join(resposta.streaming_content).decode())
+        self.assertEqual([(linha['quantidade_lote'], linha['custo_lote']) for linha in linhas], [('1', '4,00'), ('2', '12,00')])
+        item = ItemVenda.objects.get(venda__tipo_venda='LOJA')
+        self.assertEqual(linhas[0]['meu_lucro_item'], f'{item.meu_lucro_item:.2f}'.replace('.', ','))
+
+        ontem = (timezone.localdate() - timedelta(days=1)).isoformat()
+        self.assertEqual(self.ler_csv(b''.join(self.client.get(url, {'data_fim': ontem}).streaming_content).decode()), [])
+
+        saida = StringIO()
+        call_command('exportar_vendas', '--tipo-venda', 'EXTERNA', stdout=saida)
+        [linha] = self.ler_csv(saida.getvalue())
+        self.assertEqual((linha['tipo_venda'], linha['preco_compra_lote']), ('EXTERNA', '6,00'))
+
+
+class ImportacaoProdutosTests(EstoqueTestCase):
+    """Importação de produtos e lotes por CSV em blocos, com simulação"""
+
+    CSV = (
+        'nome;fornecedor;preco_venda;quantidade;preco_compra\n'
+        'caneca  AZUL;acme;12,00;5;3,50\n'
+        'Prato Fundo;;9,90;2;4,00\n'
+        'Prato fundo;;;1;4,50\n'
+        'Copo;Vidraria Nova;;x;1\n'
+        'Garfo;;;3;\n'
+    )
+
+    def test_simulacao_e_importacao_pela_tela(self):
+        acme = Fornecedor.objects.create(nome='Acme')
+        caneca = self.criar_produto('Caneca Azul', [(1, Decimal('3.00'))])
+        caneca.fornecedor = acme
+        caneca.save()
+        url = reverse('inventario:importar_produtos')
+
+        def enviar(simular):
+            arquivo = SimpleUploadedFile('catalogo.csv', self.CSV.encode('utf-8-sig'), content_type='text/csv')
+            return self.client.post(url, {'arquivo': arquivo, 'simular': 'on' if simular else ''}).context['resultado']
+
+        resultado = enviar(simular=True)
+        self.assertEqual((resultado.produtos_criados, resultado.produtos_atualizados, resultado.lotes_criados), (1, 1, 3))
+        self.assertEqual([numero for numero, _ in resultado.erros], [5, 6])
+        self.assertEqual(Produto.objects.count(), 1)
+        self.assertEqual(Lote.objects.count(), 1)
+
+        resultado = enviar(simular=False)
+        self.assertEqual(resultado.linhas_importadas, 3)
+        caneca.refresh_from_db()
+        self.assertEqual((caneca.preco_venda, caneca.estoque_atual, caneca.custo_estoque), (Decimal('12.00'), 6, Decimal('20.50')))
+        prato = Produto.objects.get(nome_normalizado='prato fundo')
+        self.assertEqual((prato.nome, prato.estoque_atual, prato.fornecedor), ('Prato Fundo', 3, None))
+        self.assertEqual(verificar_estoque(), [])
+        self.assertFalse(Fornecedor.objects.filter(nome='Vidraria Nova').exists())
+
+    def test_milhares_de_linhas_com_queries_por_bloco(self):
+        linhas = ['nome,fornecedor,preco_venda,quantidade,preco_compra']
+        linhas += [f'Produto {i},Fornecedor {i % 7},10.00,{i % 5 + 1},2.50' for i in range(5000)]
+
+        with CaptureQueriesContext(connection) as consultas:
+            resultado = importar_arquivo(StringIO('\n'.join(linhas)), tamanho_bloco=1000)
+        self.assertEqual((resultado.produtos_criados, resultado.lotes_criados, resultado.erros), (5000, 5000, []))
+        self.assertEqual(Fornecedor.objects.count(), 7)
+        # Uma busca de produtos e um UPDATE de totais por bloco (os INSERTs são divididos só pelo limite de parâmetros do SQLite)
+        sqls = [q['sql'] for q in consultas.captured_queries]
+        self.assertEqual(len([sql for sql in sqls if sql.startswith('SELECT "inventario_produto"')]), 5)
+        self.assertEqual(len([sql for sql in sqls if sql.startswith('UPDATE "inventario_produto"')]), 5)
+        self.assertLess(len(sqls), 150)
+
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', encoding='utf-8') as arquivo:
+            arquivo.write('\n'.join(linhas[:1] + ['Produto 1,Fornecedor 1,11.00,2,2.50', 'Sem preço,,,2,']))
+            arquivo.flush()
+            saida = StringIO()
+            call_command('importar_produtos', arquivo.name, '--simular', stdout=saida, stderr=StringIO())
+        self.assertIn('[SIMULAÇÃO] 2 linha(s) lida(s): 0 produto(s) criado(s), 1 atualizado(s), 1 lote(s)', saida.getvalue())
+        self.assertEqual(Produto.objects.get(nome='Produto 1').preco_venda, Decimal('10.00'))
+
+
+    def test_valores_nao_numericos_viram_erro_da_linha(self):
+        csv_arquivo = StringIO('nome;preco_venda;quantidade;preco_compra\nFoo;NaN;;\nBar;10,00;1;sNaN\nBaz;Infinity;;\nOk;5,00;;\n')
+        resultado = importar_arquivo(csv_arquivo, simular=True)
+        self.assertEqual([numero for numero, _ in resultado.erros], [2, 3, 4])
+        self.assertEqual(resultado.produtos_criados, 1)
+
+
+class RecebimentoProdutosChegandoTests(EstoqueTestCase):
+    """Recebimento em lote de produtos chegando, com número fixo de queries"""
+
+    def chegando(self, nome, quantidade=2, preco=Decimal('5.00'), **campos):
+        return ProdutoChegando.objects.create(nome=nome, quantidade=quantidade, preco_compra=preco, **campos)
+
+    def test_recebe_selecionados_reaproveitando_produtos(self):
+        fornecedor = Fornecedor.objects.create(nome='Distribuidora')
+        caneca = self.criar_produto('Caneca', [(1, Decimal('4.00'))])
+        pausado = Produto.objects.create(nome='Pires', ativo=False)
+        itens = [
+            self.chegando('Qualquer Nome', produto_existente=pausado),
+            self.chegando('CANECA', quantidade=3),
+            self.chegando('Tigela', fornecedor=fornecedor),
+            self.chegando('tigela', preco=Decimal('6.00'), fornecedor=fornecedor),
+        ]
+        outro = self.chegando('Pires')
+        self.assertContains(self.client.get(reverse('inventario:listar_produtos_chegando')), 'Receber todos')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            resposta = self.client.post(reverse('inventario:receber_produtos_chegando'), {'ids': [item.pk for item in itens]})
+        self.assertRedirects(resposta, reverse('inventario:listar_produtos_chegando'))
+
+        caneca.refresh_from_db()
+        pausado.refresh_from_db()
+        tigela = Produto.objects.get(nome_normalizado='tigela')
+        self.assertEqual((caneca.estoque_atual, pausado.estoque_atual), (4, 2))
+        self.assertEqual((tigela.estoque_atual, tigela.custo_estoque, tigela.fornecedor), (4, Decimal('22.00'), fornecedor))
+        self.assertEqual(verificar_estoque(), [])
+        self.assertFalse(ProdutoChegando.objects.filter(pk__in=[item.pk for item in itens], incluido_estoque=False).exists())
+        outro.refresh_from_db()
+        self.assertFalse(outro.incluido_estoque)
+
+    def test_recebe_todos_do_fornecedor_com_queries_constantes(self):
+        url = reverse('inventario:receber_produtos_chegando')
+        poucos = Fornecedor.objects.create(nome='Poucos')
+        muitos = Fornecedor.objects.create(nome='Muitos')
+        for i in range(2):
+            self.chegando(f'Item {i}', fornecedor=poucos)
+        for i in range(30):
+            self.chegando(f'Item {i % 15} B', fornecedor=muitos)
+
+        with CaptureQueriesContext(connection) as consultas_poucos:
+            self.client.post(url, json.dumps({'fornecedor_id': poucos.pk}), content_type='application/json')
+        with CaptureQueriesContext(connection) as consultas_muitos:
+            dados = self.client.post(
+                url, json.dumps({'fornecedor_id': muitos.pk, 'precos': {}}), content_type='application/json'
+            ).json()
+        self.assertEqual(len(consultas_poucos), len(consultas_muitos))
+        self.assertEqual((len(dados['recebidos']), len(dados['produtos_criados'])), (30, 15))
+        self.assertFalse(ProdutoChegando.objects.filter(incluido_estoque=False).exists())
+
+
+class QuantidadeChegandoTests(EstoqueTestCase):
+    """Quantidade chegando por produto: mesma regra na listagem, na API e nas tendências"""
+
+    def chegando(self, nome, quantidade, **campos):
+        return ProdutoChegando.objects.create(nome=nome, quantidade=quantidade, preco_compra=Decimal('5.00'), **campos)
+
+    def test_vinculados_e_por_nome_somam_igual_em_todas_as_telas(self):
+        caneca = self.criar_produto('Caneca Azul', [(2, Decimal('4.00'))])
+        pausado = Produto.objects.create(nome='Pires', ativo=False)
+        self.chegando('Outro Nome', 3, produto_existente=caneca)
+        self.chegando('CANECA  azul', 4)
+        self.chegando('Pires', 5)  # sem vínculo, não conta para produto pausado
+        self.chegando('Pires', 6, produto_existente=pausado)
+        self.chegando('Caneca Azul', 7, incluido_estoque=True)
+
+        self.assertEqual((caneca.quantidade_chegando, pausado.quantidade_chegando), (7, 6))
+        anotados = dict(anotar_quantidade_chegando(Produto.objects.all()).values_list('nome', 'qtd_chegando'))
+        self.assertEqual(anotados, {'Caneca Azul': 7, 'Pires': 6})
+        analise = {produto.nome: produto.qtd_chegando for produto in produtos_para_analise([caneca.pk, pausado.pk])}
+        self.assertEqual(analise, anotados)
+
+        dados = self.client.get(reverse('inventario:buscar_produtos_listagem_json'), {'fields': 'quantidade_chegando'}).json()
+        self.assertEqual(dados['produtos'], [{'id': caneca.pk, 'quantidade_chegando': 7}])
+
+    def test_listagem_sem_query_por_produto(self):
+        url = reverse('inventario:listar_produtos')
+        self.criar_produto('Produto 0', [(1, Decimal('1.00'))])
+        self.chegando('Produto 0', 2)
+        with CaptureQueriesContext(connection) as poucos:
+            self.client.get(url, {'ordenar': 'chegando', 'ordem': 'desc'})
+        for i in range(1, 15):
+            produto = self.criar_produto(f'Produto {i}', [(1, Decimal('1.00'))])
+            self.chegando(f'produto {i}', i + 2)
+            self.chegando('Vinculado', 1, produto_existente=produto)
+        with CaptureQueriesContext(connection) as muitos:
+            resposta = self.client.get(url, {'ordenar': 'chegando', 'ordem': 'desc'})
+        self.assertEqual(len(poucos), len(muitos))
+        self.assertEqual([produto.nome for produto in resposta.context['produtos']][:2], ['Produto 14', 'Produto 13'])
+
+
+class InstrumentacaoDesempenhoTests(EstoqueTestCase):
+    """Middleware de orçamento de queries e página /_perf/"""
+
+    def setUp(self):
+        super().setUp()
+        desempenho.zerar()
+        self.addCleanup(desempenho.zerar)
+
+    def test_desligada_nao_mede(self):
+        resposta = self.client.get(reverse('inventario:listar_produtos'))
+        self.assertNotIn('Server-Timing', resposta)
+        self.assertEqual(desempenho.resumo(), [])
+
+    @override_settings(PERF_INSTRUMENTACAO=True, PERF_ORCAMENTOS={'inventario:detalhar_produto': 1})
+    def test_mede_queries_repetidas_e_avisa_orcamento(self):
+        produto = self.criar_produto('Caneca', [(1, Decimal('4.00'))])
+        resposta = self.client.get(reverse('inventario:listar_produtos'))
+        self.assertRegex(resposta['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", total;dur=[\d.]+$')
+
+        with self.assertLogs('inventario.desempenho', 'WARNING') as logs:
+            self.client.get(reverse('inventario:detalhar_produto', args=[produto.pk]))
+        self.assertIn('inventario:detalhar_produto', logs.output[0])
+
+        linhas = {linha['view']: linha for linha in desempenho.resumo()}
+        self.assertEqual(linhas['inventario:listar_produtos']['requisicoes'], 1)
+        self.assertEqual(linhas['inventario:detalhar_produto']['estouros'], 1)
+        self.assertEqual(
+            desempenho.impressao_digital("SELECT 1 FROM x WHERE id IN (%s, %s) AND nome = 'a'"),
+            "SELECT ? FROM x WHERE id IN (...) AND nome = '?'",
+        )
+
+    @override_settings(PERF_INSTRUMENTACAO=True)
+    async def test_mede_views_async_sem_sair_do_event_loop(self):
+        self.assertTrue(iscoroutinefunction(DesempenhoMiddleware(views.buscar_vendas_listagem_json)))
+        cliente = AsyncClient()
+        await cliente.aforce_login(await get_user_model().objects.aget(username='caixa'))
+        resposta = await cliente.get(reverse('inventario:buscar_vendas_listagem_json'))
+        self.assertRegex(resposta['Server-Timing'], r'^db;dur=[\d.]+;desc="[1-9]\d* queries"')
+        [linha] = [linha for linha in desempenho.resumo() if linha['view'] == 'inventario:buscar_vendas_listagem_json']
+        self.assertEqual(linha['requisicoes'], 1)
+
+    @override_settings(PERF_INSTRUMENTACAO=True)
+    def test_painel_somente_staff(self):
+        url = reverse('inventario:painel_desempenho')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        staff = get_user_model().objects.create_user(username='gerente', password='senha-teste-123', is_staff=True)
+        self.client.force_login(staff)
+        self.client.get(reverse('inventario:listar_produtos'))
+        resposta = self.client.get(url)
+        self.assertContains(resposta, 'inventario:listar_produtos')
+        self.assertContains(resposta, 'Cache do dashboard')
+
+
+class BenchmarkTests(EstoqueTestCase):
+    """Loja sintética e harness de benchmark em escala mínima"""
+
+    def test_loja_sintetica_consistente_e_deterministica(self):
+        loja = gerar_loja(produtos=12, lotes_por_produto=2, vendas=40, semente=7)
+        self.assertEqual(verificar_estoque(), [])
+        self.assertEqual(Venda.objects.count(), loja.vendas)
+        self.assertEqual(
+            ItemVenda.objects.aggregate(total=Sum('quantidade'))['total'],
+            ItemVendaLote.objects.aggregate(total=Sum('quantidade_retirada'))['total'],
+        )
+        nomes = list(Produto.objects.order_by('id').values_list('nome', flat=True))
+        with transaction.atomic():
+            gerar_loja(produtos=12, lotes_por_produto=2, vendas=40, semente=7)
+            self.assertEqual(list(Produto.objects.order_by('id').values_list('nome', flat=True))[12:], nomes)
+            transaction.set_rollback(True)
+
+    def test_mede_cenarios_e_compara_com_baseline(self):
+        resultado = medir_escala(
+            {'produtos': 12, 'lotes_por_produto': 2, 'vendas': 40}, repeticoes=2,
+            cenarios={'listar_produtos', 'criar_venda', 'registrar_devolucao'},
+        )
+        self.assertEqual(set(resultado['cenarios']), {'listar_produtos', 'criar_venda', 'registrar_devolucao'})
+        self.assertFalse([medida for medida in resultado['cenarios'].values() if 'erro' in medida])
+        self.assertEqual(Venda.objects.count(), 0)  # tudo desfeito
+
+        resultados = {'mini': resultado}
+        baseline = gerar_baseline(resultados)
+        self.assertEqual(comparar(resultados, baseline), [])
+        baseline['escalas']['mini']['criar_venda']['queries'] -= 1
+        self.assertEqual(len(comparar(resultados, baseline)), 1)
+
+
+class SimulacaoCargaTests(EstoqueTestCase):
+    """Fluxo do caixa da simulação de carga e reconciliação do estoque"""
+
+    def test_caixa_vende_e_estoque_reconcilia(self):
+        gerar_loja(produtos=15, lotes_por_produto=2, vendas=20, semente=3)
+        antes = quantidades_lotes()
+        cliente = ClienteLocal(get_user_model().objects.get(username='caixa'))
+        cliente.fechar = lambda: None  # a conexão pertence à transação do teste
+        resultado = executar_caixa(cliente, iteracoes=6, semente=1, marcador='Carga 1')
+        self.assertGreater(resultado.vendas, 0)
+        self.assertEqual(dict(resultado.erros), {})
+        self.assertEqual(len(resultado.latencias['detalhar_venda']), resultado.vendas)
+        self.assertEqual(reconciliar(antes, 'Carga 1'), [])
+
+        Lote.objects.filter(pk=next(iter(antes))).update(quantidade_atual=F('quantidade_atual') + 1)
+        self.assertTrue(reconciliar(antes, 'Carga 1'))
+
+    def test_classifica_erros_de_lock(self):
+        self.assertEqual(classificar_erro('deadlock detected'), 'deadlock')
+        self.assertEqual(classificar_erro('database is locked'), 'lock')
+        self.assertIsNone(classificar_erro('Estoque insuficiente para o produto: Caneca'))
+
+
+class DevolucaoTests(EstoqueTestCase):
+    """Devoluções em lote: saldo por item, lotes de origem e estorno total"""
+
+    def setUp(self):
+        super().setUp()
+        self.caneca = self.criar_produto('Caneca', [(2, Decimal('5.00')), (5, Decimal('6.00'))])
+        self.copo = self.criar_produto('Copo', [(4, Decimal('3.00'))])
+        self.venda_id = self.postar_venda([
+            {'id': self.caneca.id, 'quantidade': 3}, {'id': self.copo.id, 'quantidade': 2},
+        ]).json()['venda_id']
+        self.item_caneca = ItemVenda.objects.get(venda_id=self.venda_id, produto=self.caneca)
+        self.item_copo = ItemVenda.objects.get(venda_id=self.venda_id, produto=self.copo)
+        self.url = reverse('inventario:registrar_devolucao', kwargs={'venda_pk': self.venda_id})
+
+    def quantidades_lotes(self, produto):
+        return list(produto.lotes.order_by('data_entrada').values_list('quantidade_atual', flat=True))
+
+    def test_devolucao_parcial_volta_aos_lotes_de_origem(self):
+        self.client.post(self.url, {f'item_{self.item_caneca.id}': 2, 'motivo': 'Defeito'})
+
+        self.assertEqual(self.quantidades_lotes(self.caneca), [2, 4])
+        item = ItemDevolucao.objects.get()
+        self.assertEqual(item.quantidade, 2)
+        self.assertTrue(item.devolvido_ao_estoque)
+        self.assertEqual(verificar_estoque(), [])
+
+        resposta = self.client.post(self.url, {f'item_{self.item_caneca.id}': 2})
+        self.assertRedirects(resposta, self.url, fetch_redirect_response=False)
+        self.assertEqual(Devolucao.objects.count(), 1)
+
+    def test_devolver_tudo_estorna_o_saldo_de_todos_os_itens(self):
+        self.client.post(self.url, {f'item_{self.item_copo.id}': 1})
+        self.client.post(self.url, {'devolver_tudo': '1'})
+
+        self.assertEqual(self.quantidades_lotes(self.caneca), [2, 5])
+        self.assertEqual(self.quantidades_lotes(self.copo), [4])
+        devolvidas = dict(ItemDevolucao.objects.values('item_venda_original').annotate(
+            total=Sum('quantidade')
+        ).values_list('item_venda_original', 'total'))
+        self.assertEqual(devolvidas, {self.item_caneca.id: 3, self.item_copo.id: 2})
+        venda = Venda.objects.get(pk=self.venda_id)
+        self.assertEqual(venda.tipo_devolucao, 'total')
+
+        with self.assertNumQueries(2):
+            linhas = itens_para_devolucao(venda)
+            self.assertEqual([linha['max_para_devolver'] for linha in linhas], [0, 0])
+
+    def test_retornar_item_antigo_ao_estoque(self):
+        devolucao = Devolucao.objects.create(venda_original_id=self.venda_id)
+        item = ItemDevolucao.objects.create(devolucao=devolucao, item_venda_original=self.item_caneca, quantidade=3)
+        url = reverse('inventario:retornar_item_ao_estoque', kwargs={'item_id': item.id})
+
+        self.client.post(url)
+        self.client.post(url)
+
+        self.assertEqual(self.quantidades_lotes(self.caneca), [2, 5])
+        item.refresh_from_db()
+        self.assertTrue(item.devolvido_ao_estoque)
+
+
+class ConcorrenciaEstoqueTests(EstoqueTestCase):
+    """Baixas condicionais nos lotes e retentativa de transações"""
+
+    def test_baixa_condicional_nao_deixa_lote_negativo(self):
+        produto = self.criar_produto('Caneca', [(2, Decimal('5.00')), (3, Decimal('6.00'))])
+        primeiro, segundo = produto.lotes.order_by('data_entrada')
+
+        with self.assertRaises(ConflitoEstoque):
+            with transaction.atomic():
+                movimentar_lotes({primeiro.pk: -1, segundo.pk: -4})
+        self.assertEqual(list(produto.lotes.order_by('data_entrada').values_list('quantidade_atual', flat=True)), [2, 3])
+
+        movimentar_lotes({primeiro.pk: -2, segundo.pk: 1})
+        self.assertEqual(list(produto.lotes.order_by('data_entrada').values_list('quantidade_atual', flat=True)), [0, 4])
+
+
+class VendasParalelasTests(TransactionTestCase):
+    """
+    Caixas vendendo ao mesmo tempo (sem a transação do TestCase). No SQLite cada
+    escrita trava o banco inteiro, então os conflitos de linha do PostgreSQL
+    (ex.: chaves dos totais diários) são cobertos pela retentativa, testada à parte.
+    """
+
+    CAIXAS = 10
+
+    def setUp(self):
+        self.usuario = get_user_model().objects.create_user(username='caixa', password='senha-teste-123')
+        Configuracao.objects.get_or_create()
+        cache.clear()
+        self.produto = Produto.objects.create(nome='Caneca', preco_venda=Decimal('20.00'))
+        agora = timezone.now()
+        criar_lote(self.produto, 2, Decimal('5.00'), data_entrada=agora - timedelta(days=2))
+        criar_lote(self.produto, 3, Decimal('6.00'), data_entrada=agora - timedelta(days=1))
+
+    @override_settings(RETENTATIVAS_TRANSACAO=50)
+    def test_vendas_simultaneas_nao_vendem_alem_do_estoque(self):
+        barreira = threading.Barrier(self.CAIXAS, timeout=10)
+        respostas = []
+        # Login antes das threads: só a venda disputa o banco
+        clientes = [Client() for _ in range(self.CAIXAS)]
+        for cliente in clientes:
+            cliente.force_login(self.usuario)
+
+        def caixa(cliente):
+            try:
+                barreira.wait()
+                resposta = cliente.post(
+                    reverse('inventario:criar_venda'),
+                    json.dumps({'tipo_venda': 'LOJA', 'itens': [{'id': self.produto.pk, 'quantidade': 1}]}),
+                    content_type='application/json',
+                )
+                respostas.append(resposta.json())
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=caixa, args=(cliente,)) for cliente in clientes]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        vendidas = [resposta for resposta in respostas if resposta['sucesso']]
+        recusadas = [resposta['erro'] for resposta in respostas if not resposta['sucesso']]
+        self.assertEqual(len(vendidas), 5)
+        self.assertEqual(len(recusadas), self.CAIXAS - 5)
+        self.assertTrue(all(erro.startswith('Estoque insuficiente') for erro in recusadas), recusadas)
+        self.assertEqual(list(self.produto.lotes.order_by('data_entrada').values_list('quantidade_atual', flat=True)), [0, 0])
+        self.assertEqual(ItemVendaLote.objects.aggregate(total=Sum('quantidade_retirada'))['total'], 5)
+        self.assertEqual(verificar_estoque(), [])
+
+    @override_settings(RETENTATIVAS_TRANSACAO=50)
+    def test_vendas_do_mesmo_dia_com_produtos_diferentes(self):
+        # Nenhum lote em comum: só os totais do dia são disputados (travar_dias no PostgreSQL)
+        produtos = [self.produto] + [
+            Produto.objects.create(nome=f'Copo {i}', preco_venda=Decimal('10.00')) for i in range(self.CAIXAS - 1)
+        ]
+        for produto in produtos[1:]:
+            criar_lote(produto, 1, Decimal('4.00'))
+        barreira = threading.Barrier(self.CAIXAS, timeout=10)
+        respostas = []
+        clientes = [Client() for _ in range(self.CAIXAS)]
+        for cliente in clientes:
+            cliente.force_login(self.usuario)
+
+        def caixa(cliente, produto):
+            try:
+                barreira.wait()
+                resposta = cliente.post(
+                    reverse('inventario:criar_venda'),
+                    json.dumps({'tipo_venda': 'LOJA', 'itens': [{'id': produto.pk, 'quantidade': 1}]}),
+                    content_type='application/json',
+                )
+                respostas.append(resposta.json())
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=caixa, args=argumentos) for argumentos in zip(clientes, produtos)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertTrue(all(resposta['sucesso'] for resposta in respostas), respostas)
+        self.assertEqual(len(respostas), self.CAIXAS)
+        hoje = timezone.localdate()
+        diaria = VendaDiaria.objects.get(data=hoje, tipo_venda='LOJA')
+        self.assertEqual((diaria.n_vendas, diaria.receita), (self.CAIXAS, Decimal('20.00') + Decimal('10.00') * (self.CAIXAS - 1)))
+        self.assertEqual(
+            sorted(VendaDiariaProduto.objects.filter(data=hoje).values_list('produto_id', 'quantidade')),
+            [(produto.pk, 1) for produto in sorted(produtos, key=lambda produto: produto.pk)],
+        )
+
+    @override_settings(RETENTATIVAS_TRANSACAO=2)
+    def test_retentativa_so_para_erros_transitorios(self):
+        chamadas = []
+
+        @com_retentativa
+        def falha_transitoria():
+            chamadas.append(1)
+            if len(chamadas) < 3:
+                raise OperationalError('database is locked')
+            return 'ok'
+
+        @com_retentativa
+        def falha_permanente():
+            chamadas.append(1)
+            raise OperationalError('no such table: inventario_lote')
+
+        self.assertEqual(falha_transitoria(), 'ok')
+        self.assertEqual(len(chamadas), 3)
+        chamadas.clear()
+
+        # Chave única dos totais diários gravada por outra venda do mesmo dia: refeita
+        hoje = timezone.localdate()
+        VendaDiaria.objects.create(data=hoje, tipo_venda='LOJA')
+
+        @com_retentativa
+        @transaction.atomic
+        def conflito_nos_totais():
+            chamadas.append(1)
+            if len(chamadas) == 1:
+                VendaDiaria.objects.create(data=hoje, tipo_venda='LOJA')
+            atualizar_vendas_diarias([hoje])
+            return 'ok'
+
+        self.assertEqual(conflito_nos_totais(), 'ok')
+        self.assertEqual(len(chamadas), 2)
+        chamadas.clear()
+
+        @com_retentativa
+        @transaction.atomic
+        def outra_chave_unica():
+            chamadas.append(1)
+            get_user_model().objects.create(username='caixa')
+
+        with self.assertRaises(IntegrityError):
+            outra_chave_unica()
+        self.assertEqual(len(chamadas), 1)
+        chamadas.clear()
+        with self.assertRaises(OperationalError):
+            falha_permanente()
+        self.assertEqual(len(chamadas), 1)
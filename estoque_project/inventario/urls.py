@@ -7,12 +7,19 @@ urlpatterns = [
     # Setup inicial - criar superusuário (apenas uma vez)
     path('setup-admin/', views.setup_admin, name='setup_admin'),
     path('', views.dashboard, name='dashboard'),
+    # Health checks (sem login)
+    path('healthz', views.healthz, name='healthz'),
+    path('readyz', views.readyz, name='readyz'),
+    # Instrumentação de queries (staff)
+    path('_perf/', views.painel_desempenho, name='painel_desempenho'),
     # PWA
     path('offline/', views.offline, name='offline'),
     path('sw.js', views.service_worker, name='service_worker'),
     # URLs Produto
     path('produtos/', views.listar_produtos, name='listar_produtos'),
     path('produtos/novo/', views.criar_produto, name='criar_produto'),
+    path('produtos/importar/', views.importar_produtos, name='importar_produtos'),
+    path('produtos/parados/', views.relatorio_produtos_parados, name='produtos_parados'),
     path('produtos/<int:pk>/', views.detalhar_produto, name='detalhar_produto'),
     path('produtos/<int:pk>/editar/', views.editar_produto, name='editar_produto'),
     path('produtos/<int:pk>/pausar/', views.pausar_produto, name='pausar_produto'),
@@ -23,6 +30,7 @@ urlpatterns = [
     # URLs Vendas
     path('vendas/', views.listar_vendas, name='listar_vendas'),
     path('vendas/nova/', views.criar_venda, name='criar_venda'),
+    path('vendas/exportar/', views.exportar_vendas, name='exportar_vendas'),
     path('vendas/<int:pk>/', views.detalhar_venda, name='detalhar_venda'),
     path('vendas/<int:pk>/editar/', views.editar_venda, name='editar_venda'),
     path('vendas/<int:pk>/excluir/', views.excluir_venda, name='excluir_venda'),
@@ -35,6 +43,7 @@ urlpatterns = [
     # URLs Produtos Chegando
     path('chegando/', views.listar_produtos_chegando, name='listar_produtos_chegando'),
     path('chegando/novo/', views.criar_produto_chegando, name='criar_produto_chegando'),
+    path('chegando/receber/', views.receber_produtos_chegando, name='receber_produtos_chegando'),
     path('chegando/<int:pk>/editar/', views.editar_produto_chegando, name='editar_produto_chegando'),
     path('chegando/<int:pk>/excluir/', views.excluir_produto_chegando, name='excluir_produto_chegando'),
     path('chegando/<int:pk>/incluir/', views.incluir_no_estoque, name='incluir_no_estoque'),
@@ -0,0 +1,154 @@
+"""
+Tabelas de totais diários das vendas (VendaDiaria e VendaDiariaProduto).
+
+Os totais de um dia são refeitos a partir do resumo gravado em cada Venda
+sempre que uma venda daquele dia é criada, editada, excluída ou recebe uma
+devolução. O dashboard lê no máximo uma linha por dia e tipo de venda em vez
+de reagregar as vendas e seus itens a cada carregamento.
+
+No PostgreSQL os dias refeitos ficam travados (advisory lock por dia) até o
+fim da transação: duas vendas do mesmo dia com produtos diferentes não
+disputam nenhum lote, e sem a trava as duas apagariam e regravariam as mesmas
+linhas ao mesmo tempo (violação de chave única, ou totais sem a outra venda).
+"""
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Sum, Count, F, Q, ExpressionWrapper, DecimalField
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .cache_dashboard import agendar_invalidacao
+from .models import Venda, ItemVenda, VendaDiaria, VendaDiariaProduto
+
+# Primeira chave de pg_advisory_xact_lock(chave, dia) para os totais diários
+CHAVE_TRAVA_DIAS = 71830
+
+
+def dia_local(valor):
+    """Converte um datetime (com timezone) para a data local; datas são mantidas."""
+    if isinstance(valor, datetime):
+        return timezone.localtime(valor).date()
+    return valor
+
+
+def _filtro_dias(dias, campo='data'):
+    """Q com os intervalos [00:00, 24:00) de cada dia local informado."""
+    filtro = Q()
+    for dia in dias:
+        inicio = timezone.make_aware(datetime.combine(dia, time.min))
+        filtro |= Q(**{f'{campo}__gte': inicio, f'{campo}__lt': inicio + timedelta(days=1)})
+    return filtro
+
+
+def travar_dias(dias):
+    """
+    Trava os dias (em ordem) até o fim da transação atual, no PostgreSQL. Quem
+    espera lê depois os totais já com as vendas de quem travou antes.
+    """
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        for dia in sorted(dias):
+            cursor.execute('SELECT pg_advisory_xact_lock(%s, %s)', [CHAVE_TRAVA_DIAS, dia.toordinal()])
+
+
+def _linhas_vendas(vendas):
+    valor_total = F('valor_bruto_registrado') - F('desconto')
+    for linha in vendas.annotate(dia=TruncDate('data')).values('dia', 'tipo_venda').annotate(
+        receita_dia=Sum(valor_total),
+        custo_dia=Sum('custo_total_registrado'),
+        taxa_dia=Sum(ExpressionWrapper(
+            valor_total * F('taxa_aplicada') / 100,
+            output_field=DecimalField(max_digits=16, decimal_places=6)
+        )),
+        meu_lucro_dia=Sum('meu_lucro_registrado'),
+        n_vendas_dia=Count('id'),
+    ).order_by('dia', 'tipo_venda'):
+        yield VendaDiaria(
+            data=linha['dia'],
+            tipo_venda=linha['tipo_venda'],
+            receita=linha['receita_dia'] or Decimal('0.00'),
+            custo=linha['custo_dia'] or Decimal('0.00'),
+            taxa=linha['taxa_dia'] or Decimal('0.00'),
+            meu_lucro=linha['meu_lucro_dia'] or Decimal('0.00'),
+            n_vendas=linha['n_vendas_dia'],
+        )
+
+
+def _linhas_produtos(itens):
+    for linha in itens.annotate(dia=TruncDate('venda__data')).values('dia', 'produto_id').annotate(
+        quantidade_dia=Sum('quantidade'),
+        receita_dia=Sum(F('quantidade') * F('preco_venda_unitario')),
+        custo_dia=Sum('custo_compra_total_registrado'),
+    ).order_by('dia', 'produto_id'):
+        yield VendaDiariaProduto(
+            data=linha['dia'],
+            produto_id=linha['produto_id'],
+            quantidade=linha['quantidade_dia'] or 0,
+            receita=linha['receita_dia'] or Decimal('0.00'),
+            custo=linha['custo_dia'] or Decimal('0.00'),
+        )
+
+
+def atualizar_vendas_diarias(datas):
+    """
+    Refaz os totais dos dias informados (datas ou datetimes de vendas).
+
+    Deve ser chamada depois que o resumo das vendas envolvidas estiver gravado.
+    """
+    dias = sorted({dia_local(valor) for valor in datas if valor})
+    if not dias:
+        return
+
+    vendas = Venda.objects.filter(_filtro_dias(dias), status='CONCLUIDA')
+    itens = ItemVenda.objects.filter(_filtro_dias(dias, 'venda__data'), venda__status='CONCLUIDA')
+
+    with transaction.atomic():
+        travar_dias(dias)
+        VendaDiaria.objects.filter(data__in=dias).delete()
+        VendaDiariaProduto.objects.filter(data__in=dias).delete()
+        VendaDiaria.objects.bulk_create(list(_linhas_vendas(vendas)))
+        VendaDiariaProduto.objects.bulk_create(list(_linhas_produtos(itens)))
+        agendar_invalidacao()
+
+
+def reconstruir_vendas_diarias(desde=None):
+    """
+    Regenera as tabelas diárias a partir do histórico (opcionalmente só a partir
+    da data `desde`). Retorna a quantidade de linhas diárias criadas.
+    """
+    vendas = Venda.objects.filter(status='CONCLUIDA')
+    itens = ItemVenda.objects.filter(venda__status='CONCLUIDA')
+    diarias = VendaDiaria.objects.all()
+    diarias_produtos = VendaDiariaProduto.objects.all()
+    if desde:
+        inicio = timezone.make_aware(datetime.combine(desde, time.min))
+        vendas = vendas.filter(data__gte=inicio)
+        itens = itens.filter(venda__data__gte=inicio)
+        diarias = diarias.filter(data__gte=desde)
+        diarias_produtos = diarias_produtos.filter(data__gte=desde)
+
+    with transaction.atomic():
+        diarias.delete()
+        diarias_produtos.delete()
+        linhas = list(_linhas_vendas(vendas))
+        VendaDiaria.objects.bulk_create(linhas, batch_size=1000)
+        VendaDiariaProduto.objects.bulk_create(_linhas_produtos(itens), batch_size=1000)
+        agendar_invalidacao()
+    return len(linhas)
+
+
+def totais_periodo(inicio, fim):
+    """Receita, meu lucro e número de vendas somados entre as datas (inclusive)."""
+    totais = VendaDiaria.objects.filter(data__range=[inicio, fim]).aggregate(
+        receita=Sum('receita'),
+        meu_lucro=Sum('meu_lucro'),
+        n_vendas=Sum('n_vendas'),
+    )
+    return {
+        'receita': totais['receita'] or Decimal('0'),
+        'meu_lucro': totais['meu_lucro'] or Decimal('0'),
+        'n_vendas': totais['n_vendas'] or 0,
+    }
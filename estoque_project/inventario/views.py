@@ -1,23 +1,46 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from .models import Produto, Fornecedor, Lote, Venda, ItemVenda, ItemVendaLote, Configuracao, Devolucao, ItemDevolucao, ProdutoChegando
-from .forms import ProdutoForm, ProdutoEditForm, LoteForm, ConfiguracaoForm, FornecedorForm
+from .models import Produto, Fornecedor, Venda, ItemVenda, Configuracao, Devolucao, ItemDevolucao, ProdutoChegando, VendaDiaria, VendaDiariaProduto
+from .forms import ProdutoForm, ProdutoEditForm, LoteForm, ConfiguracaoForm, FornecedorForm, ImportarProdutosForm
+from .fifo import normalizar_itens, carregar_estoque, registrar_itens_venda, restaurar_lotes_venda
+from .estoque import (
+    ajustar_estoque, acumular_delta, criar_lote, anotar_quantidade_chegando, movimentar_lotes,
+    produtos_parados, recalcular_ultima_venda,
+)
+from .concorrencia import com_retentativa
+from .vendas_diarias import totais_periodo, atualizar_vendas_diarias
+from .series_temporais import serie_temporal, niveis, cortes_do_maximo
+from .cache_dashboard import obter_contexto, estatisticas as estatisticas_cache_dashboard
+from .tendencias import analisar_produtos, ordenar_analises
+from .previsoes import analises_do_snapshot, recalcular_previsoes
+from .busca import buscar_produtos
+from .catalogo import aobter_catalogo, linha_catalogo
+from .paginacao import paginar, campos_pedidos, aresposta_paginada
+from .exportacao import filtrar_itens, linhas_exportacao, gerar_csv
+from .importacao import importar_arquivo, ErroImportacao
+from .recebimento import receber_produtos_chegando as receber_pendentes
+from .devolucoes import registrar_devolucao as registrar_devolucao_venda, itens_para_devolucao, retornar_ao_estoque
+from . import desempenho
 from django.http import JsonResponse
+import io
 import json
-from django.db import transaction
+from django.db import transaction, connection
+from django.core.cache import cache
+from django.conf import settings
+import time
 from decimal import Decimal
-from django.db.models import Sum, F, OuterRef, Subquery, ExpressionWrapper, fields, Case, When, Value, Q
+from django.db.models import Sum, Count, F, OuterRef, Subquery, ExpressionWrapper, fields, Case, When, Value, Q, Prefetch
+from django.db.models.functions import Coalesce, Round
 from django.utils import timezone
 from datetime import timedelta, datetime
 from django.core.serializers.json import DjangoJSONEncoder
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.views.decorators.http import require_POST, require_http_methods
 from django.contrib import messages
 from django.urls import reverse
-from django_ratelimit.decorators import ratelimit
-from django_ratelimit.exceptions import Ratelimited
+from .limite_taxa import limitar_taxa
 from django.contrib.auth import get_user_model
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
+from django.core.exceptions import PermissionDenied
 
 # Create your views here.
 
@@ -266,58 +289,84 @@ def dashboard(request):
         data_inicio = hoje - timedelta(days=29)
         data_fim = hoje
     
-    # Garante que a data fim inclua o dia inteiro
-    data_fim_query = datetime.combine(data_fim, datetime.max.time())
+    # Otimização: contexto calculado fica em cache até a próxima alteração de vendas/estoque
+    context, acerto = obter_contexto(
+        periodo, data_inicio, data_fim, hoje,
+        lambda: _calcular_contexto_dashboard(periodo, data_inicio, data_fim, hoje)
+    )
+    resposta = render(request, 'inventario/dashboard.html', context)
+    resposta['X-Dashboard-Cache'] = 'HIT' if acerto else 'MISS'
+    return resposta
+
+
+def relatorio_produtos_parados(request):
+    """
+    Relatório completo dos produtos parados há `dias_produto_parado` dias ou
+    mais, do mais parado para o menos, paginado por cursor.
+    """
+    config, _ = Configuracao.objects.get_or_create()
+    hoje = timezone.localdate()
+    produtos = produtos_parados(_limite_parado(hoje, config.dias_produto_parado))
+
+    page_obj = paginar(request, produtos, ['parado_desde', 'id'], 20)
+
+    context = {
+        'page_obj': page_obj,
+        'produtos_parados': _linhas_produtos_parados(page_obj, hoje),
+        'dias_limite_parado': config.dias_produto_parado,
+    }
+    return render(request, 'inventario/produtos_parados.html', context)
+
+
+def _limite_parado(hoje, dias):
+    """Início do dia local seguinte ao último dia que ainda conta como parado há `dias` dias."""
+    return timezone.make_aware(datetime.combine(hoje - timedelta(days=dias - 1), datetime.min.time()))
+
+
+def _linhas_produtos_parados(produtos, hoje):
+    """[{'produto', 'dias_parado', 'quantidade'}] dos produtos anotados por estoque.produtos_parados."""
+    return [
+        {
+            'produto': produto,
+            'dias_parado': (hoje - timezone.localtime(produto.parado_desde).date()).days,
+            'quantidade': produto.estoque_atual,
+        }
+        for produto in produtos
+    ]
+
 
+def _calcular_contexto_dashboard(periodo, data_inicio, data_fim, hoje):
+    """Calcula o contexto do dashboard; QuerySets são convertidos em listas para poderem ir ao cache."""
     # --- 2. Recalcular Estatísticas com Base no Filtro ---
-    # Otimização: Calcular meu_lucro diretamente no banco usando annotate
-    vendas_periodo = Venda.objects.filter(data__range=[data_inicio, data_fim_query]).annotate(
-        valor_bruto_agg=Sum(F('itens__quantidade') * F('itens__preco_venda_unitario')),
-        valor_liquido_agg=F('valor_bruto_agg') - F('desconto'),
-        custo_total_agg=Sum('itens__custo_compra_total_registrado'),
-        lucro_bruto_agg=F('valor_liquido_agg') - F('custo_total_agg'),
-        valor_taxa_calc=ExpressionWrapper(
-            (F('valor_liquido_agg') * F('taxa_aplicada')) / 100,
-            output_field=fields.DecimalField(max_digits=10, decimal_places=2)
-        ),
-        lucro_apos_taxa=F('lucro_bruto_agg') - F('valor_taxa_calc'),
-        meu_lucro_agg=Case(
-            When(tipo_venda='LOJA', then=F('lucro_apos_taxa') / 2),
-            default=F('lucro_apos_taxa'),
-            output_field=fields.DecimalField(max_digits=10, decimal_places=2)
-        )
-    )
+    # Otimização: totais lidos da tabela diária (uma linha por dia e tipo de venda)
+    totais = totais_periodo(data_inicio, data_fim)
     
     # Cards
-    valor_total_estoque = Lote.objects.filter(produto__ativo=True).aggregate(
-        total=Sum(F('quantidade_atual') * F('preco_compra'))
+    valor_total_estoque = Produto.objects.filter(ativo=True).aggregate(
+        total=Sum('custo_estoque')
     )['total'] or Decimal('0')
     
-    numero_vendas = vendas_periodo.count()
-    # Otimização: Agregar meu_lucro calculado no banco
-    meu_lucro_total = vendas_periodo.aggregate(total=Sum('meu_lucro_agg'))['total'] or Decimal('0')
-    # Otimização: Agregar valor_total no banco
-    receita_total = vendas_periodo.aggregate(total=Sum('valor_liquido_agg'))['total'] or Decimal('0')
+    numero_vendas = totais['n_vendas']
+    meu_lucro_total = totais['meu_lucro']
+    receita_total = totais['receita']
+
+    vendas_produtos_periodo = VendaDiariaProduto.objects.filter(data__range=[data_inicio, data_fim])
 
     # --- NOVO: Top 5 Produtos Mais Vendidos no Período ---
-    top_produtos_vendidos = ItemVenda.objects.filter(
-        venda__in=vendas_periodo
-    ).values(
+    top_produtos_vendidos = list(vendas_produtos_periodo.values(
         'produto__id',
         'produto__nome'
     ).annotate(
         quantidade_total_vendida=Sum('quantidade')
-    ).order_by('-quantidade_total_vendida')[:5]
+    ).order_by('-quantidade_total_vendida')[:5])
 
     # --- NOVO: Top 5 Produtos Mais Lucrativos no Período ---
-    produtos_mais_lucrativos = ItemVenda.objects.filter(
-        venda__in=vendas_periodo
-    ).values(
+    produtos_mais_lucrativos = list(vendas_produtos_periodo.values(
         'produto__id',
         'produto__nome'
     ).annotate(
-        receita_total=Sum(F('quantidade') * F('preco_venda_unitario')),
-        custo_total=Sum('custo_compra_total_registrado'),
+        receita_total=Sum('receita'),
+        custo_total=Sum('custo'),
         lucro_total=F('receita_total') - F('custo_total'),
         margem_lucro=Case(
             When(receita_total__gt=0, then=ExpressionWrapper(
@@ -327,159 +376,52 @@ def dashboard(request):
             default=Value(0),
             output_field=fields.DecimalField(max_digits=5, decimal_places=2)
         )
-    ).order_by('-lucro_total')[:5]
+    ).order_by('-lucro_total')[:5])
 
     # Tabela de estoque baixo (não depende do período)
     config, _ = Configuracao.objects.get_or_create()
 
     # Produtos com estoque baixo
-    produtos_estoque_baixo = Produto.objects.annotate(
-        qtd_total=Sum('lotes__quantidade_atual')
-    ).filter(qtd_total__lt=config.limite_estoque_baixo, ativo=True)
+    produtos_estoque_baixo = list(Produto.objects.filter(estoque_atual__lt=config.limite_estoque_baixo, ativo=True))
     
     # Produtos parados (há mais de X dias no estoque sem vender, conforme configuração)
-    # Otimização: Usar Subquery para pegar última venda em uma única query
-    produtos_com_estoque = Produto.objects.annotate(
-        qtd_total=Sum('lotes__quantidade_atual'),
-        ultima_venda_data=Subquery(
-            ItemVenda.objects.filter(
-                produto=OuterRef('pk')
-            ).order_by('-venda__data').values('venda__data')[:1]
-        ),
-        lote_mais_antigo_data=Subquery(
-            Lote.objects.filter(
-                produto=OuterRef('pk'),
-                quantidade_atual__gt=0
-            ).order_by('data_entrada').values('data_entrada')[:1]
-        )
-    ).filter(qtd_total__gt=0, ativo=True).prefetch_related('lotes')
-    
-    produtos_parados = []
-    for produto in produtos_com_estoque:
-        # Calcula há quantos dias está parado usando dados já carregados
-        if produto.ultima_venda_data:
-            # Produto já foi vendido - calcula dias desde a última venda
-            data_ultima_venda = timezone.localtime(produto.ultima_venda_data).date()
-            dias_parado = (hoje - data_ultima_venda).days
-        elif produto.lote_mais_antigo_data:
-            # Produto nunca foi vendido - calcula dias desde o lote mais antigo
-            data_entrada = timezone.localtime(produto.lote_mais_antigo_data).date()
-            dias_parado = (hoje - data_entrada).days
-        else:
-            continue  # Pula se não houver lote
-        
-        # Só adiciona se o produto está parado há X dias ou mais (conforme configuração)
-        if dias_parado >= config.dias_produto_parado:
-            produtos_parados.append({
-                'produto': produto,
-                'dias_parado': dias_parado,
-                'quantidade': produto.qtd_total
-            })
-    
-    # Ordena por dias parado (maior tempo primeiro) e limita a 5
-    produtos_parados = sorted(produtos_parados, key=lambda x: x['dias_parado'], reverse=True)[:5]
+    # Otimização: datas mantidas em Produto, um ORDER BY ... LIMIT pelo índice idx_produto_parado
+    parados = _linhas_produtos_parados(
+        produtos_parados(_limite_parado(hoje, config.dias_produto_parado))[:5], hoje
+    )
 
     # --- 3. Dados do Gráfico de Linhas ---
-    vendas_por_unidade = {}
-    if (data_fim - data_inicio).days <= 90: # Agrupar por dia para períodos curtos
-        delta = data_fim - data_inicio
-        for i in range(delta.days + 1):
-            dia = data_inicio + timedelta(days=i)
-            vendas_por_unidade[dia.strftime('%d/%m')] = {'receita': Decimal('0'), 'meu_lucro': Decimal('0')}
-        
-        for venda in vendas_periodo:
-            # Converter para timezone local antes de formatar
-            data_local = timezone.localtime(venda.data)
-            dia_str = data_local.strftime('%d/%m')
-            if dia_str in vendas_por_unidade:
-                # Otimização: Usar valores já calculados no banco
-                vendas_por_unidade[dia_str]['receita'] += venda.valor_liquido_agg or Decimal('0')
-                vendas_por_unidade[dia_str]['meu_lucro'] += venda.meu_lucro_agg or Decimal('0')
-    else: # Agrupar por mês para períodos longos
-        # Criar dicionário de meses primeiro (baseado no período)
-        meses = set()
-        for venda in vendas_periodo:
-            data_local = timezone.localtime(venda.data)
-            mes_str = data_local.strftime('%b/%y')
-            meses.add(mes_str)
-        
-        for mes_str in sorted(meses):
-            vendas_por_unidade[mes_str] = {'receita': Decimal('0'), 'meu_lucro': Decimal('0')}
-
-        for venda in vendas_periodo:
-            # Converter para timezone local antes de formatar
-            data_local = timezone.localtime(venda.data)
-            mes_str = data_local.strftime('%b/%y')
-            if mes_str in vendas_por_unidade:
-                # Otimização: Usar valores já calculados no banco
-                vendas_por_unidade[mes_str]['receita'] += venda.valor_liquido_agg or Decimal('0')
-                vendas_por_unidade[mes_str]['meu_lucro'] += venda.meu_lucro_agg or Decimal('0')
-    
-    labels_grafico = list(vendas_por_unidade.keys())
-    receita_grafico = [v['receita'] for v in vendas_por_unidade.values()]
-    meu_lucro_grafico = [v['meu_lucro'] for v in vendas_por_unidade.values()]
+    # Agrupar por dia para períodos curtos e por mês para períodos longos (no banco, pela tabela diária)
+    unidade_grafico = 'dia' if (data_fim - data_inicio).days <= 90 else 'mes'
+    serie_vendas = serie_temporal(
+        VendaDiaria.objects.all(), 'data', {'receita': Sum('receita'), 'meu_lucro': Sum('meu_lucro')},
+        unidade_grafico, data_inicio, data_fim
+    )
+    labels_grafico = serie_vendas['rotulos']
+    receita_grafico = serie_vendas['series']['receita']
+    meu_lucro_grafico = serie_vendas['series']['meu_lucro']
 
     # --- 4. Dados do Gráfico Heatmap (últimos 365 dias) ---
     heatmap_inicio = hoje - timedelta(days=364)
-    # Otimização: Calcular meu_lucro no banco para o heatmap também
-    vendas_heatmap = Venda.objects.filter(
-        data__range=[heatmap_inicio, data_fim_query],
-        status='CONCLUIDA'  # Apenas vendas concluídas
-    ).annotate(
-        valor_bruto_hm=Sum(F('itens__quantidade') * F('itens__preco_venda_unitario')),
-        valor_liquido_hm=F('valor_bruto_hm') - F('desconto'),
-        custo_total_hm=Sum('itens__custo_compra_total_registrado'),
-        lucro_bruto_hm=F('valor_liquido_hm') - F('custo_total_hm'),
-        valor_taxa_hm=ExpressionWrapper(
-            (F('valor_liquido_hm') * F('taxa_aplicada')) / 100,
-            output_field=fields.DecimalField(max_digits=10, decimal_places=2)
-        ),
-        lucro_apos_taxa_hm=F('lucro_bruto_hm') - F('valor_taxa_hm'),
-        meu_lucro_hm=Case(
-            When(tipo_venda='LOJA', then=F('lucro_apos_taxa_hm') / 2),
-            default=F('lucro_apos_taxa_hm'),
-            output_field=fields.DecimalField(max_digits=10, decimal_places=2)
-        )
-    ).prefetch_related('itens', 'devolucoes__itens_devolvidos')
-    
-    lucro_por_dia = {}
-    for venda in vendas_heatmap:
-        # Converter para timezone local antes de extrair a data
-        data_local = timezone.localtime(venda.data)
-        dia = data_local.date()
-        lucro_por_dia.setdefault(dia, Decimal('0'))
-        # Otimização: Usar valor já calculado no banco
-        lucro_venda = venda.meu_lucro_hm or Decimal('0')
-        lucro_por_dia[dia] += lucro_venda
-
-    heatmap_data = []
-    max_lucro = max(lucro_por_dia.values()) if lucro_por_dia else 0
-    for i in range(365):
-        dia = heatmap_inicio + timedelta(days=i)
-        lucro = lucro_por_dia.get(dia, 0)
-        
-        # Nivelar o lucro em 5 categorias para as cores
-        nivel = 0
-        if max_lucro > 0:
-            if lucro > max_lucro * Decimal('0.75'): nivel = 4
-            elif lucro > max_lucro * Decimal('0.50'): nivel = 3
-            elif lucro > max_lucro * Decimal('0.25'): nivel = 2
-            elif lucro > 0: nivel = 1
-        
-        heatmap_data.append({
-            'data': dia.isoformat(),
-            'lucro': float(lucro),
-            'nivel': nivel
-        })
+    # Otimização: no máximo 365 linhas da tabela diária (somente vendas concluídas)
+    serie_lucro = serie_temporal(
+        VendaDiaria.objects.all(), 'data', {'lucro': Sum('meu_lucro')}, 'dia', heatmap_inicio, hoje
+    )
+    lucros = serie_lucro['series']['lucro']
+    # Nivelar o lucro em 5 categorias para as cores (frações do maior lucro do ano)
+    heatmap_data = [
+        {'data': dia, 'lucro': float(lucro), 'nivel': nivel}
+        for dia, lucro, nivel in zip(serie_lucro['datas'], lucros, niveis(lucros, cortes_do_maximo(lucros)))
+    ]
     
     # --- 5. Contexto Final ---
-    context = {
+    return {
         'valor_total_estoque': valor_total_estoque,
         'numero_vendas': numero_vendas,
         'meu_lucro_total': meu_lucro_total,
         'receita_total': receita_total,
         'produtos_estoque_baixo': produtos_estoque_baixo,
-        'produtos_parados': produtos_parados,
+        'produtos_parados': parados,
         'dias_limite_parado': config.dias_produto_parado,  # Quantidade de dias conforme configuração
         'top_produtos_vendidos': top_produtos_vendidos,
         'produtos_mais_lucrativos': produtos_mais_lucrativos,
@@ -495,7 +437,6 @@ def dashboard(request):
         'meu_lucro_grafico': json.dumps(meu_lucro_grafico, cls=DjangoJSONEncoder),
         'heatmap_data': json.dumps(heatmap_data),
     }
-    return render(request, 'inventario/dashboard.html', context)
 
 # --- CRUD Produto ---
 
@@ -519,19 +460,20 @@ def listar_produtos(request):
     if query:
         produtos_list = produtos_list.filter(nome__icontains=query)
 
-    produtos = produtos_list.annotate(
-        quantidade_total_agg=Sum('lotes__quantidade_atual'),
-        custo_total=Sum(F('lotes__quantidade_atual') * F('lotes__preco_compra'))
+    # Custo e margem arredondados no banco: são chaves do cursor e precisam voltar
+    # do banco com o mesmo valor usado no WHERE da página seguinte
+    produtos = anotar_quantidade_chegando(produtos_list).annotate(
+        quantidade_total_agg=F('estoque_atual')
     ).annotate(
         custo_medio_ponderado_agg=Case(
-            When(quantidade_total_agg__gt=0, then=F('custo_total') / F('quantidade_total_agg')),
+            When(estoque_atual__gt=0, then=Round(F('custo_estoque') / F('estoque_atual'), 2)),
             default=Value(0),
             output_field=fields.DecimalField(max_digits=10, decimal_places=2)
         )
     ).annotate(
         margem_lucro_agg=Case(
-            When(custo_medio_ponderado_agg__gt=0, then=ExpressionWrapper(
-                (F('preco_venda') - F('custo_medio_ponderado_agg')) * 100 / F('preco_venda'),
+            When(custo_medio_ponderado_agg__gt=0, then=Round(
+                (F('preco_venda') - F('custo_medio_ponderado_agg')) * 100 / F('preco_venda'), 2,
                 output_field=fields.DecimalField(max_digits=5, decimal_places=2)
             )),
             default=Value(None),
@@ -542,34 +484,29 @@ def listar_produtos(request):
     # Aplicar ordenação
     campos_ordenacao = {
         'nome': 'nome',
-        'estoque': 'quantidade_total_agg',
-        'chegando': 'quantidade_total_agg',  # não temos campo agregado para chegando ainda
+        'estoque': 'estoque_atual',
+        'chegando': 'qtd_chegando',
         'preco': 'preco_venda',
         'custo': 'custo_medio_ponderado_agg',
         'margem': 'margem_lucro_agg',
     }
     
     campo = campos_ordenacao.get(ordenar_por, 'nome')
-    if ordem == 'desc':
-        campo = f'-{campo}'
-    
-    produtos = produtos.order_by(campo)
-    
-    # Calcular estatísticas gerais (antes da paginação)
-    total_produtos_diferentes = produtos.count()
-    quantidade_total_geral = produtos.aggregate(
-        total=Sum('quantidade_total_agg')
-    )['total'] or 0
-    
-    # Paginação (20 produtos por página)
-    paginator = Paginator(produtos, 20)
-    page_number = request.GET.get('page')
-    try:
-        page_obj = paginator.get_page(page_number)
-    except PageNotAnInteger:
-        page_obj = paginator.get_page(1)
-    except EmptyPage:
-        page_obj = paginator.get_page(paginator.num_pages)
+    if campo in ('preco_venda', 'margem_lucro_agg'):
+        # A paginação por cursor não compara com NULL: sem preço/margem vai para o início (ou fim, se desc)
+        produtos = produtos.annotate(
+            valor_ordenacao=Coalesce(campo, Value(Decimal('-999999')), output_field=fields.DecimalField(max_digits=10, decimal_places=2))
+        )
+        campo = 'valor_ordenacao'
+    direcao = '-' if ordem == 'desc' else ''
+
+    # Estatísticas gerais em uma query, sem as anotações da listagem
+    totais = produtos_list.aggregate(total_produtos=Count('id'), quantidade=Sum('estoque_atual'))
+    total_produtos_diferentes = totais['total_produtos']
+    quantidade_total_geral = totais['quantidade'] or 0
+
+    # Paginação por cursor (20 produtos por página)
+    page_obj = paginar(request, produtos, [f'{direcao}{campo}', f'{direcao}id'], 20)
     
     context = {
         'page_obj': page_obj,
@@ -597,11 +534,10 @@ def criar_produto(request):
                     fornecedor=form.cleaned_data['fornecedor']
                 )
 
-                Lote.objects.create(
-                    produto=produto,
-                    quantidade_inicial=form.cleaned_data['quantidade_inicial'],
-                    quantidade_atual=form.cleaned_data['quantidade_inicial'],
-                    preco_compra=form.cleaned_data['preco_compra']
+                criar_lote(
+                    produto,
+                    form.cleaned_data['quantidade_inicial'],
+                    form.cleaned_data['preco_compra']
                 )
             return redirect('inventario:listar_produtos')
     else:
@@ -626,36 +562,35 @@ def editar_produto(request, pk):
                 
                 if diferenca > 0:
                     # Aumentar estoque: criar novo lote de ajuste
-                    fornecedor_padrao = Fornecedor.objects.first()
-                    if fornecedor_padrao:
-                        Lote.objects.create(
-                            produto=produto,
-                            fornecedor=fornecedor_padrao,
-                            quantidade_inicial=diferenca,
-                            quantidade_atual=diferenca,
-                            preco_compra=produto.custo_medio_ponderado or produto.preco_venda
-                        )
-                        messages.success(request, f'Estoque aumentado em {diferenca} unidades.')
+                    criar_lote(
+                        produto,
+                        diferenca,
+                        produto.custo_medio_ponderado or produto.preco_venda or Decimal('0.00')
+                    )
+                    messages.success(request, f'Estoque aumentado em {diferenca} unidades.')
                 elif diferenca < 0:
                     # Diminuir estoque: remover dos lotes mais antigos (FIFO)
-                    quantidade_a_remover = abs(diferenca)
-                    lotes_disponiveis = produto.lotes.filter(quantidade_atual__gt=0).order_by('data_entrada')
-                    
-                    for lote in lotes_disponiveis:
-                        if quantidade_a_remover <= 0:
-                            break
-                        
-                        if lote.quantidade_atual <= quantidade_a_remover:
-                            # Remover todo o lote
-                            quantidade_a_remover -= lote.quantidade_atual
-                            lote.quantidade_atual = 0
-                            lote.save()
-                        else:
-                            # Remover parcialmente
-                            lote.quantidade_atual -= quantidade_a_remover
-                            lote.save()
-                            quantidade_a_remover = 0
-                    
+                    @com_retentativa
+                    @transaction.atomic
+                    def reduzir_estoque():
+                        lotes_disponiveis = carregar_estoque([produto.pk])[produto.pk].lotes_fifo
+                        quantidade_a_remover = min(abs(diferenca), sum(lote.quantidade_atual for lote in lotes_disponiveis))
+                        retiradas = {}
+                        deltas = {}
+
+                        for lote in lotes_disponiveis:
+                            if quantidade_a_remover <= 0:
+                                break
+
+                            quantidade_retirada = min(lote.quantidade_atual, quantidade_a_remover)
+                            quantidade_a_remover -= quantidade_retirada
+                            retiradas[lote.id] = -quantidade_retirada
+                            acumular_delta(deltas, lote, -quantidade_retirada)
+
+                        movimentar_lotes(retiradas)
+                        ajustar_estoque(deltas)
+
+                    reduzir_estoque()
                     messages.success(request, f'Estoque reduzido em {abs(diferenca)} unidades.')
             
             return redirect('inventario:detalhar_produto', pk=produto.pk)
@@ -752,10 +687,7 @@ def adicionar_estoque(request, pk):
     if request.method == 'POST':
         form = LoteForm(request.POST)
         if form.is_valid():
-            lote = form.save(commit=False)
-            lote.produto = produto
-            lote.quantidade_atual = lote.quantidade_inicial
-            lote.save()
+            criar_lote(produto, form.cleaned_data['quantidade_inicial'], form.cleaned_data['preco_compra'])
             return redirect('inventario:detalhar_produto', pk=produto.pk)
     else:
         form = LoteForm()
@@ -767,6 +699,34 @@ def adicionar_estoque(request, pk):
     }
     return render(request, 'inventario/adicionar_estoque.html', context)
 
+# Erros de linha exibidos no relatório da importação (o total aparece sempre)
+ERROS_IMPORTACAO_EXIBIDOS = 200
+
+def importar_produtos(request):
+    """Importa produtos e lotes de um CSV (ver importacao.py), com modo simulação."""
+    resultado = None
+    if request.method == 'POST':
+        form = ImportarProdutosForm(request.POST, request.FILES)
+        if form.is_valid():
+            arquivo = io.TextIOWrapper(form.cleaned_data['arquivo'].file, encoding='utf-8-sig', newline='')
+            try:
+                resultado = importar_arquivo(arquivo, simular=form.cleaned_data['simular'])
+            except ErroImportacao as erro:
+                form.add_error('arquivo', str(erro))
+            except UnicodeDecodeError:
+                form.add_error('arquivo', 'O arquivo precisa estar em UTF-8.')
+            else:
+                if not resultado.simulacao:
+                    messages.success(request, f'{resultado.linhas_importadas} linha(s) importada(s).')
+    else:
+        form = ImportarProdutosForm()
+
+    return render(request, 'inventario/importar_produtos.html', {
+        'form': form,
+        'resultado': resultado,
+        'erros_exibidos': resultado.erros[:ERROS_IMPORTACAO_EXIBIDOS] if resultado else [],
+    })
+
 @require_POST
 def criar_fornecedor_rapido_json(request):
     try:
@@ -788,38 +748,41 @@ def criar_fornecedor_rapido_json(request):
 
 # --- Vendas ---
 
-@ratelimit(key='ip', rate='60/m', method='GET')
-def buscar_produtos_json(request):
-    """API de busca de produtos com limite de 60 requisições por minuto por IP"""
+# As APIs api/buscar-* são views async (ORM assíncrono): sob ASGI cada tecla do
+# autocomplete espera o banco no event loop, sem ocupar um worker inteiro.
+
+@limitar_taxa(chave='user_or_ip', taxa='300/m')
+async def buscar_produtos_json(request):
+    """
+    API de busca de produtos (autocomplete), limite de 300 requisições por minuto por usuário.
+    Atendida pelo catálogo em memória (catalogo.py); com CATALOGO_EM_MEMORIA=False consulta o banco.
+    """
     termo = request.GET.get('term', '')
-    produtos = Produto.objects.annotate(
-        quantidade_total_agg=Sum('lotes__quantidade_atual')
-    ).filter(
-        nome__icontains=termo,
-        ativo=True
-    ).exclude(
-        preco_venda__isnull=True
-    )
+    limite = request.GET.get('limite')
+
+    if getattr(settings, 'CATALOGO_EM_MEMORIA', True):
+        produtos = (await aobter_catalogo()).buscar(termo, limite)
+    else:
+        produtos = [
+            linha_catalogo(produto)
+            async for produto in buscar_produtos(
+                termo, limite, Produto.objects.filter(ativo=True).exclude(preco_venda__isnull=True)
+            )
+        ]
 
     resultado = []
-    for produto in produtos:
-        estoque_atual = produto.quantidade_total_agg if produto.quantidade_total_agg else 0
-        
-        # Pega o custo FIFO (primeiro lote disponível, mais antigo)
-        lote_fifo = produto.lotes.filter(quantidade_atual__gt=0).order_by('data_entrada').first()
-        custo_fifo = lote_fifo.preco_compra if lote_fifo else Decimal('0')
-        
+    for produto_id, nome, _, preco_venda, estoque_atual, custo_fifo in produtos:
         # Adiciona indicador visual se sem estoque
         if estoque_atual == 0:
-            label = f"{produto.nome} (SEM ESTOQUE)"
+            label = f"{nome} (SEM ESTOQUE)"
         else:
-            label = f"{produto.nome} (Estoque: {estoque_atual})"
+            label = f"{nome} (Estoque: {estoque_atual})"
         
         resultado.append({
-            'id': produto.id,
+            'id': produto_id,
             'label': label,
-            'value': produto.nome,
-            'preco': str(produto.preco_venda),
+            'value': nome,
+            'preco': str(preco_venda),
             'custo': str(custo_fifo),
             'estoque': estoque_atual,
             'sem_estoque': estoque_atual == 0
@@ -827,9 +790,25 @@ def buscar_produtos_json(request):
     
     return JsonResponse(resultado, safe=False)
 
-@ratelimit(key='ip', rate='60/m', method='GET')
-def buscar_produtos_listagem_json(request):
-    """API para busca em tempo real na listagem de produtos - Limite: 60 req/min"""
+# Campos da API de listagem de produtos (margem_cor depende da configuração e é montado na view)
+CAMPOS_PRODUTO_LISTAGEM = {
+    'id': lambda produto: produto.pk,
+    'nome': lambda produto: produto.nome,
+    'quantidade_total_agg': lambda produto: produto.estoque_atual,
+    'preco_venda': lambda produto: float(produto.preco_venda or 0),
+    'custo_medio_ponderado_agg': lambda produto: float(produto.custo_medio_ponderado_agg or 0),
+    'margem_lucro_agg': lambda produto: float(produto.margem_lucro_agg) if produto.margem_lucro_agg else None,
+    'margem_cor': None,
+    'ativo': lambda produto: produto.ativo,
+    'quantidade_chegando': lambda produto: int(produto.qtd_chegando),
+}
+
+@limitar_taxa(chave='ip', taxa='60/m')
+async def buscar_produtos_listagem_json(request):
+    """
+    API para busca em tempo real na listagem de produtos - Limite: 60 req/min.
+    Paginada por cursor (?limit=, ?cursor=) e com projeção de campos (?fields=).
+    """
     query = request.GET.get('q', '')
     status = request.GET.get('status', 'ativos')
     
@@ -841,14 +820,17 @@ def buscar_produtos_listagem_json(request):
     if query:
         produtos_list = produtos_list.filter(nome__icontains=query)
     
-    config = Configuracao.objects.first()
+    campos = campos_pedidos(request, CAMPOS_PRODUTO_LISTAGEM)
+    if 'margem_cor' in campos:
+        config = await Configuracao.objects.afirst()
+        margem_ideal = config.margem_lucro_ideal if config else None
+        campos['margem_cor'] = lambda produto: (
+            'success' if margem_ideal is not None and produto.margem_lucro_agg and produto.margem_lucro_agg >= margem_ideal else 'danger'
+        )
     
     produtos = produtos_list.annotate(
-        quantidade_total_agg=Sum('lotes__quantidade_atual'),
-        custo_total=Sum(F('lotes__quantidade_atual') * F('lotes__preco_compra'))
-    ).annotate(
         custo_medio_ponderado_agg=Case(
-            When(quantidade_total_agg__gt=0, then=F('custo_total') / F('quantidade_total_agg')),
+            When(estoque_atual__gt=0, then=F('custo_estoque') / F('estoque_atual')),
             default=Value(0),
             output_field=fields.DecimalField(max_digits=10, decimal_places=2)
         )
@@ -861,30 +843,12 @@ def buscar_produtos_listagem_json(request):
             default=Value(None),
             output_field=fields.DecimalField(max_digits=5, decimal_places=2, null=True)
         )
-    ).order_by('nome')
-    
-    produtos_data = []
-    for produto in produtos:
-        margem_cor = 'success' if config and produto.margem_lucro_agg and produto.margem_lucro_agg >= config.margem_lucro_ideal else 'danger'
-        
-        produtos_data.append({
-            'id': produto.pk,
-            'nome': produto.nome,
-            'quantidade_total_agg': produto.quantidade_total_agg or 0,
-            'preco_venda': float(produto.preco_venda),
-            'custo_medio_ponderado_agg': float(produto.custo_medio_ponderado_agg or 0),
-            'margem_lucro_agg': float(produto.margem_lucro_agg) if produto.margem_lucro_agg else None,
-            'margem_cor': margem_cor,
-            'ativo': produto.ativo,
-            'quantidade_chegando': int(produto.quantidade_chegando or 0)
-        })
+    )
+    if 'quantidade_chegando' in campos:
+        produtos = anotar_quantidade_chegando(produtos)
     
-    return JsonResponse({
-        'produtos': produtos_data,
-        'total': len(produtos_data)
-    })
+    return await aresposta_paginada(request, produtos, ['nome', 'id'], campos, 'produtos')
 
-@transaction.atomic
 def criar_venda(request):
     if request.method == 'POST':
         try:
@@ -900,17 +864,26 @@ def criar_venda(request):
             if not itens_venda:
                 return JsonResponse({'sucesso': False, 'erro': 'A venda deve ter pelo menos um item.'}, status=400)
             
-            # Valida desconto antes de criar a venda
-            valor_bruto_temp = 0
-            for item_data in itens_venda:
-                produto = Produto.objects.get(id=item_data['id'])
-                valor_bruto_temp += produto.preco_venda * int(item_data['quantidade'])
-            
-            if desconto > valor_bruto_temp:
-                return JsonResponse({'sucesso': False, 'erro': 'O desconto não pode ser maior que o valor total da venda.'}, status=400)
+            itens = normalizar_itens(itens_venda)
+
+            # Refeita do zero se o banco abortar a transação por concorrência
+            @com_retentativa
+            @transaction.atomic
+            def gravar_venda():
+                # Carrega produtos e lotes da cesta de uma vez (com lock até o fim da transação)
+                produtos = carregar_estoque(item['produto_id'] for item in itens)
+
+                # Valida desconto antes de criar a venda
+                valor_bruto_temp = 0
+                for item in itens:
+                    produto = produtos.get(item['produto_id'])
+                    if produto is None:
+                        raise ValueError(f"Produto #{item['produto_id']} não encontrado.")
+                    valor_bruto_temp += (produto.preco_venda or 0) * item['quantidade']
+
+                if desconto > valor_bruto_temp:
+                    raise ValueError('O desconto não pode ser maior que o valor total da venda.')
 
-
-            with transaction.atomic():
                 # Calcular taxa de pagamento
                 config, _ = Configuracao.objects.get_or_create()
                 taxa_aplicada = config.get_taxa_pagamento(tipo_pagamento, parcelas)
@@ -924,58 +897,12 @@ def criar_venda(request):
                     taxa_aplicada=taxa_aplicada
                 )
 
-                for item_data in itens_venda:
-                    produto_id = item_data['id']
-                    quantidade_vendida = int(item_data['quantidade'])
-                    eh_brinde = item_data.get('eh_brinde', False)
-                    produto = Produto.objects.get(id=produto_id)
-
-                    if produto.quantidade_total < quantidade_vendida:
-                        raise ValueError(f'Estoque insuficiente para o produto: {produto.nome}')
-                    
-                    preco_no_ato_da_venda = Decimal('0.00') if eh_brinde else produto.preco_venda
-                    if not eh_brinde and preco_no_ato_da_venda is None:
-                        raise ValueError(f'O produto {produto.nome} está sem preço de venda definido.')
-
-                    quantidade_a_baixar = quantidade_vendida
-                    custo_total_item = Decimal('0')
-                    lotes_disponiveis = produto.lotes.filter(quantidade_atual__gt=0).order_by('data_entrada')
-                    lotes_utilizados_info = []
-
-                    for lote in lotes_disponiveis:
-                        if quantidade_a_baixar == 0:
-                            break
-                        quantidade_retirada_lote = min(lote.quantidade_atual, quantidade_a_baixar)
-                        custo_total_item += quantidade_retirada_lote * lote.preco_compra
-                        lote.quantidade_atual -= quantidade_retirada_lote
-                        lote.save()
-                        quantidade_a_baixar -= quantidade_retirada_lote
-                        
-                        # Guardar informação do lote utilizado
-                        lotes_utilizados_info.append({
-                            'lote': lote,
-                            'quantidade_retirada': quantidade_retirada_lote,
-                            'preco_compra': lote.preco_compra
-                        })
-                    
-                    item_venda = ItemVenda.objects.create(
-                        venda=venda,
-                        produto=produto,
-                        quantidade=quantidade_vendida,
-                        preco_venda_unitario=preco_no_ato_da_venda,
-                        custo_compra_total_registrado=custo_total_item,
-                        eh_brinde=eh_brinde
-                    )
-                    
-                    # Registrar os lotes utilizados
-                    for lote_info in lotes_utilizados_info:
-                        ItemVendaLote.objects.create(
-                            item_venda=item_venda,
-                            lote=lote_info['lote'],
-                            quantidade_retirada=lote_info['quantidade_retirada'],
-                            preco_compra_lote=lote_info['preco_compra']
-                        )
+                # Baixa FIFO de todos os itens em lote
+                registrar_itens_venda(venda, itens, produtos)
+                venda.atualizar_resumo()
+                return venda
 
+            venda = gravar_venda()
             return JsonResponse({'sucesso': True, 'venda_id': venda.id})
         except Exception as e:
             return JsonResponse({'sucesso': False, 'erro': str(e)}, status=400)
@@ -1008,12 +935,16 @@ def criar_venda(request):
 def listar_vendas(request):
     query = request.GET.get('q', '').strip()
     # Otimização: usa prefetch_related para evitar N+1 queries + only() para reduzir dados
+    # (valores financeiros e de devolução vêm do resumo gravado na própria venda)
     vendas = Venda.objects.prefetch_related(
-        'itens__produto',
-        'devolucoes__itens_devolvidos'
+        'itens__produto'
     ).only(
         'id', 'cliente_nome', 'data', 'tipo_venda', 
-        'status', 'desconto'
+        'status', 'desconto', 'taxa_aplicada',
+        'valor_bruto_registrado', 'meu_lucro_registrado',
+        'quantidade_vendida_registrada', 'quantidade_devolvida_registrada',
+        'quantidade_brindes_registrada', 'valor_brindes_registrado',
+        'possui_devolucao'
     )
     if query:
         filtros = Q(cliente_nome__icontains=query)
@@ -1026,17 +957,9 @@ def listar_vendas(request):
         if 'extern' in termo or 'externa' in termo or 'externo' in termo:
             filtros |= Q(tipo_venda='EXTERNA')
         vendas = vendas.filter(filtros)
-    vendas = vendas.order_by('-data')
-    
-    # Paginação (20 vendas por página)
-    paginator = Paginator(vendas, 20)
-    page_number = request.GET.get('page')
-    try:
-        page_obj = paginator.get_page(page_number)
-    except PageNotAnInteger:
-        page_obj = paginator.get_page(1)
-    except EmptyPage:
-        page_obj = paginator.get_page(paginator.num_pages)
+
+    # Paginação por cursor (20 vendas por página)
+    page_obj = paginar(request, vendas, ['-data', '-id'], 20)
     
     return render(request, 'inventario/listar_vendas.html', {
         'page_obj': page_obj,
@@ -1044,17 +967,37 @@ def listar_vendas(request):
         'query_atual': query,
     })
 
-@ratelimit(key='ip', rate='60/m', method='GET')
-def buscar_vendas_listagem_json(request):
-    """API para busca em tempo real na listagem de vendas - Limite: 60 req/min"""
+# Campos da API de listagem de vendas ('itens' faz um prefetch e só é carregado se pedido)
+CAMPOS_VENDA_LISTAGEM = {
+    'id': lambda venda: venda.id,
+    'cliente_nome': lambda venda: venda.cliente_nome or 'Cliente não informado',
+    'data': lambda venda: timezone.localtime(venda.data).strftime('%d/%m/%Y %H:%M') if venda.data else '',
+    'tipo_venda': lambda venda: venda.tipo_venda,
+    'tipo_venda_label': lambda venda: venda.get_tipo_venda_display(),
+    'valor_total': lambda venda: float(venda.valor_total),
+    'meu_lucro': lambda venda: float(venda.meu_lucro),
+    'teve_devolucao': lambda venda: venda.teve_devolucao,
+    'tipo_devolucao': lambda venda: venda.tipo_devolucao,
+    'quantidade_total_vendida': lambda venda: venda.quantidade_total_vendida,
+    'quantidade_total_devolvida': lambda venda: venda.quantidade_total_devolvida,
+    'tem_brindes': lambda venda: venda.tem_brindes,
+    'quantidade_brindes_dados': lambda venda: venda.quantidade_brindes_dados,
+    'valor_brindes_dados': lambda venda: float(venda.valor_brindes_dados or 0),
+    'itens': lambda venda: [
+        {'quantidade': item.quantidade, 'produto_nome': item.produto.nome} for item in venda.itens.all()
+    ],
+    'url_detalhes': lambda venda: reverse('inventario:detalhar_venda', kwargs={'pk': venda.pk}),
+}
+
+@limitar_taxa(chave='ip', taxa='60/m')
+async def buscar_vendas_listagem_json(request):
+    """
+    API para busca em tempo real na listagem de vendas - Limite: 60 req/min.
+    Paginada por cursor (?limit=, ?cursor=) e com projeção de campos (?fields=).
+    """
     query = request.GET.get('q', '').strip()
-    # Otimização: usa prefetch_related para evitar N+1 queries
-    vendas_qs = Venda.objects.prefetch_related(
-        'itens',
-        'itens__produto',
-        'devolucoes',
-        'devolucoes__itens_devolvidos'
-    )
+    # Valores financeiros e de devolução vêm do resumo gravado na própria venda
+    vendas_qs = Venda.objects.all()
     if query:
         filtros = Q(cliente_nome__icontains=query)
         if query.isdigit():
@@ -1065,31 +1008,43 @@ def buscar_vendas_listagem_json(request):
         if 'extern' in termo or 'externa' in termo or 'externo' in termo:
             filtros |= Q(tipo_venda='EXTERNA')
         vendas_qs = vendas_qs.filter(filtros)
-    vendas_qs = vendas_qs.order_by('-data')
-
-    vendas_data = []
-    for venda in vendas_qs:
-        vendas_data.append({
-            'id': venda.id,
-            'cliente_nome': venda.cliente_nome or 'Cliente não informado',
-            'data': timezone.localtime(venda.data).strftime('%d/%m/%Y %H:%M') if venda.data else '',
-            'tipo_venda': venda.tipo_venda,
-            'tipo_venda_label': venda.get_tipo_venda_display(),
-            'valor_total': float(venda.valor_total),
-            'meu_lucro': float(venda.meu_lucro),
-            'tipo_devolucao': venda.tipo_devolucao,
-            'quantidade_total_vendida': venda.quantidade_total_vendida,
-            'quantidade_total_devolvida': venda.quantidade_total_devolvida,
-            'tem_brindes': venda.tem_brindes if hasattr(venda, 'tem_brindes') else any(getattr(item, 'eh_brinde', False) for item in venda.itens.all()),
-            'quantidade_brindes_dados': getattr(venda, 'quantidade_brindes_dados', 0),
-            'valor_brindes_dados': float(getattr(venda, 'valor_brindes_dados', 0) or 0),
-            'url_detalhes': reverse('inventario:detalhar_venda', kwargs={'pk': venda.pk}),
-        })
 
-    return JsonResponse({
-        'vendas': vendas_data,
-        'total': len(vendas_data)
-    })
+    campos = campos_pedidos(request, CAMPOS_VENDA_LISTAGEM)
+    if 'itens' in campos:
+        vendas_qs = vendas_qs.prefetch_related(
+            Prefetch('itens', queryset=ItemVenda.objects.select_related('produto').only(
+                'id', 'venda_id', 'quantidade', 'produto__nome'
+            ))
+        )
+
+    return await aresposta_paginada(request, vendas_qs, ['-data', '-id'], campos, 'vendas')
+
+@require_http_methods(['GET'])
+def exportar_vendas(request):
+    """
+    Exporta as vendas (item a item, com os lotes consumidos) em CSV, gerado
+    durante o download. Filtros: data_inicio, data_fim (AAAA-MM-DD),
+    tipo_venda, tipo_pagamento e produto (id).
+    """
+    try:
+        data_inicio = datetime.strptime(request.GET['data_inicio'], '%Y-%m-%d').date() if request.GET.get('data_inicio') else None
+        data_fim = datetime.strptime(request.GET['data_fim'], '%Y-%m-%d').date() if request.GET.get('data_fim') else None
+        produto_id = int(request.GET['produto']) if request.GET.get('produto') else None
+    except ValueError:
+        messages.error(request, 'Filtros de exportação inválidos. Use datas no formato AAAA-MM-DD.')
+        return redirect('inventario:listar_vendas')
+
+    itens = filtrar_itens(
+        data_inicio=data_inicio,
+        data_fim=data_fim,
+        tipo_venda=request.GET.get('tipo_venda') or None,
+        tipo_pagamento=request.GET.get('tipo_pagamento') or None,
+        produto_id=produto_id,
+    )
+    resposta = StreamingHttpResponse(gerar_csv(linhas_exportacao(itens)), content_type='text/csv; charset=utf-8')
+    nome_arquivo = f"vendas_{timezone.localdate().strftime('%Y%m%d')}.csv"
+    resposta['Content-Disposition'] = f'attachment; filename="{nome_arquivo}"'
+    return resposta
 
 def detalhar_venda(request, pk):
     venda = get_object_or_404(Venda.objects.prefetch_related(
@@ -1098,7 +1053,6 @@ def detalhar_venda(request, pk):
     ), pk=pk)
     return render(request, 'inventario/detalhar_venda.html', {'venda': venda})
 
-@transaction.atomic
 def editar_venda(request, pk):
     """
     Edita uma venda existente.
@@ -1129,28 +1083,40 @@ def editar_venda(request, pk):
             if not itens_novos:
                 return JsonResponse({'sucesso': False, 'erro': 'A venda deve ter pelo menos um item.'}, status=400)
             
-            # Valida desconto
-            valor_bruto_temp = sum(
-                Produto.objects.get(id=item['id']).preco_venda * int(item['quantidade'])
-                for item in itens_novos
-                if not item.get('eh_brinde', False)
-            )
-            
-            if desconto > valor_bruto_temp:
-                return JsonResponse({'sucesso': False, 'erro': 'O desconto não pode ser maior que o valor total da venda.'}, status=400)
-
-            with transaction.atomic():
-                # 1. Restaurar estoque dos itens antigos
-                for item_antigo in venda.itens.all():
-                    # Restaurar lotes FIFO utilizados
-                    for lote_usado in item_antigo.lotes_utilizados.all():
-                        lote_usado.lote.quantidade_atual += lote_usado.quantidade_retirada
-                        lote_usado.lote.save()
+            itens = normalizar_itens(itens_novos, aceitar_preco_personalizado=True)
+
+            # Refeita do zero se o banco abortar a transação por concorrência
+            @com_retentativa
+            @transaction.atomic
+            def gravar_edicao():
+                # Trava a venda: uma devolução ou edição simultânea espera esta terminar
+                venda = Venda.objects.select_for_update().filter(pk=pk).first()
+                if venda is None or venda.possui_devolucao:
+                    raise ValueError('Não é possível editar vendas que já possuem devoluções registradas.')
+
+                # 1. Restaurar estoque dos itens antigos aos lotes FIFO utilizados
+                restaurar_lotes_venda(venda)
+                
+                # 2. Carregar produtos e lotes da nova cesta (já com o estoque restaurado)
+                produtos = carregar_estoque(item['produto_id'] for item in itens)
+                
+                # Valida desconto
+                valor_bruto_temp = 0
+                for item in itens:
+                    produto = produtos.get(item['produto_id'])
+                    if produto is None:
+                        raise ValueError(f"Produto #{item['produto_id']} não encontrado.")
+                    if not item['eh_brinde']:
+                        valor_bruto_temp += (produto.preco_venda or 0) * item['quantidade']
+                
+                if desconto > valor_bruto_temp:
+                    raise ValueError('O desconto não pode ser maior que o valor total da venda.')
                 
-                # 2. Deletar itens antigos (em cascata deleta os lotes_utilizados)
+                # 3. Deletar itens antigos (em cascata deleta os lotes_utilizados)
+                produtos_antigos = set(venda.itens.values_list('produto_id', flat=True))
                 venda.itens.all().delete()
                 
-                # 3. Atualizar dados da venda
+                # 4. Atualizar dados da venda
                 config, _ = Configuracao.objects.get_or_create()
                 taxa_aplicada = config.get_taxa_pagamento(tipo_pagamento, parcelas)
                 
@@ -1162,65 +1128,13 @@ def editar_venda(request, pk):
                 venda.taxa_aplicada = taxa_aplicada
                 venda.save()
                 
-                # 4. Adicionar novos itens
-                for item_data in itens_novos:
-                    produto_id = item_data['id']
-                    quantidade_vendida = int(item_data['quantidade'])
-                    eh_brinde = item_data.get('eh_brinde', False)
-                    preco_personalizado = item_data.get('preco_personalizado')
-                    
-                    produto = Produto.objects.get(id=produto_id)
-
-                    if produto.quantidade_total < quantidade_vendida:
-                        raise ValueError(f'Estoque insuficiente para o produto: {produto.nome}')
-                    
-                    # Usar preço personalizado se fornecido, senão usar o preço do produto
-                    if preco_personalizado is not None:
-                        preco_no_ato_da_venda = Decimal(str(preco_personalizado)) if not eh_brinde else Decimal('0.00')
-                    else:
-                        preco_no_ato_da_venda = Decimal('0.00') if eh_brinde else produto.preco_venda
-                    
-                    if not eh_brinde and preco_no_ato_da_venda is None:
-                        raise ValueError(f'O produto {produto.nome} está sem preço de venda definido.')
-
-                    quantidade_a_baixar = quantidade_vendida
-                    custo_total_item = Decimal('0')
-                    lotes_disponiveis = produto.lotes.filter(quantidade_atual__gt=0).order_by('data_entrada')
-                    lotes_utilizados_info = []
-
-                    for lote in lotes_disponiveis:
-                        if quantidade_a_baixar == 0:
-                            break
-                        quantidade_retirada_lote = min(lote.quantidade_atual, quantidade_a_baixar)
-                        custo_total_item += quantidade_retirada_lote * lote.preco_compra
-                        lote.quantidade_atual -= quantidade_retirada_lote
-                        lote.save()
-                        quantidade_a_baixar -= quantidade_retirada_lote
-                        
-                        lotes_utilizados_info.append({
-                            'lote': lote,
-                            'quantidade_retirada': quantidade_retirada_lote,
-                            'preco_compra': lote.preco_compra
-                        })
-                    
-                    item_venda = ItemVenda.objects.create(
-                        venda=venda,
-                        produto=produto,
-                        quantidade=quantidade_vendida,
-                        preco_venda_unitario=preco_no_ato_da_venda,
-                        custo_compra_total_registrado=custo_total_item,
-                        eh_brinde=eh_brinde
-                    )
-                    
-                    # Registrar os lotes utilizados
-                    for lote_info in lotes_utilizados_info:
-                        ItemVendaLote.objects.create(
-                            item_venda=item_venda,
-                            lote=lote_info['lote'],
-                            quantidade_retirada=lote_info['quantidade_retirada'],
-                            preco_compra_lote=lote_info['preco_compra']
-                        )
+                # 5. Adicionar novos itens com baixa FIFO em lote
+                registrar_itens_venda(venda, itens, produtos)
+                venda.atualizar_resumo()
+                # Produtos que saíram da venda podem ter outra última venda
+                recalcular_ultima_venda(produtos_antigos - set(produtos))
 
+            gravar_edicao()
             return JsonResponse({'sucesso': True, 'venda_id': venda.id})
         except Exception as e:
             return JsonResponse({'sucesso': False, 'erro': str(e)}, status=400)
@@ -1254,7 +1168,6 @@ def editar_venda(request, pk):
     return render(request, 'inventario/editar_venda.html', context)
 
 @require_POST
-@transaction.atomic
 def excluir_venda(request, pk):
     """
     Exclui uma venda e restaura o estoque aos lotes FIFO originais.
@@ -1271,23 +1184,34 @@ def excluir_venda(request, pk):
         messages.error(request, 'Não é possível excluir vendas que já possuem devoluções registradas. Exclua as devoluções primeiro.')
         return redirect('inventario:detalhar_venda', pk=pk)
     
+    # Guardar informações antes de excluir
+    venda_id = venda.id
+    cliente_nome = venda.cliente_nome or 'Cliente não informado'
+
+    # Refeita do zero se o banco abortar a transação por concorrência
+    @com_retentativa
+    @transaction.atomic
+    def excluir():
+        # Trava a venda: uma devolução ou edição simultânea espera esta terminar
+        venda = Venda.objects.select_for_update().filter(pk=pk).first()
+        if venda is None:
+            raise ValueError('A venda já foi excluída.')
+        if venda.possui_devolucao:
+            raise ValueError('A venda possui devoluções registradas.')
+
+        # Restaurar estoque aos lotes FIFO originais
+        restaurar_lotes_venda(venda)
+
+        # Excluir a venda (em cascata exclui itens e lotes_utilizados)
+        data_venda = venda.data
+        produto_ids = set(venda.itens.values_list('produto_id', flat=True))
+        venda.delete()
+        atualizar_vendas_diarias([data_venda])
+        recalcular_ultima_venda(produto_ids)
+
     try:
-        with transaction.atomic():
-            # Restaurar estoque aos lotes FIFO originais
-            for item in venda.itens.all():
-                # Restaurar lotes FIFO utilizados
-                for lote_usado in item.lotes_utilizados.all():
-                    lote_usado.lote.quantidade_atual += lote_usado.quantidade_retirada
-                    lote_usado.lote.save()
-            
-            # Guardar informações antes de excluir
-            venda_id = venda.id
-            cliente_nome = venda.cliente_nome or 'Cliente não informado'
-            
-            # Excluir a venda (em cascata exclui itens e lotes_utilizados)
-            venda.delete()
-            
-            messages.success(request, f'Venda #{venda_id} ({cliente_nome}) foi excluída com sucesso e o estoque foi restaurado.')
+        excluir()
+        messages.success(request, f'Venda #{venda_id} ({cliente_nome}) foi excluída com sucesso e o estoque foi restaurado.')
     except Exception as e:
         messages.error(request, f'Erro ao excluir a venda: {str(e)}')
         return redirect('inventario:detalhar_venda', pk=pk)
@@ -1306,7 +1230,7 @@ def listar_devolucoes(request):
             'itens_devolvidos',
             'itens_devolvidos__item_venda_original',
             'itens_devolvidos__item_venda_original__produto'
-        ).order_by('-data')
+        )
         mensagem_filtro = f"Exibindo devoluções para a Venda #{venda_id}"
     else:
         devolucoes = Devolucao.objects.select_related(
@@ -1315,18 +1239,11 @@ def listar_devolucoes(request):
             'itens_devolvidos',
             'itens_devolvidos__item_venda_original',
             'itens_devolvidos__item_venda_original__produto'
-        ).all().order_by('-data')
+        ).all()
         mensagem_filtro = None
     
-    # Paginação (15 devoluções por página)
-    paginator = Paginator(devolucoes, 15)
-    page_number = request.GET.get('page')
-    try:
-        page_obj = paginator.get_page(page_number)
-    except PageNotAnInteger:
-        page_obj = paginator.get_page(1)
-    except EmptyPage:
-        page_obj = paginator.get_page(paginator.num_pages)
+    # Paginação por cursor (15 devoluções por página)
+    page_obj = paginar(request, devolucoes, ['-data', '-id'], 15)
 
     context = {
         'page_obj': page_obj,
@@ -1346,87 +1263,35 @@ def detalhar_devolucao(request, pk):
     }
     return render(request, 'inventario/detalhar_devolucao.html', context)
 
-@transaction.atomic
 def registrar_devolucao(request, venda_pk):
-    venda = get_object_or_404(Venda, pk=venda_pk)
-
     if request.method == 'POST':
-        devolucao = Devolucao.objects.create(
-            venda_original=venda,
-            motivo=request.POST.get('motivo', '')
-        )
-        
-        itens_devolvidos_dados = []
-        houve_devolucao = False
-
-        for item_venda in venda.itens.all():
-            input_name = f'item_{item_venda.id}'
-            quantidade_a_devolver = int(request.POST.get(input_name, 0))
+        # Devolução de todos os itens (estorno total) ou das quantidades informadas
+        devolver_tudo = bool(request.POST.get('devolver_tudo'))
+        try:
+            quantidades = {}
+            if not devolver_tudo:
+                for campo, valor in request.POST.items():
+                    if campo.startswith('item_') and campo[5:].isdigit():
+                        quantidades[int(campo[5:])] = int(valor or 0)
+            devolucao = registrar_devolucao_venda(
+                venda_pk, quantidades, motivo=request.POST.get('motivo', ''), devolver_tudo=devolver_tudo
+            )
+        except Venda.DoesNotExist:
+            raise Http404('Venda não encontrada.')
+        except ValueError as erro:
+            messages.error(request, str(erro))
+            return redirect('inventario:registrar_devolucao', venda_pk=venda_pk)
 
-            if quantidade_a_devolver > 0:
-                houve_devolucao = True
-                
-                # Validação
-                total_ja_devolvido = ItemDevolucao.objects.filter(item_venda_original=item_venda).aggregate(Sum('quantidade'))['quantidade__sum'] or 0
-                if quantidade_a_devolver > (item_venda.quantidade - total_ja_devolvido):
-                    messages.error(request, f"Quantidade a devolver para '{item_venda.produto.nome}' é maior que a permitida.")
-                    return redirect('inventario:registrar_devolucao', venda_pk=venda.pk)
-
-                itens_devolvidos_dados.append({
-                    'item_venda_original': item_venda,
-                    'quantidade': quantidade_a_devolver
-                })
-        
-        if not houve_devolucao:
+        if devolucao is None:
             messages.warning(request, "Nenhum item foi selecionado para devolução.")
-            devolucao.delete() # Remove a devolução vazia
-            return redirect('inventario:registrar_devolucao', venda_pk=venda.pk)
+            return redirect('inventario:registrar_devolucao', venda_pk=venda_pk)
 
-        # Processar a devolução
-        for dados in itens_devolvidos_dados:
-            item_devolucao = ItemDevolucao.objects.create(devolucao=devolucao, **dados)
-            
-            # Restaurar estoque aos lotes FIFO originais (na mesma ordem FIFO)
-            item_venda_original = dados['item_venda_original']
-            quantidade_a_devolver = dados['quantidade']
-            
-            # Buscar os lotes utilizados na venda original (mesma ordem FIFO)
-            lotes_utilizados = item_venda_original.lotes_utilizados.all().order_by('id')
-            
-            if lotes_utilizados.exists():
-                # Devolver aos lotes originais
-                for lote_usado in lotes_utilizados:
-                    if quantidade_a_devolver <= 0:
-                        break
-                    
-                    # Calcular quanto devolver para este lote
-                    quantidade_devolver_lote = min(quantidade_a_devolver, lote_usado.quantidade_retirada)
-                    
-                    # Restaurar ao lote original
-                    lote_usado.lote.quantidade_atual += quantidade_devolver_lote
-                    lote_usado.lote.save()
-                    
-                    quantidade_a_devolver -= quantidade_devolver_lote
-            else:
-                # Fallback: se não houver rastreamento FIFO (vendas antigas), usar lote mais recente
-                produto = item_venda_original.produto
-                lote_mais_recente = produto.lotes.order_by('-data_entrada').first()
-                if lote_mais_recente:
-                    lote_mais_recente.quantidade_atual += quantidade_a_devolver
-                    lote_mais_recente.save()
-        
         messages.success(request, "Devolução registrada com sucesso e estoque atualizado.")
         return redirect('inventario:listar_devolucoes')
 
     # Lógica para o GET (exibição inicial)
-    itens_venda_com_max_devolucao = []
-    for item in venda.itens.all():
-        total_ja_devolvido = ItemDevolucao.objects.filter(item_venda_original=item).aggregate(Sum('quantidade'))['quantidade__sum'] or 0
-        max_para_devolver = item.quantidade - total_ja_devolvido
-        itens_venda_com_max_devolucao.append({
-            'item': item,
-            'max_para_devolver': max_para_devolver
-        })
+    venda = get_object_or_404(Venda, pk=venda_pk)
+    itens_venda_com_max_devolucao = itens_para_devolucao(venda)
 
     context = {
         'venda': venda,
@@ -1441,22 +1306,17 @@ def listar_produtos_chegando(request):
     produtos_chegando = ProdutoChegando.objects.filter(incluido_estoque=False)
     if query:
         produtos_chegando = produtos_chegando.filter(nome__icontains=query)
-    produtos_chegando = produtos_chegando.order_by('-data_compra')
-    
-    # Paginação (20 produtos por página)
-    paginator = Paginator(produtos_chegando, 20)
-    page_number = request.GET.get('page')
-    try:
-        page_obj = paginator.get_page(page_number)
-    except PageNotAnInteger:
-        page_obj = paginator.get_page(1)
-    except EmptyPage:
-        page_obj = paginator.get_page(paginator.num_pages)
+
+    # Paginação por cursor (20 produtos por página)
+    page_obj = paginar(request, produtos_chegando, ['-data_compra', '-id'], 20)
     
     return render(request, 'inventario/listar_produtos_chegando.html', {
         'page_obj': page_obj,
         'produtos_chegando': page_obj,  # Mantém compatibilidade com template
         'query_atual': query,
+        'fornecedores_pendentes': Fornecedor.objects.filter(
+            produtos_chegando__incluido_estoque=False
+        ).distinct().order_by('nome'),
     })
 
 def criar_produto_chegando(request):
@@ -1584,7 +1444,7 @@ def incluir_no_estoque(request, pk):
                     fornecedor = produto.fornecedor
             else:
                 # Verifica se já existe produto com esse nome
-                produto_existente = Produto.objects.filter(nome__iexact=produto_chegando.nome, ativo=True).first()
+                produto_existente = Produto.objects.filter(nome_normalizado=produto_chegando.nome_normalizado, ativo=True).first()
                 
                 if produto_existente:
                     # Adiciona lote ao produto existente
@@ -1602,12 +1462,7 @@ def incluir_no_estoque(request, pk):
                     )
             
             # Cria lote
-            Lote.objects.create(
-                produto=produto,
-                quantidade_inicial=produto_chegando.quantidade,
-                quantidade_atual=produto_chegando.quantidade,
-                preco_compra=produto_chegando.preco_compra
-            )
+            criar_lote(produto, produto_chegando.quantidade, produto_chegando.preco_compra)
             
             # Marca como incluído
             produto_chegando.incluido_estoque = True
@@ -1632,6 +1487,49 @@ def incluir_no_estoque(request, pk):
         'produto_vinculado': produto_vinculado
     })
 
+@require_POST
+def receber_produtos_chegando(request):
+    """
+    Inclui vários produtos chegando no estoque de uma vez (ver recebimento.py).
+    Aceita o formulário da listagem (ids ou fornecedor) ou JSON
+    {"ids": [...]} / {"fornecedor_id": N}, com "precos" opcional {id: preço}
+    para os produtos que forem criados.
+    """
+    resposta_json = request.content_type == 'application/json'
+    try:
+        if resposta_json:
+            dados = json.loads(request.body)
+            ids = dados.get('ids')
+            fornecedor_id = dados.get('fornecedor_id')
+            precos = {int(pk): preco for pk, preco in (dados.get('precos') or {}).items()}
+        else:
+            ids = request.POST.getlist('ids') or None
+            fornecedor_id = request.POST.get('fornecedor_id') or None
+            precos = None
+        ids = [int(pk) for pk in ids] if ids is not None else None
+        fornecedor_id = int(fornecedor_id) if fornecedor_id is not None else None
+        recebidos, criados = receber_pendentes(ids=ids, fornecedor_id=fornecedor_id, precos=precos)
+    except Exception as e:
+        if resposta_json:
+            return JsonResponse({'sucesso': False, 'erro': str(e)}, status=400)
+        messages.error(request, f'Erro ao receber os produtos: {e}')
+        return redirect('inventario:listar_produtos_chegando')
+
+    if resposta_json:
+        return JsonResponse({
+            'sucesso': True,
+            'recebidos': [chegando.pk for chegando in recebidos],
+            'produtos_criados': [produto.pk for produto in criados],
+        })
+    if not recebidos:
+        messages.warning(request, 'Nenhum produto pendente selecionado.')
+    else:
+        messages.success(request, f'{len(recebidos)} produto(s) incluído(s) no estoque.')
+        sem_preco = [produto.nome for produto in criados if produto.preco_venda is None]
+        if sem_preco:
+            messages.warning(request, f"Produtos criados sem preço de venda: {', '.join(sem_preco)}.")
+    return redirect('inventario:listar_produtos_chegando')
+
 
 # --- Configurações ---
 
@@ -1702,55 +1600,15 @@ def retornar_item_ao_estoque(request, item_id):
     if item_devolucao.devolvido_ao_estoque:
         messages.warning(request, 'Este item já foi retornado ao estoque.')
         return redirect('inventario:detalhar_devolucao', pk=item_devolucao.devolucao.pk)
-    
+
     try:
-        with transaction.atomic():
-            # Pega o produto e item de venda original
-            produto = item_devolucao.item_venda_original.produto
-            item_venda = item_devolucao.item_venda_original
-            quantidade_a_devolver = item_devolucao.quantidade
-            
-            # Buscar os lotes utilizados na venda original (mesma ordem FIFO)
-            lotes_utilizados = item_venda.lotes_utilizados.all().order_by('id')
-            
-            if lotes_utilizados.exists():
-                # Devolver aos lotes originais
-                for lote_usado in lotes_utilizados:
-                    if quantidade_a_devolver <= 0:
-                        break
-                    
-                    # Calcular quanto devolver para este lote
-                    quantidade_devolver_lote = min(quantidade_a_devolver, lote_usado.quantidade_retirada)
-                    
-                    # Restaurar ao lote original
-                    lote_usado.lote.quantidade_atual += quantidade_devolver_lote
-                    lote_usado.lote.save()
-                    
-                    quantidade_a_devolver -= quantidade_devolver_lote
-            else:
-                # Fallback: se não houver rastreamento FIFO (vendas antigas), criar novo lote
-                if item_venda.custo_compra_total_registrado and item_venda.quantidade > 0:
-                    preco_compra_unitario = item_venda.custo_compra_total_registrado / item_venda.quantidade
-                else:
-                    preco_compra_unitario = Decimal('0.00')
-                
-                Lote.objects.create(
-                    produto=produto,
-                    quantidade_inicial=item_devolucao.quantidade,
-                    quantidade_atual=item_devolucao.quantidade,
-                    preco_compra=preco_compra_unitario,
-                    data_entrada=timezone.now()
-                )
-            
-            # Marca o item como devolvido ao estoque
-            item_devolucao.devolvido_ao_estoque = True
-            item_devolucao.data_retorno_estoque = timezone.now()
-            item_devolucao.save()
-            
+        if retornar_ao_estoque([item_devolucao.pk]):
             messages.success(
-                request, 
-                f'{item_devolucao.quantidade} unidade(s) de "{produto.nome}" retornada(s) aos lotes originais com sucesso!'
+                request,
+                f'{item_devolucao.quantidade} unidade(s) de "{item_devolucao.item_venda_original.produto.nome}" retornada(s) aos lotes originais com sucesso!'
             )
+        else:
+            messages.warning(request, 'Este item já foi retornado ao estoque.')
     except Exception as e:
         messages.error(request, f'Erro ao retornar item ao estoque: {str(e)}')
     
@@ -1759,9 +1617,22 @@ def retornar_item_ao_estoque(request, item_id):
 
 # --- API de Busca para Devoluções ---
 
-@ratelimit(key='ip', rate='60/m', method='GET')
-def buscar_devolucoes_listagem_json(request):
-    """API para busca em tempo real na listagem de devoluções - Limite: 60 req/min"""
+# Campos da API de listagem de devoluções
+CAMPOS_DEVOLUCAO_LISTAGEM = {
+    'id': lambda dev: dev.id,
+    'data': lambda dev: timezone.localtime(dev.data).strftime('%d/%m/%Y %H:%M'),
+    'venda_id': lambda dev: dev.venda_original_id,
+    'cliente': lambda dev: dev.venda_original.cliente_nome or 'Sem nome',
+    'valor_total': lambda dev: float(dev.valor_total_agg),
+    'motivo': lambda dev: dev.motivo or '',
+}
+
+@limitar_taxa(chave='ip', taxa='60/m')
+async def buscar_devolucoes_listagem_json(request):
+    """
+    API para busca em tempo real na listagem de devoluções - Limite: 60 req/min.
+    Paginada por cursor (?limit=, ?cursor=) e com projeção de campos (?fields=).
+    """
     query = request.GET.get('q', '').strip()
     
     devolucoes_list = Devolucao.objects.all().select_related('venda_original')
@@ -1774,21 +1645,18 @@ def buscar_devolucoes_listagem_json(request):
             Q(itens_devolvidos__item_venda_original__produto__nome__icontains=query)
         ).distinct()
     
-    devolucoes_list = devolucoes_list.order_by('-data')
-    
-    # Serializa os dados
-    devolucoes_data = []
-    for dev in devolucoes_list:
-        devolucoes_data.append({
-            'id': dev.id,
-            'data': timezone.localtime(dev.data).strftime('%d/%m/%Y %H:%M'),
-            'venda_id': dev.venda_original.id,
-            'cliente': dev.venda_original.cliente_nome or 'Sem nome',
-            'valor_total': float(dev.valor_total_restituido),
-            'motivo': dev.motivo or '',
-        })
+    campos = campos_pedidos(request, CAMPOS_DEVOLUCAO_LISTAGEM)
+    if 'valor_total' in campos:
+        # Subquery em vez de Sum no join para não multiplicar pelo filtro por produto
+        devolucoes_list = devolucoes_list.annotate(
+            valor_total_agg=Coalesce(Subquery(
+                ItemDevolucao.objects.filter(devolucao=OuterRef('pk')).order_by().values('devolucao').annotate(
+                    total=Sum(F('quantidade') * F('item_venda_original__preco_venda_unitario'))
+                ).values('total')[:1]
+            ), Value(Decimal('0.00')), output_field=fields.DecimalField(max_digits=12, decimal_places=2))
+        )
     
-    return JsonResponse({'devolucoes': devolucoes_data})
+    return await aresposta_paginada(request, devolucoes_list, ['-data', '-id'], campos, 'devolucoes')
 
 
 # --- PWA Support ---
@@ -1803,6 +1671,95 @@ def service_worker(request):
     return render(request, 'inventario/sw.js', content_type='application/javascript')
 
 
+# --- Health checks (isentos de login) ---
+
+# Depois que o banco não tem migrations pendentes, continua assim enquanto o processo viver
+_migracoes_aplicadas = False
+
+
+def _migracoes_pendentes():
+    global _migracoes_aplicadas
+    if _migracoes_aplicadas:
+        return []
+    from django.db.migrations.executor import MigrationExecutor
+    executor = MigrationExecutor(connection)
+    plano = executor.migration_plan(executor.loader.graph.leaf_nodes())
+    pendentes = [f'{migration.app_label}.{migration.name}' for migration, _ in plano]
+    _migracoes_aplicadas = not pendentes
+    return pendentes
+
+
+@require_http_methods(['GET', 'HEAD'])
+def healthz(request):
+    """Liveness: responde sem tocar no banco nem na sessão"""
+    return JsonResponse({'status': 'ok'})
+
+
+@require_http_methods(['GET', 'HEAD'])
+def readyz(request):
+    """
+    Readiness: ping no banco (latência e reaproveitamento da conexão sob CONN_MAX_AGE),
+    migrations pendentes e acesso ao cache. Retorna 503 se algum item falhar.
+    """
+    resultado = {'status': 'ok'}
+
+    conexao_reutilizada = connection.connection is not None
+    inicio = time.perf_counter()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+        resultado['banco'] = {
+            'ok': True,
+            'latencia_ms': round((time.perf_counter() - inicio) * 1000, 2),
+            'conexao_reutilizada': conexao_reutilizada,
+            'conn_max_age': connection.settings_dict.get('CONN_MAX_AGE'),
+        }
+    except Exception as e:
+        resultado['banco'] = {'ok': False, 'erro': str(e)}
+
+    if resultado['banco']['ok']:
+        try:
+            pendentes = _migracoes_pendentes()
+            resultado['migrations'] = {'ok': not pendentes, 'pendentes': pendentes}
+        except Exception as e:
+            resultado['migrations'] = {'ok': False, 'erro': str(e)}
+
+    inicio = time.perf_counter()
+    try:
+        cache.set('readyz:ping', 1, timeout=10)
+        cache_ok = cache.get('readyz:ping') == 1
+        resultado['cache'] = {'ok': cache_ok, 'latencia_ms': round((time.perf_counter() - inicio) * 1000, 2)}
+    except Exception as e:
+        resultado['cache'] = {'ok': False, 'erro': str(e)}
+
+    verificacoes = [resultado['banco'], resultado.get('migrations', {'ok': False}), resultado['cache']]
+    if not all(verificacao['ok'] for verificacao in verificacoes):
+        resultado['status'] = 'erro'
+    return JsonResponse(resultado, status=200 if resultado['status'] == 'ok' else 503)
+
+
+@require_http_methods(['GET', 'POST'])
+def painel_desempenho(request):
+    """
+    Resumo da instrumentação de queries (desempenho.py) deste processo, só para staff.
+    POST zera as amostras.
+    """
+    if not request.user.is_staff:
+        raise PermissionDenied
+    if request.method == 'POST':
+        desempenho.zerar()
+        messages.success(request, 'Amostras de desempenho zeradas.')
+        return redirect('inventario:painel_desempenho')
+    return render(request, 'inventario/painel_desempenho.html', {
+        'instrumentacao_ativa': settings.PERF_INSTRUMENTACAO,
+        'orcamento_padrao': settings.PERF_ORCAMENTO_QUERIES,
+        'amostras_por_view': settings.PERF_AMOSTRAS,
+        'linhas': desempenho.resumo(),
+        'cache_dashboard': estatisticas_cache_dashboard(),
+    })
+
+
 # --- Análise de Tendências e Previsão de Estoque ---
 
 def analise_tendencias(request):
@@ -1810,8 +1767,6 @@ def analise_tendencias(request):
     Análise de tendências de vendas e previsão de necessidade de reposição de estoque.
     Calcula médias móveis, detecta sazonalidade e sugere reposições baseadas em histórico.
     """
-    from collections import defaultdict
-    from statistics import mean, stdev
     import logging
     import traceback
     
@@ -1828,8 +1783,10 @@ def analise_tendencias(request):
 
 def _analise_tendencias_impl(request):
     """Implementação interna da análise de tendências"""
-    from collections import defaultdict
-    from statistics import mean, stdev
+    if request.method == 'POST':
+        total = recalcular_previsoes()
+        messages.success(request, f'Previsões recalculadas para {total} produto(s).')
+        return redirect('inventario:analise_tendencias')
     
     hoje = timezone.localtime(timezone.now()).date()
     
@@ -1837,211 +1794,22 @@ def _analise_tendencias_impl(request):
     config, _ = Configuracao.objects.get_or_create()
     dias_analise = config.dias_analise_tendencias
     
-    # Período de análise
-    data_inicio_analise = hoje - timedelta(days=dias_analise - 1)
-    
-    # Otimização: Buscar todos os produtos ativos com quantidade_chegando anotada
-    from django.db.models.functions import Coalesce
-    produtos = Produto.objects.filter(ativo=True).annotate(
-        qtd_chegando=Coalesce(
-            Subquery(
-                ProdutoChegando.objects.filter(
-                    produto_existente=OuterRef('pk'),
-                    incluido_estoque=False
-                ).values('produto_existente').annotate(
-                    total=Sum('quantidade')
-                ).values('total')
-            ),
-            0
-        )
-    ).prefetch_related('lotes')
+    # Otimização: ler as previsões pré-calculadas (comando recalcular_previsoes)
+    analises_produtos, previsoes_calculadas_em, dias_previsoes = analises_do_snapshot()
     
-    analises_produtos = []
+    if analises_produtos and dias_previsoes == dias_analise:
+        data_fim_analise = timezone.localtime(previsoes_calculadas_em).date()
+    else:
+        # Snapshot vazio ou calculado com outro período: calcula na hora
+        data_fim_analise = hoje
+        previsoes_calculadas_em = None
+        analises_produtos = analisar_produtos(hoje - timedelta(days=dias_analise - 1), dias_analise)
     
-    for produto in produtos:
-        # Histórico de vendas diárias dos últimos dias configurados
-        vendas_diarias = defaultdict(int)
-        
-        # Buscar todas as vendas do produto no período (com select_related para otimizar)
-        itens_vendidos = ItemVenda.objects.filter(
-            produto=produto,
-            venda__data__gte=data_inicio_analise,
-            venda__status='CONCLUIDA',
-            eh_brinde=False  # Não contar brindes
-        ).select_related('venda')
-        
-        # Preencher vendas diárias
-        for item in itens_vendidos:
-            data_venda = timezone.localtime(item.venda.data).date()
-            vendas_diarias[data_venda] += item.quantidade
-        
-        # Criar lista de vendas para todos os dias (incluindo dias sem vendas = 0)
-        vendas_lista = []
-        for i in range(dias_analise):
-            data = data_inicio_analise + timedelta(days=i)
-            vendas_lista.append(vendas_diarias.get(data, 0))
-        
-        # Se não houver vendas no período configurado, pular este produto
-        total_vendido_periodo = sum(vendas_lista)
-        if total_vendido_periodo == 0:
-            continue
-        
-        # Calcular médias móveis
-        media_movel_7_dias = mean(vendas_lista[-7:]) if len(vendas_lista) >= 7 else mean(vendas_lista)
-        media_movel_14_dias = mean(vendas_lista[-14:]) if len(vendas_lista) >= 14 else mean(vendas_lista)
-        media_movel_30_dias = mean(vendas_lista[-30:]) if len(vendas_lista) >= 30 else mean(vendas_lista)
-        
-        # Desvio padrão para entender volatilidade
-        try:
-            desvio_padrao = stdev(vendas_lista) if len(vendas_lista) > 1 else 0
-        except:
-            desvio_padrao = 0
-        
-        # Tendência: comparar segunda metade do período com primeira metade
-        # Requer pelo menos 14 dias de dados (7 dias em cada metade)
-        if len(vendas_lista) >= 14:
-            metade = len(vendas_lista) // 2
-            media_segunda_metade = mean(vendas_lista[metade:])
-            media_primeira_metade = mean(vendas_lista[:metade])
-            
-            if media_primeira_metade > 0:
-                variacao_percentual = ((media_segunda_metade - media_primeira_metade) / media_primeira_metade) * 100
-            else:
-                # Se não havia vendas na primeira metade mas há na segunda
-                if media_segunda_metade > 0:
-                    variacao_percentual = 100
-                else:
-                    variacao_percentual = 0
-            
-            if variacao_percentual > 15:
-                tendencia = 'crescente'
-                tendencia_icon = '📈'
-                tendencia_class = 'success'
-            elif variacao_percentual < -15:
-                tendencia = 'decrescente'
-                tendencia_icon = '📉'
-                tendencia_class = 'danger'
-            else:
-                tendencia = 'estável'
-                tendencia_icon = '➡️'
-                tendencia_class = 'info'
-        else:
-            variacao_percentual = 0
-            tendencia = 'dados insuficientes'
-            tendencia_icon = '❓'
-            tendencia_class = 'secondary'
-        
-        # Estoque atual
-        estoque_atual = produto.quantidade_total
-        
-        # Projeção de demanda futura (baseada na média móvel de 30 dias)
-        demanda_diaria_media = media_movel_30_dias
-        
-        # Dias de cobertura atual (quantos dias o estoque atual vai durar)
-        if demanda_diaria_media > 0:
-            dias_cobertura_atual = estoque_atual / demanda_diaria_media
-        else:
-            dias_cobertura_atual = float('inf')
-        
-        # Calcular ponto de reposição
-        # Ponto de reposição = (Demanda diária * Lead Time) + Estoque de Segurança
-        # Estoque de Segurança = Demanda diária * Dias de cobertura mínima
-        lead_time = produto.lead_time_dias
-        dias_cobertura_minima = produto.dias_cobertura_minima
-        
-        # Adicionar desvio padrão ao estoque de segurança para produtos com vendas voláteis
-        estoque_seguranca = (demanda_diaria_media * dias_cobertura_minima) + (desvio_padrao * 1.5)
-        ponto_reposicao = (demanda_diaria_media * lead_time) + estoque_seguranca
-        
-        # Quantidade sugerida para compra
-        # Queremos manter estoque para: Lead Time + Cobertura Mínima + 50% extra
-        estoque_ideal = demanda_diaria_media * (lead_time + dias_cobertura_minima) * 1.5
-        
-        # Otimização: Usar quantidade_chegando já anotada no queryset
-        quantidade_chegando = produto.qtd_chegando
-        estoque_projetado = estoque_atual + quantidade_chegando
-        
-        if estoque_projetado < ponto_reposicao:
-            precisa_repor = True
-            quantidade_sugerida = max(0, estoque_ideal - estoque_projetado)
-            urgencia = 'alta' if dias_cobertura_atual < lead_time else 'média'
-            urgencia_class = 'danger' if urgencia == 'alta' else 'warning'
-        else:
-            precisa_repor = False
-            quantidade_sugerida = 0
-            urgencia = 'baixa'
-            urgencia_class = 'success'
-        
-        # Detecção de sazonalidade simples (comparar semanas)
-        # Agrupar por dia da semana
-        vendas_por_dia_semana = defaultdict(list)
-        for i, qtd in enumerate(vendas_lista):
-            data = data_inicio_analise + timedelta(days=i)
-            dia_semana = data.weekday()  # 0 = Segunda, 6 = Domingo
-            vendas_por_dia_semana[dia_semana].append(qtd)
-        
-        # Calcular média por dia da semana
-        medias_dia_semana = {}
-        dias_nomes = ['Seg', 'Ter', 'Qua', 'Qui', 'Sex', 'Sáb', 'Dom']
-        for dia in range(7):
-            if vendas_por_dia_semana[dia]:
-                medias_dia_semana[dias_nomes[dia]] = mean(vendas_por_dia_semana[dia])
-        
-        # Dia da semana com mais vendas
-        if medias_dia_semana:
-            dia_mais_vendas = max(medias_dia_semana, key=medias_dia_semana.get)
-            media_dia_mais_vendas = medias_dia_semana[dia_mais_vendas]
-        else:
-            dia_mais_vendas = 'N/A'
-            media_dia_mais_vendas = 0
-        
-        # Custo estimado da reposição sugerida
-        custo_medio = produto.custo_medio_ponderado
-        
-        # Se o custo médio ponderado for 0 (sem estoque), usar o último preço de compra conhecido
-        if custo_medio == 0:
-            ultimo_lote = produto.lotes.order_by('-data_entrada').first()
-            if ultimo_lote:
-                custo_medio = ultimo_lote.preco_compra
-        
-        custo_estimado_reposicao = Decimal(str(quantidade_sugerida)) * custo_medio if quantidade_sugerida > 0 else Decimal('0.00')
-        
-        analises_produtos.append({
-            'produto': produto,
-            'estoque_atual': estoque_atual,
-            'quantidade_chegando': quantidade_chegando,
-            'estoque_projetado': estoque_projetado,
-            'total_vendido_periodo': total_vendido_periodo,
-            'media_movel_7_dias': round(media_movel_7_dias, 2),
-            'media_movel_14_dias': round(media_movel_14_dias, 2),
-            'media_movel_30_dias': round(media_movel_30_dias, 2),
-            'desvio_padrao': round(desvio_padrao, 2),
-            'dias_cobertura_atual': round(dias_cobertura_atual, 1) if dias_cobertura_atual != float('inf') else 999,
-            'ponto_reposicao': round(ponto_reposicao, 1),
-            'precisa_repor': precisa_repor,
-            'quantidade_sugerida': round(quantidade_sugerida),
-            'urgencia': urgencia,
-            'urgencia_class': urgencia_class,
-            'tendencia': tendencia,
-            'tendencia_icon': tendencia_icon,
-            'tendencia_class': tendencia_class,
-            'variacao_percentual': round(variacao_percentual, 1),
-            'dia_mais_vendas': dia_mais_vendas,
-            'media_dia_mais_vendas': round(media_dia_mais_vendas, 2),
-            'custo_estimado_reposicao': custo_estimado_reposicao,
-            'vendas_lista': vendas_lista[-30:],  # Últimos 30 dias para gráfico
-        })
+    # Período de análise
+    data_inicio_analise = data_fim_analise - timedelta(days=dias_analise - 1)
     
     # Ordenar por urgência (alta primeiro) e depois por quantidade sugerida
-    def ordem_urgencia(item):
-        if item['urgencia'] == 'alta':
-            return (0, -item['quantidade_sugerida'])
-        elif item['urgencia'] == 'média':
-            return (1, -item['quantidade_sugerida'])
-        else:
-            return (2, -item['quantidade_sugerida'])
-    
-    analises_produtos.sort(key=ordem_urgencia)
+    ordenar_analises(analises_produtos)
     
     # Calcular totais e estatísticas gerais
     total_produtos_analisados = len(analises_produtos)
@@ -2056,8 +1824,9 @@ def _analise_tendencias_impl(request):
         'produtos_urgencia_alta': produtos_urgencia_alta,
         'custo_total_reposicao': custo_total_reposicao,
         'data_inicio_analise': data_inicio_analise,
-        'data_fim_analise': hoje,
+        'data_fim_analise': data_fim_analise,
         'dias_analise': dias_analise,
+        'previsoes_calculadas_em': previsoes_calculadas_em,
     }
     
     return render(request, 'inventario/analise_tendencias.html', context)